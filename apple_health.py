@@ -0,0 +1,55 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import pandas as pd
+
+# -------------------------------------------------------------------------
+#                          Apple Health export
+# -------------------------------------------------------------------------
+
+# Columns of the export used by the app and their types, the other columns are not read
+RUN_COLUMNS = {
+    "Date": "string",
+    "Activity": "string",
+    "Duration(s)": "float32",
+    "Distance(km)": "float32",
+    "Heart rate: Average(count/min)": "float32"
+}
+
+
+# Define a function that parses the "Date" column of the export
+def parse_end_dates(dates):
+    """
+    Returns the end date of each workout from the "Date" column of the export, which holds
+    "<start date> - <end date>", parsed as datetime for the whole column at once.
+    """
+
+    return pd.to_datetime(dates.str.split(" - ", n=1).str[1])
+
+
+# Define a function that reads the runs of the Apple Health export
+def read_runs(path, min_distance=1, chunksize=50000):
+    """
+    Reads the runs of the Apple Health workouts export chunk by chunk, so only the runs (and not every workout
+    of the export) are held in memory at once.
+
+    Parameters:
+        - path (str or file-like): the CSV export
+        - min_distance (float): runs of this distance (km) or less are dropped
+        - chunksize (int): number of rows read at once
+
+    Returns:
+        A dataframe with the columns of RUN_COLUMNS and a "day" column holding the end date of each run
+    """
+
+    chunks = []
+    with pd.read_csv(path, usecols=list(RUN_COLUMNS), dtype=RUN_COLUMNS, chunksize=chunksize) as reader:
+        for chunk in reader:
+            # Only keep runs (not counting runs <= min_distance), before parsing the dates
+            chunk = chunk.loc[(chunk["Activity"] == "Running") & (chunk["Distance(km)"] > min_distance)]
+            chunk = chunk.assign(day=parse_end_dates(chunk["Date"]))
+            chunks.append(chunk)
+
+    run = pd.concat(chunks, ignore_index=True)
+    run["Activity"] = run["Activity"].astype("category")
+    return run
@@ -0,0 +1,123 @@
+// -------------------------------------------------------------------------
+//                       Client-side date range filtering
+// -------------------------------------------------------------------------
+//
+// Used when health-app.py runs with 'clientside_filtering': the daily data of some graphs is sent once in
+// the "client_data" store and date range changes are drawn here without a request to the server.
+
+// Returns the index of the first day after 'day' in the sorted dates (the first day on or after 'day'
+// when 'after' is false), like numpy's searchsorted. Dates are ISO strings so they compare as text
+function searchDays(dates, day, after) {
+    let low = 0;
+    let high = dates.length;
+    while (low < high) {
+        const middle = (low + high) >> 1;
+        const value = dates[middle].slice(0, 10);
+        if (value < day || (after && value === day)) {
+            low = middle + 1;
+        } else {
+            high = middle;
+        }
+    }
+    return low;
+}
+
+// Returns a date as a number of days since 1970-01-01, the x values of the trend lines (see trendline.to_days)
+function toDays(date) {
+    return Date.parse(date.length > 10 ? date + "Z" : date) / 86400000;
+}
+
+// Formats a duration in seconds as "HHhMM", rounded to 10 minutes (see formatting.format_duration)
+function formatDuration(seconds) {
+    const minutes = Math.round(seconds / 600) * 10;
+    const pad = (value) => String(value).padStart(2, "0");
+    return pad(Math.floor(minutes / 60)) + "h" + pad(minutes % 60);
+}
+
+// Returns the number of points, the average and the least squares line of the points between two days,
+// from the prefix sums of the trend line (see trendline.TrendIndex.fit)
+function fitRange(trend, startDay, endDay) {
+    const start = searchDays(trend.days, startDay, false);
+    const end = searchDays(trend.days, endDay, true);
+    const [n, sx, sy, sxy, sxx] = trend.prefix.map((sums) => sums[end] - sums[start]);
+    const count = Math.round(n);
+    const fit = {average: count > 0 ? sy / count : null, line: null};
+
+    const denominator = count * sxx - sx * sx;
+    if (count >= 2 && denominator > 0) {
+        const slope = (count * sxy - sx * sy) / denominator;
+        const intercept = (sy - slope * sx) / count;
+        fit.line = {slope: slope, intercept: intercept - slope * trend.origin};
+    }
+    return fit;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    health: {
+        // Draws a graph for the date range from its daily data: the graph of the whole history drawn by the
+        // server is reused with the points, trend line, average line and y ticks of the range
+        filterFigure: function (startDate, endDate, clientData, chart) {
+            if (!clientData || !startDate || !endDate) {
+                return window.dash_clientside.no_update;
+            }
+            const data = clientData.charts[chart];
+            if (!data) {
+                return clientData.loading;
+            }
+
+            // The graph of the whole history is a message when it doesn't hold enough data: no points, trend
+            // line or average line to reuse
+            const base = data.figure;
+            if (!base.data || !base.data.length || !base.layout.shapes || !base.layout.shapes.length ||
+                !base.layout.annotations || base.layout.annotations.length < 2) {
+                return clientData.empty;
+            }
+
+            const startDay = startDate.slice(0, 10);
+            const endDay = endDate.slice(0, 10);
+            const first = searchDays(data.x, startDay, false);
+            const last = searchDays(data.x, endDay, true);
+            if (last - first < 2) {
+                return clientData.empty;
+            }
+
+            // Points of the date range
+            const x = data.x.slice(first, last);
+            const y = data.y.slice(first, last);
+            const points = Object.assign({}, data.figure.data[0], {x: x, y: y});
+            if (data.customdata) {
+                points.customdata = data.customdata.slice(first, last);
+            }
+            const traces = [points];
+
+            // Trend line from the first to the last day of the range
+            const fit = fitRange(data.trend, startDay, endDay);
+            if (fit.line) {
+                const ends = [x[0], x[x.length - 1]];
+                traces.push(Object.assign({}, data.figure.data[1], {
+                    x: ends, y: ends.map((day) => fit.line.intercept + fit.line.slope * toDays(day))
+                }));
+            }
+
+            // Average line and its annotation (the first annotation is the title of the y axis)
+            const layout = Object.assign({}, data.figure.layout);
+            layout.shapes = [Object.assign({}, layout.shapes[0], {y0: fit.average, y1: fit.average})];
+            layout.annotations = [layout.annotations[0], Object.assign({}, layout.annotations[1], {y: fit.average})];
+
+            // Durations are displayed as "HHhMM" on 7 ticks or so
+            if (data.durations) {
+                const values = y.filter((value) => value !== null);
+                const min = Math.min(...values);
+                const max = Math.max(...values);
+                const step = Math.round((max - min) / 7);
+                const tickvals = [];
+                for (let value = min; step > 0 && value < max; value += step) {
+                    tickvals.push(value);
+                }
+                layout.yaxis = Object.assign({}, layout.yaxis, {tickvals: tickvals, ticktext: tickvals.map(formatDuration)});
+            }
+
+            return {data: traces, layout: layout};
+        }
+    }
+});
@@ -0,0 +1,459 @@
+"""
+Benchmarks the loading, filtering and drawing of the dashboard on synthetic data.
+
+Generates Oura sleep documents and Apple Health exports covering several years for one or more users, serves
+them with a stubbed Oura API and Google Drive (no network access is needed), then times each stage of the app
+and prints the results as JSON, e.g.:
+
+    python benchmark.py --years 1 5 20 --users 1 4 --repeat 3 --output bench.json
+
+'--startup' reports where the time of importing the app goes instead (which modules take the longest to import).
+"""
+
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import hashlib
+import argparse
+import datetime
+import tempfile
+import subprocess
+import functools
+import statistics
+import importlib.util
+import numpy as np
+import pandas as pd
+import plotly
+import oura_sync
+from drive_cache import DriveCache
+from figure_cache import FigureCache
+from date_range import slice_days
+from trendline import TrendIndex
+
+# Folder of this file, where health-app.py is
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# -------------------------------------------------------------------------
+#                              Synthetic data
+# -------------------------------------------------------------------------
+
+
+# Define a function that generates the sleep documents returned by Oura's API
+def make_sleep_documents(first_day, days, seed=0):
+    """
+    Returns one "long_sleep" document per night (and a nap every 10 days) with the fields of Oura's API,
+    including the 5-minute HRV and heart rate series and the sleep phases.
+
+    Parameters:
+        - first_day (datetime.date): first night
+        - days (int): number of nights
+        - seed (int): seed of the random values
+
+    Returns:
+        A list of sleep documents (dict)
+    """
+
+    rng = np.random.default_rng(seed)
+    documents = []
+    for i in range(days):
+        day = (first_day + datetime.timedelta(days=i)).isoformat()
+        for sleep_type in (["long_sleep", "late_nap"] if i % 10 == 0 else ["long_sleep"]):
+            samples = int(rng.integers(80, 110))
+            bedtime = f"{day}T23:00:00+02:00"
+            hrv = rng.normal(55, 15, samples).round().tolist()
+            documents.append({
+                "id": f"{day}-{sleep_type}", "day": day, "type": sleep_type, "bedtime_start": bedtime,
+                "average_hrv": int(rng.integers(30, 90)), "lowest_heart_rate": int(rng.integers(40, 60)),
+                "total_sleep_duration": int(rng.integers(20000, 32000)),
+                "deep_sleep_duration": int(rng.integers(3000, 7000)),
+                "rem_sleep_duration": int(rng.integers(4000, 8000)),
+                "hrv": {"interval": 300.0, "items": [v if v > 20 else None for v in hrv], "timestamp": bedtime},
+                "heart_rate": {"interval": 300.0, "items": rng.integers(40, 70, samples).tolist(),
+                               "timestamp": bedtime},
+                "sleep_phase_5_min": "".join(rng.choice(list("1234"), samples)),
+                "movement_30_sec": "".join(rng.choice(list("123"), samples * 10)),
+                "readiness": {"score": int(rng.integers(60, 95)), "contributors": {"hrv_balance": 70}}
+            })
+    return documents
+
+
+# Define a function that writes a synthetic Apple Health workouts export
+def write_workouts_csv(path, first_day, days, seed=0):
+    """
+    Writes about two workouts per day of various types (a third of them runs) in the format of the
+    Health Export CSV app.
+    """
+
+    rng = np.random.default_rng(seed)
+    n = days * 2
+    start = pd.Timestamp(first_day) + pd.to_timedelta(np.sort(rng.integers(0, days * 86400, n)), unit="s")
+    duration = rng.integers(900, 5400, n)
+    end = start + pd.to_timedelta(duration, unit="s")
+    activity = rng.choice(["Running", "Cycling", "Walking", "Swimming", "Yoga", "Strength Training"], n,
+                          p=[1/3, 1/6, 1/6, 1/9, 1/9, 1/9])
+    pd.DataFrame({
+        "Date": start.strftime("%Y-%m-%d %H:%M:%S") + " - " + end.strftime("%Y-%m-%d %H:%M:%S"),
+        "Activity": activity,
+        "Duration(s)": duration,
+        "Distance(km)": (duration / 3600 * rng.uniform(6, 14, n)).round(2),
+        "Active energy(kcal)": (duration / 60 * rng.uniform(6, 12, n)).round(),
+        "Heart rate: Average(count/min)": rng.integers(110, 170, n),
+        "Heart rate: Maximum(count/min)": rng.integers(150, 195, n),
+        "Step count(count)": rng.integers(0, 15000, n),
+        "Elevation: Ascended(m)": rng.uniform(0, 300, n).round(1)
+    }).to_csv(path, index=False)
+
+
+# Define a function that writes a synthetic VO2 max export
+def write_vo2_csv(path, first_day, days, seed=0):
+    """
+    Writes one VO2 max measure every 3 days.
+    """
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(first_day, periods=days, freq="D")[::3]
+    pd.DataFrame({"Date": dates.strftime("%Y-%m-%d"),
+                  "VO2 Max(mL/min·kg)": (45 + np.cumsum(rng.normal(0, 0.2, len(dates)))).round(2)
+                  }).to_csv(path, index=False)
+
+# -------------------------------------------------------------------------
+#                          Stubbed Oura and Drive
+# -------------------------------------------------------------------------
+
+
+class StubResponse:
+    """
+    Response of 'StubSession', with the methods of 'requests.Response' used by 'oura_sync'.
+    """
+
+    def __init__(self, page):
+        self._page = page
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._page
+
+
+class StubSession:
+    """
+    Replaces the 'requests.Session' used by 'oura_sync.fetch_sleep': returns the documents of the requested
+    date range in pages of 100 documents, like Oura's API.
+    """
+
+    def __init__(self, documents, page_size=100):
+        self.documents = documents
+        self.page_size = page_size
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        rows = [d for d in self.documents if params["start_date"] <= d["day"] <= params["end_date"]]
+        offset = int(params.get("next_token", 0))
+        next_offset = offset + self.page_size
+        # Round-trip through JSON like a real response
+        page = {"data": rows[offset:next_offset], "next_token": str(next_offset) if next_offset < len(rows) else None}
+        return StubResponse(json.loads(json.dumps(page)))
+
+
+class StubFile(dict):
+    """
+    Google Drive file of 'StubDrive', with the methods of 'pydrive2.files.GoogleDriveFile' used by 'DriveCache'.
+    """
+
+    def __init__(self, metadata, source):
+        super().__init__(metadata)
+        self.source = source
+
+    def FetchMetadata(self, fields=None):
+        with open(self.source, "rb") as f:
+            self["md5Checksum"] = hashlib.md5(f.read()).hexdigest()
+        self["modifiedDate"] = datetime.datetime.fromtimestamp(os.path.getmtime(self.source)).isoformat()
+
+    def GetContentFile(self, filename):
+        shutil.copyfile(self.source, filename)
+
+
+class StubDrive:
+    """
+    Replaces the Google Drive client: serves local files by file id.
+    """
+
+    def __init__(self, files):
+        self.files = files
+
+    def CreateFile(self, metadata):
+        return StubFile(metadata, self.files[metadata["id"]])
+
+# -------------------------------------------------------------------------
+#                                Benchmark
+# -------------------------------------------------------------------------
+
+
+# Define a function that times a function
+def timed(func, repeat):
+    """
+    Calls 'func' 'repeat' times.
+
+    Returns:
+        (result of the last call, list of the durations in seconds)
+    """
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - start)
+    return result, durations
+
+
+# Keep the real function, 'load_app' replaces the module attribute
+_sync_sleep = oura_sync.sync_sleep
+
+
+# Define a function that imports the app with stubbed sources
+def load_app(users, documents, files):
+    """
+    Imports health-app.py with a 'creds' module declaring the given users, Oura's API replaced by a
+    'StubSession' and Google Drive replaced by a 'StubDrive'. The working directory must be a scratch folder.
+    """
+
+    creds = types.ModuleType("creds")
+    creds.users = users
+    sys.modules["creds"] = creds
+
+    oura_sync.sync_sleep = functools.partial(_sync_sleep, session=StubSession(documents))
+    spec = importlib.util.spec_from_file_location("health_app", os.path.join(APP_DIR, "health-app.py"))
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    app.drive = DriveCache(client=StubDrive(files))
+    return app
+
+
+# Define a function that benchmarks the app for a number of years of data and users
+def run_case(years, n_users, repeat, workdir):
+    """
+    Times each stage of the app on 'years' of synthetic data for 'n_users' users.
+
+    Returns:
+        A list of results (dict with the case, the stage, the number of rows and the durations)
+    """
+
+    days = int(years * 365.25)
+    first_day = datetime.date.today() - datetime.timedelta(days=days - 1)
+    case_dir = os.path.join(workdir, f"{years}y-{n_users}u")
+    os.makedirs(case_dir)
+    os.chdir(case_dir)
+
+    # Generate the data served by the stubs
+    documents = make_sleep_documents(first_day, days)
+    write_workouts_csv("source_workouts.csv", first_day, days)
+    write_vo2_csv("source_vo2.csv", first_day, days)
+    files = {"workouts": os.path.abspath("source_workouts.csv"), "vo2": os.path.abspath("source_vo2.csv")}
+    users = {f"user{i}": {"api_key": "stub", "file_id": "workouts", "vo2_file_id": "vo2"} for i in range(n_users)}
+    oura_sync.FIRST_DAY = first_day.isoformat()
+
+    app = load_app(users, documents, files)
+    settings = app.users["user0"]
+    os.makedirs(settings["data_dir"], exist_ok=True)
+    results = []
+
+    def record(stage, durations, rows=None):
+        results.append({"years": years, "users": n_users, "days": days, "stage": stage, "rows": rows,
+                        "min_s": round(min(durations), 6), "median_s": round(statistics.median(durations), 6)})
+
+    def record_value(stage, value):
+        results.append({"years": years, "users": n_users, "days": days, "stage": stage, "value": value})
+
+    # Parse: first sync of the Oura history (fresh store each time), then an incremental sync
+    db_path = os.path.join(settings["data_dir"], oura_sync.DB_PATH)
+
+    def cold_oura():
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        return app.load_oura(settings)
+
+    oura, durations = timed(cold_oura, repeat)
+    record("parse.oura_sync_cold", durations, len(oura))
+    _, durations = timed(lambda: app.load_oura(settings), repeat)
+    record("parse.oura_sync_incremental", durations, len(oura))
+    record_value("memory.oura_bytes_per_night", round(oura.memory_usage(deep=True).sum() / len(oura), 1))
+
+    run, durations = timed(lambda: app.load_running(settings), repeat)
+    record("parse.apple_runs", durations, len(run))
+    vo2, durations = timed(lambda: app.load_vo2(settings), repeat)
+    record("parse.vo2", durations, len(vo2))
+
+    # Filter: date ranges of the date picker, and the rollup tables
+    today = datetime.date.today()
+    ranges = {"30d": today - datetime.timedelta(days=29), "1y": today - datetime.timedelta(days=364),
+              "all": first_day}
+    for name, start in ranges.items():
+        sliced, durations = timed(lambda: slice_days(oura, start, today), repeat * 10)
+        record(f"filter.slice_days_{name}", durations, len(sliced))
+    _, durations = timed(lambda: app.source_rollups("oura", oura), repeat)
+    record("filter.rollups_oura", durations, len(oura))
+
+    # Trend lines: prefix sums once per version of the data, then a fit per date range
+    trend_index, durations = timed(lambda: TrendIndex(oura["day"], oura["average_hrv"]), repeat)
+    record("trendline.index", durations, len(oura))
+    _, durations = timed(lambda: trend_index.fit(first_day, today), repeat * 10)
+    record("trendline.fit", durations, len(oura))
+
+    # Figures: draw and serialize each graph for the whole history, outside of the figure cache
+    loader = app.user_data.get("user0")
+    while not loader.done():
+        time.sleep(0.05)
+    start_date, end_date = first_day.isoformat(), today.isoformat()
+    for chart in app.charts:
+        _, build = app.figure_job("user0", chart, start_date, end_date)
+        figure, durations = timed(build, repeat)
+        record(f"figure.build.{chart}", durations)
+        figure_json, durations = timed(figure.to_json, repeat)
+        record(f"figure.serialize.{chart}", durations, len(figure_json))
+
+    # update_output through Dash, with an empty figure cache then with the cached figures
+    client = app.app.server.test_client()
+
+    def update_all():
+        for chart in app.charts:
+            inputs = [{"id": "my-date-picker-range", "property": "start_date", "value": start_date},
+                      {"id": "my-date-picker-range", "property": "end_date", "value": end_date},
+                      {"id": "loaded_sources", "property": "data", "value": loader.versions()}]
+            # Only the graphs with dates are redrawn when zoomed
+            if app.charts[chart]["zoom"]:
+                inputs.append({"id": chart, "property": "relayoutData", "value": None})
+            payload = {"output": f"{chart}.figure", "outputs": {"id": chart, "property": "figure"},
+                       "inputs": inputs, "changedPropIds": ["my-date-picker-range.start_date"], "state": []}
+            response = client.post("/_dash-update-component", json=payload, headers={"X-Forwarded-User": "user0"})
+            assert response.status_code == 200, response.status_code
+
+    def cold_update():
+        app.figure_cache = FigureCache(max_size=256)
+        update_all()
+
+    _, durations = timed(cold_update, repeat)
+    record("update_output.all_charts_cold", durations)
+    _, durations = timed(update_all, repeat)
+    record("update_output.all_charts_cached", durations)
+
+    # Every user loading their data at the same time
+    def load_users():
+        loaders = [app.user_data.get(user) for user in users if user != "user0"]
+        while not all(user_loader.done() for user_loader in loaders):
+            time.sleep(0.01)
+
+    if n_users > 1:
+        _, durations = timed(load_users, 1)
+        record("load.other_users_concurrent", durations)
+
+    for user in users:
+        app.user_data.get(user).close()
+    return results
+
+
+# -------------------------------------------------------------------------
+#                                 Startup
+# -------------------------------------------------------------------------
+
+# Imports the app in a fresh interpreter (without users, so nothing is loaded) and prints the seconds spent
+# importing it and building its layout. The marker separates Python's own startup from the app's imports
+STARTUP_SCRIPT = """
+import sys, time, types, importlib.util
+creds = types.ModuleType("creds")
+creds.users = {{}}
+sys.modules["creds"] = creds
+sys.path.insert(0, {app_dir!r})
+spec = importlib.util.spec_from_file_location("health_app", {path!r})
+app = importlib.util.module_from_spec(spec)
+sys.stderr.write("{marker}\\n")
+start = time.perf_counter()
+spec.loader.exec_module(app)
+imported = time.perf_counter()
+app.serve_layout()
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+# Define a function that reports where the startup time of the app goes
+def startup_report(workdir, top=15):
+    """
+    Imports health-app.py in a new Python process run with '-X importtime' and returns where the time goes: the
+    time of importing the module and of building its layout, and the modules it imports (with the modules they
+    import themselves) sorted by import time.
+
+    Parameters:
+        - workdir (str): scratch folder the app is imported in
+        - top (int): number of modules reported
+
+    Returns:
+        A dict of durations in seconds
+    """
+
+    marker = "-- health-app --"
+    script = STARTUP_SCRIPT.format(app_dir=APP_DIR, path=os.path.join(APP_DIR, "health-app.py"), marker=marker)
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", script], cwd=workdir,
+                             capture_output=True, text=True, check=True)
+    import_s, layout_s = map(float, process.stdout.split()[-2:])
+
+    # Lines are "import time: <self us> | <cumulative us> | <indented module name>", the modules imported
+    # directly by the app aren't indented
+    modules = {}
+    lines = process.stderr.splitlines()
+    for line in lines[lines.index(marker) + 1:]:
+        fields = line.split("|")
+        if not line.startswith("import time:") or len(fields) != 3 or fields[2].startswith("  "):
+            continue
+        modules[fields[2].strip()] = int(fields[1]) / 1e6
+
+    slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {"import_s": import_s, "imports_s": sum(modules.values()), "layout_s": layout_s,
+            "modules_s": dict(slowest)}
+
+
+# Define the entry point of the benchmark
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--years", type=float, nargs="+", default=[1, 5, 20], help="years of history")
+    parser.add_argument("--users", type=int, nargs="+", default=[1], help="number of users")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each stage")
+    parser.add_argument("--output", help="JSON file to write, the results are printed if omitted")
+    parser.add_argument("--startup", action="store_true",
+                        help="only report where the time of importing the app goes")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="health-bench-")
+    cwd = os.getcwd()
+    results = []
+    try:
+        if args.startup:
+            results.append(startup_report(workdir))
+        else:
+            for years in args.years:
+                for n_users in args.users:
+                    results.extend(run_case(years, n_users, args.repeat, workdir))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {"date": datetime.datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0],
+                 "pandas": pd.__version__, "numpy": np.__version__, "plotly": plotly.__version__,
+                 "repeat": args.repeat},
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import numpy as np
+import pandas as pd
+from zone2 import OUTLIER_SCORE
+
+# Metrics of the Oura ring data kept in the daily table
+OURA_METRICS = ["average_hrv", "lowest_heart_rate", "total_sleep_duration", "deep_sleep_duration",
+                "rem_sleep_duration"]
+
+# Number of days a VO2 max reading is carried to the following days (readings are a few days or weeks apart)
+VO2_FILL_DAYS = 30
+
+# Numbers of days between the two metrics of the lag correlations
+LAGS = range(0, 8)
+
+# -------------------------------------------------------------------------
+#                               Daily table
+# -------------------------------------------------------------------------
+
+
+# Define a function that joins the data of every source by day
+def build_daily_table(oura, run, vo2, outliers="Performance_score", fill_days=VO2_FILL_DAYS):
+    """
+    Returns one row per calendar day from the first to the last day of the data, with the metrics of every source:
+        - the Oura metrics of the day (see 'OURA_METRICS'), the mean of the day if it has several rows
+        - "runs", "Distance(km)" and "Duration(s)": number of runs of the day and their total distance and
+          duration, 0 for days without runs
+        - "Performance": mean Zone 2 performance of the runs of the day, without the outliers
+        - "VO2 Max(mL/min·kg)": the last reading, carried forward 'fill_days' days, and "vo2_measured", True on
+          the days of a reading
+    Days follow each other without gaps, so a metric of the day after each row is read by shifting its column.
+
+    Parameters:
+        - oura (pandas.DataFrame): the Oura ring data, indexed by day (see 'date_range.index_by_day')
+        - run (pandas.DataFrame): the runs with their Zone 2 metrics (see 'zone2.add_zone2_metrics'), indexed by day
+        - vo2 (pandas.DataFrame): the VO2 max data, indexed by day
+        - outliers (str): score column of the runs whose outliers are left out of the performance
+        - fill_days (int): number of days a VO2 max reading is carried forward
+
+    Returns:
+        A dataframe with a "day" column, indexed by day like the sources (so it can be sliced with
+        'date_range.slice_days'), with float32 metrics
+    """
+
+    runs = run.groupby(level=0)
+    performance = run["Performance"].where(run[outliers].abs() < OUTLIER_SCORE)
+    sources = [
+        oura[OURA_METRICS].astype("float64").groupby(level=0).mean(),
+        pd.DataFrame({"runs": runs.size(), "Distance(km)": runs["Distance(km)"].sum(),
+                      "Duration(s)": runs["Duration(s)"].sum(),
+                      "Performance": performance.groupby(level=0).mean()}),
+        vo2[["VO2 Max(mL/min·kg)"]].astype("float64").groupby(level=0).mean()
+    ]
+
+    # Every day between the first and the last day of the sources
+    starts = [source.index[0] for source in sources if len(source)]
+    ends = [source.index[-1] for source in sources if len(source)]
+    days = pd.date_range(min(starts), max(ends), freq="D", name="date") if starts else pd.DatetimeIndex([], name="date")
+    table = pd.concat([source.reindex(days) for source in sources], axis=1)
+
+    # Days without runs ran 0 km, VO2 max readings hold until the next one (or for 'fill_days' days)
+    table[["runs", "Distance(km)", "Duration(s)"]] = table[["runs", "Distance(km)", "Duration(s)"]].fillna(0)
+    table["vo2_measured"] = table["VO2 Max(mL/min·kg)"].notna()
+    table["VO2 Max(mL/min·kg)"] = table["VO2 Max(mL/min·kg)"].ffill(limit=fill_days)
+
+    table = table.astype({column: "float32" for column in table.columns if column != "vo2_measured"})
+    table.insert(0, "day", days)
+    return table
+
+# -------------------------------------------------------------------------
+#                            Lag correlations
+# -------------------------------------------------------------------------
+
+
+class LagCorrelations:
+    """
+    Prefix sums (n, Σx, Σy, Σxy, Σx², Σy²) of the pairs made of a metric and of another metric 'lag' days later,
+    for each lag, so the correlation and the least squares line of the pairs of any date range are computed in
+    O(1) per lag once the range is located with a binary search. Pairs are dated by the day of the first metric.
+    """
+
+    def __init__(self, table, x, y, lags=LAGS):
+        """
+        Parameters:
+            - table (pandas.DataFrame): the daily table (see 'build_daily_table')
+            - x (str): column of the first metric
+            - y (str): column of the metric read 'lag' days later
+            - lags (iterable of int): numbers of days between the two metrics
+        """
+
+        self.x, self.y = x, y
+        self.days = table.index
+        self.lags = list(lags)
+        self._x = table[x].to_numpy(dtype="float64")
+        self._y = table[y].to_numpy(dtype="float64")
+
+        # Values are centered to keep the sums small and precise, the lines are moved back in 'correlations'
+        self._means = (np.nanmean(self._x) if np.isfinite(self._x).any() else 0,
+                       np.nanmean(self._y) if np.isfinite(self._y).any() else 0)
+        x_values = self._x - self._means[0]
+
+        # Prefix sums starting with 0 so the sums of the pairs of rows [i, j) are prefix[lag, :, j] - prefix[lag, :, i]
+        self._prefix = np.zeros((len(self.lags), 6, len(self._x) + 1))
+        for position, lag in enumerate(self.lags):
+            y_values = self._later(lag) - self._means[1]
+
+            # Pairs with a missing value don't contribute to the sums
+            valid = ~np.isnan(x_values) & ~np.isnan(y_values)
+            a = np.where(valid, x_values, 0)
+            b = np.where(valid, y_values, 0)
+            for row, terms in enumerate([valid.astype("float64"), a, b, a * b, a * a, b * b]):
+                np.cumsum(terms, out=self._prefix[position, row, 1:])
+
+    def _later(self, lag, start=0, end=None):
+        # Values of the second metric 'lag' days after rows [start, end), missing after the last day
+        end = len(self._y) if end is None else end
+        later = np.full(end - start, np.nan)
+        values = self._y[start + lag:end + lag]
+        later[:len(values)] = values
+        return later
+
+    def _positions(self, start_date, end_date):
+        start = self.days.searchsorted(pd.Timestamp(start_date).normalize(), side="left")
+        end = self.days.searchsorted(pd.Timestamp(end_date).normalize(), side="right")
+        return start, end
+
+    def correlations(self, start_date, end_date):
+        """
+        Returns the Pearson correlation and the least squares line of the pairs dated between start_date and
+        end_date (both included), for each lag.
+
+        Parameters:
+            - start_date (str or datetime): start of the date range
+            - end_date (str or datetime): end of the date range
+
+        Returns:
+            A dataframe with one row per lag and "lag", "pairs", "correlation", "slope" and "intercept" columns.
+            The correlation and the line are missing with less than 3 pairs or when one of the metrics doesn't vary
+        """
+
+        start, end = self._positions(start_date, end_date)
+        n, sx, sy, sxy, sxx, syy = (self._prefix[:, :, end] - self._prefix[:, :, start]).T
+        n = n.round()
+        x_spread = n * sxx - sx * sx
+        y_spread = n * syy - sy * sy
+        valid = (n >= 3) & (x_spread > 0) & (y_spread > 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = np.where(valid, (n * sxy - sx * sy) / np.sqrt(x_spread * y_spread), np.nan)
+            slope = np.where(valid, (n * sxy - sx * sy) / x_spread, np.nan)
+            intercept = (sy - slope * sx) / n
+
+        # Move the lines back to the values before centering
+        x_mean, y_mean = self._means
+        return pd.DataFrame({"lag": self.lags, "pairs": n.astype("int64"), "correlation": correlation,
+                             "slope": slope, "intercept": intercept + y_mean - slope * x_mean})
+
+    def pairs(self, start_date, end_date, lag):
+        """
+        Returns the pairs dated between start_date and end_date (both included) for one lag, without the pairs
+        with a missing value.
+
+        Returns:
+            A dataframe with the "day" of the first metric and the x and y columns of the pairs
+        """
+
+        start, end = self._positions(start_date, end_date)
+        pairs = pd.DataFrame({"day": self.days[start:end], self.x: self._x[start:end],
+                              self.y: self._later(lag, start, end)})
+        return pairs.dropna()
@@ -0,0 +1,47 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import pandas as pd
+
+# -------------------------------------------------------------------------
+#                               Date ranges
+# -------------------------------------------------------------------------
+
+
+# Define a function that indexes a dataframe by day so it can be sliced by date range
+def index_by_day(df, column):
+    """
+    Returns the dataframe sorted by the given datetime column and indexed by its normalized day
+    (time set to midnight). The column itself is kept so it can still be used to plot the data.
+
+    Parameters:
+        - df (pandas.DataFrame): the dataframe to index
+        - column (str): the datetime column holding the date of each row
+
+    Returns:
+        The sorted dataframe with a 'DatetimeIndex' named "date"
+    """
+
+    df = df.sort_values(column, kind="mergesort")
+    df.index = pd.DatetimeIndex(df[column].dt.normalize(), name="date")
+    return df
+
+
+# Define a function that returns the rows of a dataframe between two dates
+def slice_days(df, start_date, end_date):
+    """
+    Returns the rows between start_date and end_date (both included) using a binary search on the
+    sorted day index built by 'index_by_day', so the cost doesn't depend on the length of the history.
+
+    Parameters:
+        - df (pandas.DataFrame): a dataframe returned by 'index_by_day'
+        - start_date (str or datetime): start of the date range
+        - end_date (str or datetime): end of the date range
+
+    Returns:
+        The rows of the dataframe within the date range
+    """
+
+    start = df.index.searchsorted(pd.Timestamp(start_date).normalize(), side="left")
+    end = df.index.searchsorted(pd.Timestamp(end_date).normalize(), side="right")
+    return df.iloc[start:end]
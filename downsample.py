@@ -0,0 +1,93 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import numpy as np
+from trendline import to_days
+
+# -------------------------------------------------------------------------
+#                   Largest-Triangle-Three-Buckets (LTTB)
+# -------------------------------------------------------------------------
+
+
+# Define a function that selects the points to keep to draw a series with less points
+def lttb(x, y, threshold):
+    """
+    Selects 'threshold' points of a series with the Largest-Triangle-Three-Buckets algorithm: the points
+    are split into buckets and the point of each bucket forming the largest triangle with the point kept
+    in the previous bucket and the average of the next bucket is kept. Peaks and dips are kept, so the
+    downsampled series looks like the original one.
+
+    Parameters:
+        - x (array-like of float): x values, sorted in ascending order
+        - y (array-like of float): y values, without missing values
+        - threshold (int): number of points to keep
+
+    Returns:
+        A NumPy array with the positions of the points to keep, in ascending order
+    """
+
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # The first and last points are always kept, the others are split into threshold - 2 buckets
+    edges = np.arange(threshold - 1) * (n - 2) // (threshold - 2) + 1
+
+    selected = np.empty(threshold, dtype="int64")
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Average of the next bucket (the last point for the last bucket)
+        next_start, next_end = (end, edges[i + 2]) if i < threshold - 3 else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        # Keep the point forming the largest triangle
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+# Define a function that selects the rows of a dataframe to draw
+def downsample_positions(df, x, ys, budget):
+    """
+    Returns the positions of at most about 'budget' rows per metric of the dataframe, selected with LTTB so the
+    drawn series keep their peaks and dips. When several metrics are given, the rows selected for each one are kept.
+
+    Parameters:
+        - df (pandas.DataFrame): the data, sorted by x
+        - x (str): the datetime column used as x values
+        - ys (list): the metrics drawn
+        - budget (int): number of points to keep per metric, None to keep every row
+
+    Returns:
+        A NumPy array with the positions of the selected rows, in ascending order
+    """
+
+    if budget is None or df.shape[0] <= budget:
+        return np.arange(df.shape[0])
+
+    days = to_days(df[x])
+    keep = []
+    for y in ys:
+        # Missing values are not drawn, only select among the other points
+        values = df[y].to_numpy(dtype="float64")
+        valid = np.flatnonzero(~np.isnan(values))
+        keep.append(valid[lttb(days[valid], values[valid], budget)])
+
+    return np.unique(np.concatenate(keep))
+
+
+# Define a function that downsamples the rows of a dataframe
+def downsample(df, x, ys, budget):
+    """
+    Returns the rows of the dataframe selected by 'downsample_positions'.
+    """
+
+    return df.iloc[downsample_positions(df, x, ys, budget)]
@@ -0,0 +1,122 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Local file recording the Drive metadata of each downloaded file
+MANIFEST_PATH = "drive_manifest.json"
+
+# Metadata compared to decide whether a file changed on Drive
+METADATA_FIELDS = ("md5Checksum", "modifiedDate")
+
+# -------------------------------------------------------------------------
+#                          Google Drive downloads
+# -------------------------------------------------------------------------
+
+
+# Define a function that creates an authenticated Google Drive client
+def default_client():
+    """
+    Returns a PyDrive2 'GoogleDrive' client, authenticated with the settings of the working directory.
+    """
+
+    # PyDrive2 pulls in the Google API client, import it on the first download instead of when the app starts
+    from pydrive2.auth import GoogleAuth
+    from pydrive2.drive import GoogleDrive
+    return GoogleDrive(GoogleAuth())
+
+
+class DriveCache:
+    """
+    Downloads files from Google Drive to local paths, only when they changed on Drive since the last download.
+
+    The md5 checksum and modification date of each downloaded file are kept in a manifest next to the files;
+    a file whose metadata still matches the manifest is not downloaded again. One client is created (on first
+    use) and shared by every download. PyDrive2 clients can be used from several threads.
+    """
+
+    def __init__(self, client=None, manifest_path=MANIFEST_PATH):
+        """
+        Parameters:
+            - client (pydrive2.drive.GoogleDrive): client used for every download, None to create one with
+                                                   'default_client' on first use. Any object with a 'CreateFile'
+                                                   method returning PyDrive2-like files can be used (e.g. a fake in tests)
+            - manifest_path (str): path of the manifest
+        """
+
+        self.manifest_path = manifest_path
+        self._client = client
+        self._lock = threading.Lock()
+        self._manifest = self._read_manifest()
+
+    @property
+    def client(self):
+        """
+        The Google Drive client, created on first use.
+        """
+
+        with self._lock:
+            if self._client is None:
+                self._client = default_client()
+            return self._client
+
+    def fetch(self, file_id, path):
+        """
+        Makes sure 'path' holds the current content of a Google Drive file, downloading it only if it changed.
+        If Drive can't be reached, the previously downloaded file is used.
+
+        Parameters:
+            - file_id (str): id of the file on Google Drive
+            - path (str): local path of the file
+
+        Returns:
+            True if the file was downloaded, False if the local copy was up to date
+        """
+
+        cached = self._manifest.get(path)
+        try:
+            file = self.client.CreateFile({"id": file_id})
+            file.FetchMetadata(fields=",".join(METADATA_FIELDS))
+        except Exception:
+            if cached is None or not os.path.exists(path):
+                raise
+            logger.warning("Could not check %s on Google Drive, using the local copy", path, exc_info=True)
+            return False
+
+        metadata = {"id": file_id, **{field: file.get(field) for field in METADATA_FIELDS}}
+        if metadata == cached and os.path.exists(path):
+            logger.info("%s is up to date", path)
+            return False
+
+        # Download to a temporary file and rename it so readers never see a partial file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            file.GetContentFile(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.info("Downloaded %s", path)
+
+        with self._lock:
+            self._manifest[path] = metadata
+            self._write_manifest()
+        return True
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self):
+        tmp_path = f"{self.manifest_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,215 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import os
+import time
+import shutil
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# -------------------------------------------------------------------------
+#                               Figure cache
+# -------------------------------------------------------------------------
+
+
+class FigureCache:
+    """
+    Least recently used cache of serialized figures, optionally backed by a directory so the figures
+    survive a restart.
+
+    Keys should hold everything the figure depends on, e.g. (chart, start_date, end_date, data version):
+    when the data changes its version changes too, so outdated figures are never returned and are
+    evicted as new ones are added. A figure requested while it is being built is only built once. Figures on
+    disk are also kept per 'version' of the code drawing them, so a deploy or a settings change doesn't serve
+    figures drawn the old way.
+    """
+
+    def __init__(self, max_size=256, cache_dir=None, on_build=None, version=None, on_serve=None):
+        """
+        Parameters:
+            - max_size (int): maximum number of figures kept in memory (and on disk)
+            - cache_dir (str): directory where figures are also written, None to only keep them in memory
+            - on_build (callable): function called after a figure is built with its key, the number of seconds
+                                   spent building it, the number of seconds spent serializing it and its size
+            - version (str): version of the code and settings drawing the figures, figures written to
+                             'cache_dir' by other versions are removed
+            - on_serve (callable): function called with the key and the size of each figure returned by
+                                   'get_or_build', whether it was cached or not
+        """
+
+        # Keep the figures of this version in their own directory and remove the others
+        if cache_dir is not None and version is not None:
+            if os.path.isdir(cache_dir):
+                for name in os.listdir(cache_dir):
+                    path = os.path.join(cache_dir, name)
+                    if name == version:
+                        continue
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    elif name.endswith(".json"):
+                        os.remove(path)
+            cache_dir = os.path.join(cache_dir, version)
+
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.on_build = on_build
+        self.on_serve = on_serve
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._figures = OrderedDict()
+        self._building = {}
+        self._queued = set()
+        self._lock = threading.Lock()
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_or_build(self, key, build):
+        """
+        Returns the figure stored under 'key', building and storing it first if it is not cached. If the
+        figure is already being built (by another request or by 'prefetch'), waits for it instead.
+
+        Parameters:
+            - key (tuple): values identifying the figure (must be JSON serializable)
+            - build (callable): function returning the figure (plotly.graph_objs._figure.Figure)
+
+        Returns:
+            The figure as a dict, which Dash accepts as the "figure" property of a 'dcc.Graph'
+        """
+
+        key_json = json.dumps(key, default=str)
+        figure_json, future, owner = self._claim(key_json)
+        if figure_json is None:
+            if owner:
+                self._build(key_json, key, build, future)
+            figure_json = future.result()
+
+        if self.on_serve is not None:
+            self.on_serve(key, len(figure_json))
+        return json.loads(figure_json)
+
+    def prefetch(self, key, build, executor):
+        """
+        Starts building the figure stored under 'key' on the given executor, unless it is already cached
+        or being built. A later 'get_or_build' with the same key waits for it, or builds it itself if the
+        executor hasn't started it yet (so requests don't wait behind the queue of the executor).
+
+        Parameters:
+            - key (tuple): values identifying the figure (must be JSON serializable)
+            - build (callable): function returning the figure (plotly.graph_objs._figure.Figure)
+            - executor (concurrent.futures.Executor): pool running the build
+        """
+
+        key_json = json.dumps(key, default=str)
+        _, future, owner = self._claim(key_json, count=False)
+        if owner:
+            with self._lock:
+                self._queued.add(key_json)
+            executor.submit(self._build_queued, key_json, key, build, future)
+
+    def _build_queued(self, key, original_key, build, future):
+        # Build a prefetched figure, unless a request already took it over
+        with self._lock:
+            if key not in self._queued:
+                return
+            self._queued.discard(key)
+        self._build(key, original_key, build, future)
+
+    def _claim(self, key, count=True):
+        # Returns the cached figure, or the future of the build and whether the caller must run it
+        with self._lock:
+            figure_json = self._figures.get(key)
+            if figure_json is not None:
+                self._figures.move_to_end(key)
+                self.hits += count
+                return figure_json, None, False
+
+            future = self._building.get(key)
+            if future is not None:
+                # Take over a prefetched figure the executor hasn't started building yet
+                if count and key in self._queued:
+                    self._queued.discard(key)
+                    return None, future, True
+                self.hits += count
+                return None, future, False
+
+            future = Future()
+            self._building[key] = future
+            return None, future, True
+
+    def _build(self, key, original_key, build, future):
+        try:
+            # Look for the figure on disk before building it
+            figure_json = self._read(key)
+            if figure_json is not None:
+                with self._lock:
+                    self.disk_hits += 1
+            else:
+                start = time.perf_counter()
+                figure = build()
+                built = time.perf_counter()
+                figure_json = figure.to_json()
+                if self.on_build is not None:
+                    self.on_build(original_key, built - start, time.perf_counter() - built, len(figure_json))
+                with self._lock:
+                    self.misses += 1
+                self._write(key, figure_json)
+
+            with self._lock:
+                self._figures[key] = figure_json
+                self._figures.move_to_end(key)
+                while len(self._figures) > self.max_size:
+                    self._figures.popitem(last=False)
+                del self._building[key]
+            future.set_result(figure_json)
+        except BaseException as error:
+            with self._lock:
+                self._building.pop(key, None)
+            future.set_exception(error)
+
+    def stats(self):
+        """
+        Returns the hit and miss counters and the number of figures in memory.
+        """
+
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "size": len(self._figures)}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def _read(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, key, figure_json):
+        if self.cache_dir is None:
+            return
+
+        # Write to a temporary file and rename it so readers never see a partial figure
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(figure_json)
+        os.replace(tmp_path, path)
+
+        # Remove the least recently written figures once the directory holds more than max_size
+        files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                 if name.endswith(".json")]
+        if len(files) > self.max_size:
+            files.sort(key=lambda name: os.path.getmtime(name) if os.path.exists(name) else 0)
+            for name in files[:len(files) - self.max_size]:
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
@@ -0,0 +1,63 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import numpy as np
+
+# -------------------------------------------------------------------------
+#                                Durations
+# -------------------------------------------------------------------------
+
+
+# Define a function that formats durations in seconds as text
+def format_duration(seconds, round_to=None):
+    """
+    Formats durations given in seconds as "HHhMM" (e.g. 7h05 is "07h05") using integer division
+    on NumPy arrays instead of converting each value to a datetime.
+
+    Parameters:
+        - seconds (array-like): durations in seconds
+        - round_to (int): if given, durations are rounded to this number of seconds first
+                          (600 rounds to 10 minutes, as used for the y ticks)
+
+    Returns:
+        A NumPy array of strings, empty strings for missing durations
+    """
+
+    seconds = np.asarray(seconds, dtype="float64")
+    missing = np.isnan(seconds)
+    seconds = np.where(missing, 0, seconds)
+
+    # Round to the given precision
+    if round_to:
+        seconds = np.round(seconds / round_to) * round_to
+
+    # Split the number of minutes into hours and minutes
+    hours, minutes = np.divmod(seconds.astype("int64") // 60, 60)
+    text = np.char.add(np.char.add(np.char.zfill(hours.astype(str), 2), "h"),
+                       np.char.zfill(minutes.astype(str), 2))
+
+    return np.where(missing, "", text)
+
+# -------------------------------------------------------------------------
+#                                  Dates
+# -------------------------------------------------------------------------
+
+
+# Define a function that formats dates as short strings for the figures
+def compact_dates(dates):
+    """
+    Formats dates as the shortest ISO strings keeping their precision: "2021-06-12" when every date is at
+    midnight (days, weeks and months), "2021-06-12T07:51:35" otherwise. Plotly would otherwise send
+    "2021-06-12T00:00:00.000000" for each point of a date axis.
+
+    Parameters:
+        - dates (array-like): timezone-naive dates (pandas.Series, list of timestamps or datetime64 array)
+
+    Returns:
+        A NumPy array of strings
+    """
+
+    dates = np.asarray(dates, dtype="datetime64[s]")
+    known = dates[~np.isnat(dates)]
+    unit = "D" if (known == known.astype("datetime64[D]")).all() else "s"
+    return np.datetime_as_string(dates, unit=unit)
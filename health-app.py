@@ -2,21 +2,43 @@
 #                                  Imports
 # -------------------------------------------------------------------------
 import creds # import py file that holds access tokens and other ID's
+import oura_sync
+from loader import DataLoader
+from date_range import index_by_day
+from formatting import compact_dates, format_duration
+from figure_cache import FigureCache
+from trendline import TrendIndex, fit_line, smooth, to_days
+from rollups import build_rollups, choose_resolution, slice_periods, weighted_mean
+from downsample import downsample, downsample_positions
+from apple_health import read_runs
+from zone2 import OUTLIER_SCORE, add_zone2_metrics
+from run_goal import DistanceIndex
+from rolling_stats import baseline_band, rolling_statistics
+from daily_table import LagCorrelations, build_daily_table
+from drive_cache import DriveCache
+from snapshots import SnapshotStore
+from users import DEFAULT_USER, UserData, user_settings
+import metrics
 import dash
-from dash.dependencies import Input, Output
+import flask
+from flask_compress import Compress
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from dash import dcc
 from dash import html
 import dash_bootstrap_components as dbc
 import dash_extensions as de
-import plotly.express as px
+import plotly
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
-from pydrive2.auth import GoogleAuth
-from pydrive2.drive import GoogleDrive
-from pandas import json_normalize 
-import scipy.stats as stats
-import requests
+import os
+import glob
+import hashlib
 import datetime
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 
@@ -24,175 +46,1196 @@ import numpy as np
 #                             Get Oura Ring Data
 # -------------------------------------------------------------------------
 
-# Get data from Oura's API
-url = "https://api.ouraring.com/v2/usercollection/sleep"
-params = {
-    "start_date": "2021-06-11",
-    "end_date": datetime.datetime.now().strftime("%Y-%m-%d"),
-}
-headers = {
-    "Authorization": f"Bearer {creds.api_key}"
-}
-response = requests.request("GET", url, headers=headers, params=params)
 
-# Read data
-json = response.json()
-oura_data = json_normalize(json, "data")
+# Define a function that loads the Oura ring data
+def load_oura(settings):
+    """
+    Syncs the new nights of a user from Oura's API and returns the sleep data, with one "long_sleep" row per day
+    sorted by "day". 'settings' are the user's settings (see 'users.user_settings').
+    """
+
+    # Sync the new nights from Oura's API into the local store and read the full history back
+    with metrics.stage_seconds.time(stage="oura_sync"):
+        oura_data = oura_sync.sync_sleep(api_key=settings["api_key"],
+                                         db_path=os.path.join(settings["data_dir"], oura_sync.DB_PATH))
+
+    # Convert column "day" to datetime
+    oura_data["day"] = pd.to_datetime(oura_data["day"])
 
-# Convert column "day" to datetime
-oura_data["day"] = pd.to_datetime(oura_data["day"])
+    # Change the posistion of the "day" column
+    oura_data = oura_data[["day"] + list(oura_data.columns.difference(["day"]))]
+
+    # Remove duplicates and only keep "long_sleep" types
+    oura_data = oura_data.sort_values("type")
+    oura_data = oura_data.drop_duplicates(subset="day", keep="first")
+
+    # Sort data by "day" (ascending) and index it by day
+    return index_by_day(oura_data, "day")
+
+
+# Define a function that adds the formatted date and sleep durations used in the hover templates
+def format_sleep_columns(oura_data):
+    """
+    Adds "day_formatted" and "<duration>_formatted" columns to the Oura ring data (or its rollup tables).
+    """
 
-# Change the posistion of the "day" column
-oura_data = oura_data[["day"] + list(oura_data.columns.difference(["day"]))]
+    oura_data["day_formatted"] = oura_data["day"].dt.strftime("%b %d, %Y")
+    for column in ["total_sleep_duration", "deep_sleep_duration", "rem_sleep_duration"]:
+        oura_data[f"{column}_formatted"] = format_duration(oura_data[column])
+    return oura_data
 
-# Remove duplicates and only keep "long_sleep" types
-oura_data = oura_data.sort_values("type")
-oura_data = oura_data.drop_duplicates(subset="day", keep="first")
+# -------------------------------------------------------------------------
+#                               Google Drive
+# -------------------------------------------------------------------------
 
-# Sort data by "day" (ascending) and reset index
-oura_data = oura_data.sort_values("day", ascending=True).reset_index(drop=True)
+# Google Drive files are downloaded with one client, and only when they changed since the last download
+drive = DriveCache()
 
 # -------------------------------------------------------------------------
 #                            Get Apple Health Data: running
 # -------------------------------------------------------------------------
 
-# Get data from Google Drive
-gauth = GoogleAuth()
-drive = GoogleDrive(gauth)
-file = drive.CreateFile({"id": creds.file_id})
-file.GetContentFile("Export.csv")
-ah_data = pd.read_csv("Export.csv")
 
-# Add a "day" column by splitting the "Date" column which holds a start and end date
-ah_data["day"] = ah_data.Date.apply(lambda x: pd.to_datetime(x.split(" - ")[1]))
+# Define a function that loads the Apple Health running data
+def load_running(settings):
+    """
+    Downloads the Apple Health export of a user from Google Drive (if it changed) and returns the runs longer
+    than 1 km. 'settings' are the user's settings (see 'users.user_settings').
+    """
+
+    # Get data from Google Drive (only downloaded if it changed)
+    path = os.path.join(settings["data_dir"], "Export.csv")
+    with metrics.stage_seconds.time(stage="run_download"):
+        drive.fetch(settings["file_id"], path)
+
+    # Only read the runs (not counting runs < 1 km), with a "day" column holding the end date of each run
+    with metrics.stage_seconds.time(stage="run_parse"):
+        run = read_runs(path, min_distance=1)
+
+    # Sort runs by "day" (ascending) and index them by day
+    run = index_by_day(run, "day")
+
+    # Compute the pace, performance and outlier scores of the Zone 2 graph once for every date range
+    with metrics.stage_seconds.time(stage="run_zone2"):
+        return add_zone2_metrics(run)
 
 # -------------------------------------------------------------------------
 #                            Get Apple Health Data: VO2 max
 # -------------------------------------------------------------------------
 
-# Get data from Google Drive
-gauth = GoogleAuth()
-drive = GoogleDrive(gauth)
-file_id = "1lN5DGfasVOtI43gTCnesT1KCwjU2k6bL"
-file = drive.CreateFile({"id": file_id})
-file.GetContentFile("vo2max.csv")
-vo2 = pd.read_csv("vo2max.csv")
 
-# Convert date from string to datetime type
-vo2.Date = pd.to_datetime(vo2.Date)
+# Define a function that loads the Apple Health VO2 max data
+def load_vo2(settings):
+    """
+    Downloads the VO2 max export of a user from Google Drive (if it changed) and returns it with "Date" converted
+    to datetime. 'settings' are the user's settings (see 'users.user_settings').
+    """
+
+    # Get data from Google Drive (only downloaded if it changed)
+    path = os.path.join(settings["data_dir"], "vo2max.csv")
+    with metrics.stage_seconds.time(stage="vo2_download"):
+        drive.fetch(settings["vo2_file_id"], path)
+    with metrics.stage_seconds.time(stage="vo2_parse"):
+        vo2 = pd.read_csv(path)
+
+    # Convert date from string to datetime type
+    vo2.Date = pd.to_datetime(vo2.Date)
+
+    # Sort data by "Date" (ascending) and index it by day
+    return index_by_day(vo2, "Date")
+
+# -------------------------------------------------------------------------
+#                                  Metrics
+# -------------------------------------------------------------------------
+
+# VO2 max
+vo2max = 47.80
+
+# Total of km run with Nike Run Club app (before using the Apple Watch)
+nike_km = 1586
+
+# Run around the world goal
+earth_circumference = 40075
+
+# Text displayed on the cards until their data is loaded
+placeholder = "--"
+
+# -------------------------------------------------------------------------
+#                             Background loading
+# -------------------------------------------------------------------------
+
+# Settings of each user (Oura token, Drive files...), a single user unless creds defines 'users'
+users = user_settings(creds, vo2_file_id="1lN5DGfasVOtI43gTCnesT1KCwjU2k6bL", nike_km=nike_km)
+
+# Header holding the name of the logged-in user, set by the authenticating proxy in front of the app
+user_header = "X-Forwarded-User"
+
+# Load every source again every 15 minutes to pick up new nights and runs without restarting the server
+refresh_interval = 15 * 60
+
+# Define a function that starts loading the data of a user
+def create_loader(user):
+    """
+    Returns a data loader loading every source of the user on background threads, so the server can serve the
+    layout right away. Each loader has its own threads (one per source, stopped when the user is evicted), so a
+    user's first load never waits for the loads and refreshes of the other users. When the app runs in several
+    processes (e.g. gunicorn workers), only one of them loads the sources and shares them with the others
+    through memory-mapped snapshots.
+    """
+
+    settings = users[user]
+    os.makedirs(settings["data_dir"], exist_ok=True)
+    loader = DataLoader(store=SnapshotStore(os.path.join(settings["data_dir"], "snapshots")))
+    loader.submit("oura", load_oura, settings)
+    loader.submit("run", load_running, settings)
+    loader.submit("vo2", load_vo2, settings)
+    loader.start_refresh(refresh_interval)
+    return loader
+
+
+# Data of each user, loaded on their first request and evicted when idle users take too much memory
+user_data = UserData(create_loader, max_bytes=512 * 2**20, on_evict=lambda user: forget_derived(user))
+
+# Start loading the data right away when the app displays a single user
+if DEFAULT_USER in users:
+    user_data.get(DEFAULT_USER)
+
+
+# Define a function that returns the logged-in user
+def current_user():
+    """
+    Returns the name of the user making the current request, from the header set by the authenticating proxy.
+    Requests from unknown users are rejected, unless the app displays a single user.
+    """
+
+    if DEFAULT_USER in users:
+        return DEFAULT_USER
+
+    user = flask.request.headers.get(user_header)
+    if user not in users:
+        flask.abort(403)
+    return user
+
+# -------------------------------------------------------------------------
+#                                 Colors
+# -------------------------------------------------------------------------
+
+# Create variables for colors to quickly update the aesthetic of the app
+font_color = "#e6e6e6"
+marker_color = "#a02c5a"
+background_color = "#2B2B2B"
+band_color = "rgba(230, 230, 230, 0.12)"
+
+# -------------------------------------------------------------------------
+#                              Figure template
+# -------------------------------------------------------------------------
+
+# Style shared by every figure: the background color, the font and font color, no grid, the color of the
+# annotations and the dotted average lines. Each figure carries its template in its JSON, so this replaces
+# plotly's default template (about 7 kB per figure) instead of adding the style on top of it
+pio.templates["health"] = go.layout.Template(layout=dict(
+    paper_bgcolor=background_color, plot_bgcolor=background_color,
+    font=dict(family="sans-serif", color=font_color),
+    xaxis=dict(showgrid=False, zeroline=False), yaxis=dict(showgrid=False, zeroline=False),
+    margin=dict(b=75, t=10, pad=20),
+    annotationdefaults=dict(showarrow=False, font=dict(color=font_color)),
+    shapedefaults=dict(line=dict(dash="dot", color=font_color, width=1.25))
+))
+pio.templates.default = "health"
+
+# -------------------------------------------------------------------------
+#                              Graph function
+# -------------------------------------------------------------------------
+
+
+# Define a function that plots a scatter plot for a given dataframe
+def scatter_plot(
+        df, x, y, ylabel, avg_line_text, hovertemplate, ytickvals=False, custom_data=None,
+        trend=None, smoothing=None, points=None, band=None, annot1_x=-0.18, annot2_x=1.2, margin_l=110, margin_r=115):
+    """
+    Creates a scatter plot with a trend line using the provided dataframe and columns specified.
+
+    Parameters:
+    df (pandas.DataFrame): The dataframe to use for the scatter plot.
+    x (str): The column to use for the x-axis.
+    y (str): The column to use for the y-axis.
+    ylabel (str): The label to use for the y-axis.
+    avg_line_text (str): The label to use for the average line on the y-axis.
+    hovertemplate (str): Hovertemplate to use for points.
+    ytickvals (bool): Whether to reformat y ticks as durations or not.
+    custom_data (list): Columns to use in the hover template (e.g. the formatted durations), None if not needed.
+    trend (tuple): (slope, intercept) of the trend line if already fitted (see 'trendline.TrendIndex'),
+                   None to fit it on the dataframe.
+    smoothing (str): "rolling" or "loess" to draw a smoothed curve instead of a straight trend line.
+    points (int): Maximum number of points to draw, selected with LTTB (see 'downsample'). None to draw every point.
+    band (pandas.DataFrame): Rolling baseline of the metric indexed by day, with "lower", "mean" and "upper" columns
+                             (see 'rolling_stats.baseline_band'), drawn behind the points. None to draw no band.
+    annot1_x (float): x position for ylabel text.
+    annot2_x (float): x position for avg_line_text.
+    margin_l (int): Left margin for the plot.
+    margin_r (int): Right margin for the plot.
+    
+    Returns:
+    fig (plotly.graph_objs._figure.Figure) : The created scatter plot figure.
+    """
+    
+    # Average of the data (periods of rollup tables are weighted by their number of values)
+    average = weighted_mean(df, y)
+
+    # Only draw the points needed to keep the peaks and dips of the data
+    positions = downsample_positions(df, x, [y], points)
+    drawn = df.iloc[positions]
+
+    # Draw scatter plot, using WebGL for large date ranges like plotly express does
+    trace = go.Scattergl if drawn.shape[0] > 1000 else go.Scatter
+    fig = go.Figure()
+
+    # Draw the rolling baseline first so it stays behind the points: the band is filled between its lower and
+    # upper bounds, read on the days of the drawn points (or the last day before them for weeks and months).
+    # The baseline is smooth, so about 100 of these days (with the last one) are enough to draw it
+    if band is not None:
+        step = max(1, drawn.shape[0] // 100)
+        band = band.reindex(drawn.index, method="ffill").iloc[np.unique(np.r_[0:drawn.shape[0]:step, -1])]
+        band_x = compact_dates(band.index)
+        fig.add_trace(go.Scatter(x=band_x, y=band["lower"], mode="lines", line_width=0, hoverinfo="skip"))
+        fig.add_trace(go.Scatter(x=band_x, y=band["upper"], mode="lines", line_width=0, fill="tonexty",
+                                 fillcolor=band_color, hoverinfo="skip"))
+        fig.add_trace(go.Scatter(x=band_x, y=band["mean"], mode="lines", line=dict(color=font_color, width=1),
+                                 opacity=0.4, hoverinfo="skip"))
+
+    fig.add_trace(trace(x=compact_dates(drawn[x]), y=drawn[y], mode="markers",
+                        customdata=drawn[custom_data].to_numpy() if custom_data else None  # Add custom data to use in a custom hover template
+                       ))
+
+    # Add the trend line: a least squares line (2 points are enough to draw it) or a smoothed curve
+    if smoothing is None:
+        trend = trend or fit_line(df[x], df[y])
+        if trend is not None:
+            trend_x = [df[x].min(), df[x].max()]
+            fig.add_trace(trace(x=compact_dates(trend_x), y=trend[1] + trend[0] * to_days(trend_x), mode="lines",
+                                line_color="#ffdd1a", hoverinfo="skip"))
+    else:
+        fig.add_trace(trace(x=compact_dates(drawn[x]), y=smooth(df[x], df[y], method=smoothing)[positions], mode="lines",
+                            line_color="#ffdd1a", hoverinfo="skip"))
+
+    # Reformat y ticks if argument ytickvals is True
+    if ytickvals is True:
+        step = round((df[y].max() - df[y].min()) / 7)
+        ytickvals = np.arange(start=df[y].min(), 
+                              stop=df[y].max(), 
+                              step=step)
+        yticktext = format_duration(ytickvals, round_to=600)
+        fig.update_yaxes(tickvals=ytickvals, ticktext=yticktext)
+
+    # Update layout: define the margins (the colors, the font and the axes come from the "health" template)
+    fig.update_layout(margin=dict(l=margin_l, r=margin_r), autosize=True, showlegend=False)
+
+    # Update layout: define the markers' size and color and overwrite the hover template with a custom one
+    fig.update_traces(marker=dict(size=7, color=marker_color), hovertemplate=hovertemplate,
+                      selector=dict(mode="markers"))
+
+    # Add title to the y axis with annotation since 'title_standoff' doesn't seem to work in Dash
+    fig.add_annotation(x=annot1_x, xref="paper", y=0.5, yref="paper", text=ylabel, textangle=-90,
+                       font_size=14)
+
+    # Add a horizontal line for the average using 'add_shape' because 'add_hline' doesn't seem to work in Dash
+    fig.add_shape(type="line", xref="paper", x0=0, y0=average, x1=0.98, y1=average)
+
+    # Add annotation to specify that the horizontal line is the average
+    fig.add_annotation(x=annot2_x, xref="paper", y=average, text=avg_line_text, font_size=12)
+
+    return fig
+
+
+# Define a function that returns an empty figure displaying a message
+def message_figure(text):
+    """
+    Returns an empty figure with the given message in its center, displayed instead of a graph when
+    there is nothing to plot.
+
+    Parameters:
+        - text (str): the message to display
+
+    Returns:
+        fig (plotly.graph_objs._figure.Figure) : The created figure.
+    """
+
+    fig = go.Figure()
+
+    # Update layout: remove the margins (the colors and the axes come from the "health" template)
+    fig.update_layout(margin=dict(l=0, r=0, b=0, t=0, pad=0))
+
+    # Add annotation with the message
+    fig.add_annotation(x=0.5, xref="paper", y=0.5, yref="paper", text=text, font_size=16)
+
+    return fig
+
+
+# -------------------------------------------------------------------------
+#                                 Figures
+# -------------------------------------------------------------------------
+
+# Message displayed instead of a graph when the date range doesn't hold enough data
+not_enough_data = "Not enough data. Try a different date range."
+
+# Score used to remove the outliers of the Zone 2 graph: "Performance_score" compares each run to every run,
+# "Performance_rolling_score" to the runs of the 90 days around it
+zone2_outliers = "Performance_score"
+
+
+# Define a function that draws the HRV trend graph
+def hrv_figure(oura, trend=None, points=None, band=None, smoothing=None):
+    """
+    Returns the HRV trend graph for the given Oura ring data.
+    'trend' is the fitted trend line of the date range (None to fit it on the data), 'points' the maximum number
+    of points to draw and 'band' the rolling baseline drawn behind them (see 'scatter_plot').
+    'smoothing' draws a rolling mean or LOESS curve instead of the straight trend line (see 'scatter_plot').
+    """
+
+    # Show message saying "Not enough data. Try a different date range."
+    if oura.shape[0] < 2:
+        return message_figure(not_enough_data)
+
+    # Draw graph
+    return scatter_plot(df=oura, x="day", y="average_hrv", ylabel="HRV (ms)",
+                        hovertemplate="%{x} - %{y} ms", avg_line_text="Average HRV",
+                        trend=trend,
+                        smoothing=smoothing, points=points, band=band, ytickvals=False, annot1_x=-0.15, annot2_x=1.15, 
+                        margin_l=97.5, margin_r=102.5,
+                       )
+
+
+# Define a function that draws the Zone 2 performance trend graph
+def zone2_figure(new_run, trend=None, points=None, smoothing=None):
+    """
+    Returns the Zone 2 performance trend graph for the given Apple Health running data, from the rollup tables of
+    the runs without outliers (see 'drawn_rows'). The performance of each run and its outlier score are computed
+    when the runs are loaded (see 'zone2.add_zone2_metrics').
+    'trend' is the trend line fitted on the runs of the date range (None to fit it on the data) and 'points' the
+    maximum number of points to draw.
+    'smoothing' draws a rolling mean or LOESS curve instead of the straight trend line (see 'scatter_plot').
+    """
+
+    # Show message saying "Not enough data. Try a different date range."
+    if new_run.shape[0] < 2:
+        return message_figure(not_enough_data)
+
+    # Draw graph
+    return scatter_plot(df=new_run, x="day", y="Performance", 
+                        ylabel="Performance (Speed / Average HR)",
+                        hovertemplate="%{x} - %{y:.3f}",
+                        avg_line_text="Average performance", trend=trend,
+                        smoothing=smoothing, points=points, ytickvals=False,
+                        annot1_x=-0.2, annot2_x=1.26, margin_l=117.5, margin_r=145
+                       )
+
+
+# Define a function that draws the VO2 max trend graph
+def vo2max_figure(new_vo2, trend=None, points=None, smoothing=None):
+    """
+    Returns the VO2 max trend graph for the given Apple Health VO2 max data.
+    'trend' is the fitted trend line of the date range (None to fit it on the data) and 'points' the maximum number
+    of points to draw.
+    'smoothing' draws a rolling mean or LOESS curve instead of the straight trend line (see 'scatter_plot').
+    """
+
+    # Show message saying "Not enough data. Try a different date range."
+    if new_vo2.shape[0] < 2:
+        return message_figure(not_enough_data)
+
+    # Draw graph
+    return scatter_plot(df=new_vo2, x="Date", y="VO2 Max(mL/min·kg)", 
+                        ylabel="VO2 max (ml/min/kg)", hovertemplate="%{x} - %{y:.1f}",
+                        avg_line_text="Average VO2 max", trend=trend,
+                        smoothing=smoothing, points=points, ytickvals=False,
+                        annot1_x=-0.2, annot2_x=1.26, margin_l=117.5, margin_r=145
+                       )
+
+
+# Define a function that draws the total sleep trend graph
+def sleep_figure(oura, trend=None, points=None, band=None, smoothing=None):
+    """
+    Returns the total sleep trend graph for the given Oura ring data.
+    'trend' is the fitted trend line of the date range (None to fit it on the data), 'points' the maximum number
+    of points to draw and 'band' the rolling baseline drawn behind them (see 'scatter_plot').
+    'smoothing' draws a rolling mean or LOESS curve instead of the straight trend line (see 'scatter_plot').
+    """
+
+    # Show message saying "Not enough data. Try a different date range."
+    if oura.shape[0] < 2:
+        return message_figure(not_enough_data)
+
+    # Draw graph
+    return scatter_plot(df=oura, x="day", y="total_sleep_duration", 
+                        ylabel="Total sleep duration", hovertemplate="%{x} - %{customdata[0]}",
+                        avg_line_text="Average total sleep", trend=trend,
+                        smoothing=smoothing, points=points, band=band, ytickvals=True,
+                        custom_data=["total_sleep_duration_formatted"],
+                        annot1_x=-0.2, annot2_x=1.22, margin_l=117.5, margin_r=130
+                       )
+
+
+# Define a function that draws the deep sleep trend graph
+def deep_sleep_figure(oura, trend=None, points=None, band=None, smoothing=None):
+    """
+    Returns the deep sleep trend graph for the given Oura ring data.
+    'trend' is the fitted trend line of the date range (None to fit it on the data), 'points' the maximum number
+    of points to draw and 'band' the rolling baseline drawn behind them (see 'scatter_plot').
+    'smoothing' draws a rolling mean or LOESS curve instead of the straight trend line (see 'scatter_plot').
+    """
+
+    # Show message saying "Not enough data. Try a different date range."
+    if oura.shape[0] < 2:
+        return message_figure(not_enough_data)
+
+    # Draw graph
+    return scatter_plot(df=oura, x="day", y="deep_sleep_duration", 
+                        ylabel="Deep sleep duration",         
+                        hovertemplate="%{x} - %{customdata[0]}",
+                        avg_line_text="Average deep sleep", trend=trend,
+                        smoothing=smoothing, points=points, band=band, ytickvals=True,
+                        custom_data=["deep_sleep_duration_formatted"],
+                        annot1_x=-0.2, annot2_x=1.22, margin_l=117.5, margin_r=130
+                       )
+
+
+# Define a function that draws the REM sleep trend graph
+def rem_sleep_figure(oura, trend=None, points=None, band=None, smoothing=None):
+    """
+    Returns the REM sleep trend graph for the given Oura ring data.
+    'trend' is the fitted trend line of the date range (None to fit it on the data), 'points' the maximum number
+    of points to draw and 'band' the rolling baseline drawn behind them (see 'scatter_plot').
+    'smoothing' draws a rolling mean or LOESS curve instead of the straight trend line (see 'scatter_plot').
+    """
+
+    # Show message saying "Not enough data. Try a different date range."
+    if oura.shape[0] < 2:
+        return message_figure(not_enough_data)
+
+    # Draw graph
+    return scatter_plot(df=oura, x="day", y="rem_sleep_duration", 
+                        ylabel="REM sleep duration", 
+                        hovertemplate="%{x} - %{customdata[0]}",
+                        avg_line_text="Average REM sleep", trend=trend,
+                        smoothing=smoothing, points=points, band=band, ytickvals=True,
+                        custom_data=["rem_sleep_duration_formatted"],
+                        annot1_x=-0.2, annot2_x=1.22, margin_l=117.5, margin_r=130
+                       )
+
+
+# Define a function that draws the deep sleep vs REM sleep graph
+def deep_vs_rem_figure(oura, points=None):
+    """
+    Returns a graph comparing deep sleep and REM sleep for the given Oura ring data. 'points' is the maximum number
+    of points to draw per line.
+    """
+
+    # Show message saying "Not enough data. Try a different date range."
+    if oura.shape[0] < 2:
+        return message_figure(not_enough_data)
+
+    # Create a plot with 2 y axis
+    deep_vs_rem = make_subplots(specs=[[{"secondary_y": True}]])
+
+    # Only draw the points needed to keep the peaks and dips of both lines
+    drawn = downsample(oura, "day", ["deep_sleep_duration", "rem_sleep_duration"], points)
+
+    # Create customdata to control the hover
+    customdata1 = drawn[["day_formatted", "deep_sleep_duration_formatted"]].to_numpy()
+    customdata2 = drawn[["day_formatted", "rem_sleep_duration_formatted"]].to_numpy()
+    day = compact_dates(drawn.day)
+
+    # Add the deep sleep graph
+    deep_vs_rem.add_trace(go.Scatter(x=day, y=drawn.deep_sleep_duration, 
+                                     name="Deep sleep", marker_color="#ffdd1a",
+                                     customdata=customdata1, 
+                                     hovertemplate="%{customdata[0]} - %{customdata[1]}"
+                                    ),
+                                    secondary_y=False,
+                         )
+
+    # Add the REM sleep graph
+    deep_vs_rem.add_trace(go.Scatter(x=day, y=drawn.rem_sleep_duration, 
+                                     name="REM sleep", marker_color=marker_color,
+                                     customdata=customdata2,
+                                     hovertemplate="%{customdata[0]} - %{customdata[1]}"
+                                    ),
+                                    secondary_y=True
+                         )
+
+    # Update layout: define the margins (the colors, the font and the axes come from the "health" template)
+    deep_vs_rem.update_layout(margin=dict(l=120, r=130))
+
+    # # Reformat y ticks so that the sleep duration is the hh:mm format
+    if oura["deep_sleep_duration"].max() > oura["rem_sleep_duration"].max():
+        max_value = oura["deep_sleep_duration"].max()
+    else:
+        max_value = oura["rem_sleep_duration"].max()
+
+    if oura["deep_sleep_duration"].min() < oura["rem_sleep_duration"].min():
+        min_value = oura["deep_sleep_duration"].min()
+    else:
+        min_value = oura["rem_sleep_duration"].min()
+
+    step = round((max_value - min_value) / 7)
+    ytickvals = np.arange(start=min_value, stop=max_value, step=step)
+    yticktext = format_duration(ytickvals, round_to=600)
+
+    deep_vs_rem.update_yaxes(tickvals = ytickvals, ticktext= yticktext, secondary_y=False)
+
+    # Add title to the y axis with annotation since 'title_standoff' doesn't seem to work in Dash
+    deep_vs_rem.add_annotation(x=-0.2, xref="paper", y=0.5, yref="paper", text="Duration",
+                               textangle=-90, font_size=14)
+
+    # Remove secondary y axis
+    deep_vs_rem.update_yaxes(secondary_y=True, showticklabels=False)
+
+    # Averages of the data (periods of rollup tables are weighted by their number of values)
+    deep_average = weighted_mean(oura, "deep_sleep_duration")
+    rem_average = weighted_mean(oura, "rem_sleep_duration")
+
+    # Add a horizontal line for the average deep sleep using 'add_shape' because 'add_hline' doesn't seem to work in Dash
+    deep_vs_rem.add_shape(type="line", xref="paper", x0=0, y0=deep_average, x1=0.98, y1=deep_average)
+
+    # Add annotation to specify that the horizontal line is the average
+    deep_vs_rem.add_annotation(x=1.08, xref="paper", y=deep_average,
+                               text="Average deep sleep", font_size=12)
+
+    # Add a horizontal line for the average REM sleep using 'add_shape' because 'add_hline' doesn't seem to work in Dash
+    deep_vs_rem.add_shape(type="line", xref="paper", x0=0, y0=rem_average, x1=0.98, y1=rem_average)
+
+    # Add annotation to specify that the horizontal line is the average
+    deep_vs_rem.add_annotation(x=1.08, xref="paper", y=rem_average,
+                               text="Average REM sleep", font_size=12)
+
+    return deep_vs_rem
+
+
+# Define a function that returns the cumulative distance index of the runs of a user
+def distance_index(user, run, version):
+    """
+    Returns the distance index of a version of a user's runs (see 'run_goal.DistanceIndex'). When the runs of
+    the new version start with the runs of the previous one, only the new runs are added to the index.
+    """
+
+    def build():
+        previous = previous_derived(user, "run", "distance")
+        if previous is None:
+            return DistanceIndex(run["day"], run["Distance(km)"])
+        return previous.extend(run["day"], run["Distance(km)"])
+
+    return derived(user, "run", version, "distance", build)
+
+
+# Define a function that draws the progress of the run around the world goal
+def run_goal_figure(index, start_date, end_date, offset=0, points=None):
+    """
+    Returns the graph of the total distance run over the date range, counting the km run with Nike Run Club
+    ('offset'). When the range reaches the last run, the projected completion of the run around the world goal
+    at the pace of the last 90 days is drawn too (see 'run_goal.DistanceIndex.projected_completion').
+    'index' is the distance index of the runs and 'points' the maximum number of points to draw.
+    """
+
+    runs = index.cumulative(start_date, end_date)
+    runs["cumulative_km"] += offset
+
+    # Show message saying "Not enough data. Try a different date range."
+    if runs.shape[0] < 2:
+        return message_figure(not_enough_data)
+
+    # Only draw the points needed to keep the shape of the line
+    drawn = downsample(runs, "day", ["cumulative_km"], points)
+    fig = go.Figure(go.Scatter(x=compact_dates(drawn["day"]), y=drawn["cumulative_km"], mode="lines",
+                               line_color=marker_color, hovertemplate="%{x} - %{y:,.0f} km"))
+
+    # Extend the line to the goal when the date range ends with the last run
+    completion = index.projected_completion(earth_circumference, offset=offset)
+    if completion is not None and runs["day"].iloc[-1] == index.dates[-1]:
+        fig.add_trace(go.Scatter(x=compact_dates([runs["day"].iloc[-1], completion]),
+                                 y=[runs["cumulative_km"].iloc[-1], earth_circumference], mode="lines",
+                                 line=dict(color="#ffdd1a", dash="dot"), hoverinfo="skip"))
+        fig.add_annotation(x=1, xref="paper", y=earth_circumference, xanchor="right", yanchor="bottom",
+                           text=f"Around the world on {completion:%b %d, %Y}", font_size=12)
+
+    # Update layout: define the margins (the colors, the font and the axes come from the "health" template)
+    fig.update_layout(margin=dict(l=117.5, r=40), autosize=True, showlegend=False)
+
+    # Add title to the y axis with annotation since 'title_standoff' doesn't seem to work in Dash
+    fig.add_annotation(x=-0.12, xref="paper", y=0.5, yref="paper", text="Total distance (km)", textangle=-90,
+                       font_size=14)
+
+    return fig
+
+
+# Days between the HRV and the runs of the HRV vs Zone 2 performance graph (Oura dates a night by the morning
+# it ends, so 1 is the runs of the day after the morning the HRV was measured)
+performance_lag = 1
+
+# Oura metrics whose correlation with the Zone 2 performance of the following days is drawn, with their names
+lag_metrics = {"average_hrv": "HRV", "lowest_heart_rate": "Lowest HR", "total_sleep_duration": "Total sleep"}
+
+
+# Define a function that returns the lag correlations of the Oura metrics with the Zone 2 performance
+def performance_lags(user, table, version):
+    """
+    Returns the lag correlations of each metric of 'lag_metrics' with the Zone 2 performance of the following
+    days (see 'daily_table.LagCorrelations'), built once per version of a user's daily table.
+    """
+
+    return {metric: derived(user, "daily", version, ("lags", metric),
+                            lambda metric=metric: LagCorrelations(table, metric, "Performance"))
+            for metric in lag_metrics}
+
+
+# Define a function that draws the HRV vs Zone 2 performance graph
+def hrv_performance_figure(lags, start_date, end_date):
+    """
+    Returns the graph of the Zone 2 performance of the runs against the HRV measured 'performance_lag' days
+    before, with their least squares line. 'lags' are the lag correlations of the Oura metrics with the
+    performance (see 'performance_lags'), the pairs are dated by the day of the HRV.
+    """
+
+    hrv = lags["average_hrv"]
+    pairs = hrv.pairs(start_date, end_date, performance_lag)
+    fit = hrv.correlations(start_date, end_date).iloc[performance_lag]
+
+    # Show message saying "Not enough data. Try a different date range."
+    if pd.isna(fit["correlation"]):
+        return message_figure(not_enough_data)
+
+    fig = go.Figure(go.Scatter(x=pairs["average_hrv"], y=pairs["Performance"], mode="markers",
+                               marker_color=marker_color, customdata=compact_dates(pairs["day"]),
+                               hovertemplate="%{customdata} - %{x:.0f} ms, %{y:.3f}"))
+
+    # Least squares line over the HRV of the date range
+    ends = np.array([pairs["average_hrv"].min(), pairs["average_hrv"].max()])
+    fig.add_trace(go.Scatter(x=ends, y=fit["intercept"] + fit["slope"] * ends, mode="lines",
+                             line=dict(color="#ffdd1a", dash="dot"), hoverinfo="skip"))
+    fig.add_annotation(x=1, xref="paper", y=1, yref="paper", xanchor="right", yanchor="bottom",
+                       text=f"r = {fit['correlation']:.2f} ({fit['pairs']} runs)", font_size=12)
+
+    # Update layout: define the margins (the colors, the font and the axes come from the "health" template)
+    fig.update_layout(margin=dict(l=117.5, r=40), autosize=True, showlegend=False)
+    fig.update_xaxes(title_text="HRV (ms)")
+
+    # Add title to the y axis with annotation since 'title_standoff' doesn't seem to work in Dash
+    fig.add_annotation(x=-0.2, xref="paper", y=0.5, yref="paper", text="Performance (Speed / Average HR)",
+                       textangle=-90, font_size=14)
+
+    return fig
+
+
+# Define a function that draws the correlations of the Oura metrics with the Zone 2 performance by lag
+def performance_lags_figure(lags, start_date, end_date):
+    """
+    Returns a bar graph of the correlation of each Oura metric of 'lag_metrics' with the Zone 2 performance of
+    the runs 0 to 7 days later, over the date range. 'lags' are the lag correlations of the metrics (see
+    'performance_lags').
+    """
+
+    correlations = {metric: lags[metric].correlations(start_date, end_date) for metric in lag_metrics}
+
+    # Show message saying "Not enough data. Try a different date range."
+    if all(table["correlation"].isna().all() for table in correlations.values()):
+        return message_figure(not_enough_data)
+
+    fig = go.Figure()
+    for (metric, name), color in zip(lag_metrics.items(), [marker_color, "#ffdd1a", font_color]):
+        table = correlations[metric]
+        fig.add_trace(go.Bar(x=table["lag"], y=table["correlation"], name=name, marker_color=color,
+                             customdata=table["pairs"], hovertemplate=f"{name}: %{{y:.2f}} (%{{customdata}} runs)"))
+
+    # Update layout: define the margins and the legend (the colors, the font and the axes come from the "health" template)
+    fig.update_layout(margin=dict(l=117.5, r=40), autosize=True, barmode="group",
+                      legend=dict(orientation="h", x=0, y=1.02, yanchor="bottom"))
+    fig.update_xaxes(title_text="Days between the night and the run", dtick=1)
+    fig.update_yaxes(zeroline=True, zerolinecolor=font_color)
+
+    # Add title to the y axis with annotation since 'title_standoff' doesn't seem to work in Dash
+    fig.add_annotation(x=-0.2, xref="paper", y=0.5, yref="paper", text="Correlation with performance",
+                       textangle=-90, font_size=14)
+
+    return fig
+
+
+# Names of the sleep phases of the 'sleep_phase_5_min' series of Oura's API
+sleep_phases = {1: "Deep", 2: "Light", 3: "REM", 4: "Awake"}
+
+
+# Define a function that draws the 5-minute series of a night
+def night_figure(night):
+    """
+    Returns a graph of the 5-minute HRV, heart rate and sleep phases of a night.
+
+    Parameters:
+        - night (dict): the decoded series of the night returned by 'oura_sync.read_night', None if the day
+                        has no data
+
+    Returns:
+        The figure (plotly.graph_objs._figure.Figure)
+    """
+
+    if night is None or not len(night["hrv"][0]) and not len(night["heart_rate"][0]):
+        return message_figure("No data for this night.")
+
+    fig = make_subplots(rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.06, row_heights=[0.4, 0.4, 0.2])
+
+    # HRV and heart rate, with gaps where the ring didn't measure anything
+    for row, (series, name) in enumerate([("hrv", "HRV (ms)"), ("heart_rate", "Heart rate (bpm)")], start=1):
+        times, values = night[series]
+        fig.add_trace(go.Scatter(x=compact_dates(times), y=values, mode="lines", name=name, line_color=marker_color,
+                                 hovertemplate="%{x|%H:%M} - %{y:.0f}"), row=row, col=1)
+        fig.update_yaxes(title_text=name, row=row, col=1)
+
+    # Sleep phases drawn as steps, awake at the top
+    times, phases = night["phases"]
+    fig.add_trace(go.Scatter(x=compact_dates(times), y=5 - phases.astype("int64"), mode="lines", line_shape="hv",
+                             name="Sleep phase", line_color="#ffdd1a",
+                             customdata=[sleep_phases.get(phase, "") for phase in phases],
+                             hovertemplate="%{x|%H:%M} - %{customdata}"), row=3, col=1)
+    fig.update_yaxes(tickvals=[5 - phase for phase in sleep_phases], ticktext=list(sleep_phases.values()),
+                     range=[0.5, 4.5], row=3, col=1)
+
+    # Update layout: define the height and the margins (the colors, the font and the axes come from the "health" template)
+    fig.update_layout(showlegend=False, height=600, margin=dict(l=80, r=30, b=40, t=10, pad=0))
+    fig.update_xaxes(tickformat="%H:%M")
+    return fig
+
+
+# Graphs by callback id:
+#   - source: name of the source of the data in the loader, "daily" for the table joining every source by day
+#             (see 'daily_snapshot')
+#   - draw: function drawing the graph
+#   - trend: x and y columns of the trend line when it is fitted from the prefix sums of the whole data
+#   - rollup: True if the graph is drawn from the rollup tables, None if it receives the index returned by
+#             'index' with the date range
+#   - index: function returning the index of the data the graph is drawn from (e.g. 'distance_index'), for
+#            graphs without rollup
+#   - points: maximum number of points drawn (per line), the others are dropped with LTTB (None for graphs
+#             that draw every point)
+#   - band: metric whose rolling baseline is drawn behind the points (see 'band_window'), None for no band
+#   - smoothing: "rolling" or "loess" to draw a smoothed curve instead of the trend line (graphs drawn with
+#                'scatter_plot'), None for the straight trend line
+#   - zoom: True if the x axis holds dates, so zooming redraws the graph for the zoomed date range
+charts = {
+    "hrv_fig": dict(source="oura", draw=hrv_figure, trend=("day", "average_hrv"), rollup=True, index=None,
+                    points=300, band="average_hrv", smoothing=None, zoom=True),
+    "zone2_fig": dict(source="run", draw=zone2_figure, trend=("day", "Performance"), rollup=True, index=None,
+                      points=300, band=None, smoothing=None, zoom=True),
+    "vo2max_fig": dict(source="vo2", draw=vo2max_figure, trend=("Date", "VO2 Max(mL/min·kg)"), rollup=True,
+                       index=None, points=300, band=None, smoothing=None, zoom=True),
+    "sleep_fig": dict(source="oura", draw=sleep_figure, trend=("day", "total_sleep_duration"), rollup=True,
+                      index=None, points=300, band="total_sleep_duration", smoothing=None, zoom=True),
+    "deep_vs_rem": dict(source="oura", draw=deep_vs_rem_figure, trend=None, rollup=True, index=None, points=200,
+                        band=None, smoothing=None, zoom=True),
+    "deep_sleep_fig": dict(source="oura", draw=deep_sleep_figure, trend=("day", "deep_sleep_duration"), rollup=True,
+                           index=None, points=300, band="deep_sleep_duration", smoothing=None, zoom=True),
+    "rem_sleep_fig": dict(source="oura", draw=rem_sleep_figure, trend=("day", "rem_sleep_duration"), rollup=True,
+                          index=None, points=300, band="rem_sleep_duration", smoothing=None, zoom=True),
+    "run_goal_fig": dict(source="run", draw=run_goal_figure, trend=None, rollup=None, index=distance_index,
+                         points=300, band=None, smoothing=None, zoom=True),
+    "hrv_performance_fig": dict(source="daily", draw=hrv_performance_figure, trend=None, rollup=None,
+                                index=performance_lags, points=None, band=None, smoothing=None, zoom=False),
+    "performance_lags_fig": dict(source="daily", draw=performance_lags_figure, trend=None, rollup=None,
+                                 index=performance_lags, points=None, band=None, smoothing=None, zoom=False)
+}
+
+# Rolling baseline drawn behind the points of the graphs with a 'band': window in days (7, 30 or 60) and band
+# ("std" for the mean plus or minus one standard deviation, "percentile" for the 10th to 90th percentiles)
+band_window = 30
+band_kind = "std"
+
+# Filter the date range in the browser: the daily data of the graphs whose trend line is fitted from prefix sums
+# is sent once (see 'client_chart_data') and date range changes are drawn by 'assets/clientside.js' without
+# reaching the server. The other graphs (deep vs REM sleep, run goal...) are still drawn by the server
+clientside_filtering = False
+
+# Graphs filtered in the browser
+client_charts = [chart for chart in charts
+                 if clientside_filtering and charts[chart]["trend"] is not None and charts[chart]["smoothing"] is None]
+
+# Date column and metrics of the rollup tables of each source (the runs without their outliers, see 'drawn_rows')
+rollup_metrics = {
+    "oura": ("day", ["average_hrv", "lowest_heart_rate", "total_sleep_duration",
+                     "deep_sleep_duration", "rem_sleep_duration"]),
+    "run": ("day", ["Performance"]),
+    "vo2": ("Date", ["VO2 Max(mL/min·kg)"])
+}
+
+# Data derived from each source (prefix sums, rollup tables...), by user, source, version of the data and name
+derived_data = {}
+derived_lock = threading.Lock()
+
+# Derived data being built, by the same keys: other requests for it wait for the first build
+derived_building = {}
+
+
+# Define a function that records the time spent drawing and serializing a figure
+def record_figure(key, build_seconds, serialize_seconds, size):
+    """
+    Records a figure drawn by the figure cache (see the /metrics route): the time spent drawing it (the sum of
+    its steps) and the time spent serializing it. Sizes are recorded for every figure served by 'record_served'.
+
+    Parameters:
+        - key (tuple): cache key of the figure, starting with the callback id of the graph
+        - build_seconds (float): number of seconds spent drawing the figure
+        - serialize_seconds (float): number of seconds spent serializing the figure
+        - size (int): size of the serialized figure in bytes
+    """
+
+    chart = key[0]
+    metrics.figure_seconds.observe(build_seconds, chart=chart, step="build")
+    metrics.figure_seconds.observe(serialize_seconds, chart=chart, step="serialize")
+
+
+# Define a function that records the size of a figure sent to the browser
+def record_served(key, size):
+    """
+    Records the size of the JSON of a figure returned by the figure cache, drawn or cached (see the /metrics route).
+    """
+
+    metrics.figure_bytes.observe(size, chart=key[0])
+
+
+# Define a function that returns the version of the code drawing the figures
+def code_version():
+    """
+    Returns a short hash of the Python files of the app (which hold the settings of the graphs) and of plotly's
+    version, so figures drawn by another version of the app are not read from the disk cache.
+    """
+
+    digest = hashlib.sha1(plotly.__version__.encode())
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+# Figures already drawn, by graph, date range and version of the data (kept on disk across restarts, per version
+# of the code)
+figure_cache = FigureCache(max_size=256, cache_dir="figure_cache", on_build=record_figure, on_serve=record_served,
+                           version=code_version())
+
+# Pool of threads drawing the graphs of a date range concurrently
+figure_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="figures")
+
+# Date ranges whose graphs were already prefetched, by user and versions of the data (the most recent ones)
+prefetched_ranges = OrderedDict()
+prefetched_lock = threading.Lock()
+
+
+# Define a function that returns data derived from a source, built once per version of the data
+def derived(user, source, version, name, build):
+    """
+    Returns the data derived from a user's source (e.g. prefix sums or rollup tables) stored under 'name',
+    building it with 'build' the first time it is requested for this version of the data. Data is built
+    outside of the lock so users don't wait for each other, and only once: requests for data being built
+    wait for that build.
+
+    Parameters:
+        - user (str): name of the user
+        - source (str): name of the source in the loader
+        - version (str): version of the data of the source
+        - name (hashable): name of the derived data
+        - build (callable): function returning the derived data
+
+    Returns:
+        The derived data
+    """
+
+    key = (user, source, version, name)
+    with derived_lock:
+        if key in derived_data:
+            return derived_data[key]
+        future = derived_building.get(key)
+        owner = future is None
+        if owner:
+            future = derived_building[key] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        data = build()
+    except BaseException as error:
+        with derived_lock:
+            del derived_building[key]
+        future.set_exception(error)
+        raise
+
+    with derived_lock:
+        # Forget the data derived from the previous versions of the source
+        for old_key in [k for k in derived_data if k[:2] == (user, source) and k[2] != version]:
+            del derived_data[old_key]
+        data = derived_data.setdefault(key, data)
+        del derived_building[key]
+    future.set_result(data)
+    return data
+
+
+# Define a function that returns data derived from a previous version of a source
+def previous_derived(user, source, name):
+    """
+    Returns the data stored under 'name' for another version of a user's source (the previous one while the
+    new version is built), or None if there is none. Used to update derived data instead of building it again.
+    """
+
+    with derived_lock:
+        for (key_user, key_source, _, key_name), data in derived_data.items():
+            if (key_user, key_source, key_name) == (user, source, name):
+                return data
+    return None
+
+
+# Sources joined by day in the daily table
+daily_sources = ("oura", "run", "vo2")
+
+
+# Define a function that returns the daily table of a user
+def daily_snapshot(user):
+    """
+    Returns the table joining the data of every source of a user by day (see 'daily_table.build_daily_table')
+    and its version, made of the versions of the sources. The table is built once per version, so graphs
+    comparing sources slice this one table instead of merging the sources for each date range.
+
+    Parameters:
+        - user (str): name of the user
+
+    Returns:
+        (table, version), or None while one of the sources is not loaded.
+    """
+
+    # Use one snapshot of each source so the table and its version match even if a source is refreshed meanwhile
+    loader = user_data.get(user)
+    snapshots = [loader.snapshot(source) for source in daily_sources]
+    if any(snapshot is None for snapshot in snapshots):
+        return None
+    (oura, _), (run, _), (vo2, _) = snapshots
+    version = "-".join(version for _, version in snapshots)
+    table = derived(user, "daily", version, "table", lambda: build_daily_table(oura, run, vo2, zone2_outliers))
+    return table, version
+
+
+# Define a function that forgets the data derived from the sources of a user
+def forget_derived(user):
+    """
+    Removes the data derived from the sources of a user, when the user's data is evicted.
+    """
+
+    with derived_lock:
+        for key in [k for k in derived_data if k[0] == user]:
+            del derived_data[key]
+
+
+# Define a function that returns the rows of a source drawn by the graphs
+def drawn_rows(source, data):
+    """
+    Returns the rows of the given source the rollup tables and trend lines are built from: the runs without the
+    outliers, whose robust score is above the threshold whatever the date range (see 'zone2_outliers'), and every
+    row of the other sources.
+    """
+
+    if source == "run":
+        return data.loc[data[zone2_outliers].abs() < OUTLIER_SCORE]
+    return data
+
+
+# Define a function that builds the trend index of a metric of a source
+def source_trend(source, data, x, y):
+    """
+    Returns the prefix sums fitting the trend line of the y column of the given source (see 'trendline.TrendIndex'),
+    over the rows drawn by its graph (see 'drawn_rows').
+    """
+
+    rows = drawn_rows(source, data)
+    return TrendIndex(rows[x], rows[y])
+
+
+# Define a function that builds the rollup tables of a source
+def source_rollups(source, data):
+    """
+    Returns the daily, weekly and monthly rollup tables of the metrics of the given source.
+    """
+
+    date_column, metrics = rollup_metrics[source]
+    rollups = build_rollups(drawn_rows(source, data), date_column, metrics)
+    if source == "oura":
+        rollups = {resolution: format_sleep_columns(table) for resolution, table in rollups.items()}
+    return rollups
+
+
+# Define a function that returns how to draw a graph for a date range
+def figure_job(user, chart, start_date, end_date):
+    """
+    Returns the cache key of the figure of the given graph for the date range and a function drawing it.
+    The graph is drawn per day, week or month depending on the length of the date range, with at most the
+    number of points of the graph.
+
+    Parameters:
+        - user (str): name of the user whose data is drawn
+        - chart (str): the callback id of the graph
+        - start_date (str): start of the date range
+        - end_date (str): end of the date range
+
+    Returns:
+        (key, draw function), or None if the data of the graph is not loaded yet.
+    """
+
+    # Use one snapshot of the source so the data and its version match even if it is refreshed meanwhile
+    source = charts[chart]["source"]
+    snapshot = daily_snapshot(user) if source == "daily" else user_data.get(user).snapshot(source)
+    if snapshot is None:
+        return None
+    data, version = snapshot
+    resolution = choose_resolution(start_date, end_date)
+
+    # Graphs of the runs without rollup add the km run before the runs of the export, which depend on the user
+    offset = users[user]["nike_km"] if source == "run" and charts[chart]["rollup"] is None else None
+
+    def build():
+        kwargs = {} if charts[chart]["points"] is None else {"points": charts[chart]["points"]}
+
+        # Draw a smoothed curve, or fit the trend line from the prefix sums instead of the drawn points
+        if charts[chart]["smoothing"] is not None:
+            kwargs["smoothing"] = charts[chart]["smoothing"]
+        elif charts[chart]["trend"] is not None:
+            with metrics.figure_seconds.time(chart=chart, step="trend"):
+                x, y = charts[chart]["trend"]
+                trend_index = derived(user, source, version, ("trend", x, y), lambda: source_trend(source, data, x, y))
+                kwargs["trend"] = trend_index.fit(start_date, end_date)
+
+        # Rolling baseline of the metric, computed once per version of the data
+        if charts[chart]["band"] is not None:
+            with metrics.figure_seconds.time(chart=chart, step="band"):
+                statistics = derived(user, source, version, "rolling",
+                                     lambda: rolling_statistics(data, rollup_metrics[source][1]))
+                kwargs["band"] = baseline_band(statistics, charts[chart]["band"], band_window, band_kind)
+
+        # Draw the rollup table of the resolution, or the index of the data for the date range
+        with metrics.figure_seconds.time(chart=chart, step="filter"):
+            if charts[chart]["rollup"] is None:
+                table = charts[chart]["index"](user, data, version)
+                kwargs.update(start_date=start_date, end_date=end_date)
+                if offset is not None:
+                    kwargs["offset"] = offset
+            else:
+                rollups = derived(user, source, version, "rollups", lambda: source_rollups(source, data))
+                table = slice_periods(rollups[resolution], start_date, end_date, resolution)
+
+        with metrics.figure_seconds.time(chart=chart, step="draw"):
+            return charts[chart]["draw"](table, **kwargs)
+
+    return (chart, start_date, end_date, version, offset), build
+
+
+# Define a function that returns a graph for a date range, from the cache when it was already drawn
+def chart_figure(user, chart, start_date, end_date):
+    """
+    Returns the figure of the given graph for the date range. Figures are cached by graph, date range,
+    version of their data and user settings they depend on (the km run with Nike Run Club for the run goal),
+    so a new version of the data is drawn again.
+
+    Parameters:
+        - user (str): name of the user whose data is drawn
+        - chart (str): the callback id of the graph
+        - start_date (str): start of the date range
+        - end_date (str): end of the date range
+
+    Returns:
+        The figure, or a "Loading data..." message if its data is not loaded yet.
+    """
 
-# -------------------------------------------------------------------------
-#                                  Metrics
-# -------------------------------------------------------------------------
+    job = figure_job(user, chart, start_date, end_date)
+    if job is None:
+        return message_figure("Loading data...")
+    return figure_cache.get_or_build(*job)
 
-# Average HRV
-avg_hrv = round(oura_data.average_hrv.mean())
 
-# Average lowest HR
-avg_lowhr = round(oura_data.lowest_heart_rate.mean())
+# Define a function that starts drawing a graph in the background
+def prefetch_figure(user, chart, start_date, end_date):
+    """
+    Starts drawing the figure of the given graph for the date range on the figure pool, unless it is
+    already cached, being drawn, or its data is not loaded yet. 'chart_figure' then picks it up.
 
-# Average total sleep
-avg_sleep = round(oura_data.total_sleep_duration.mean())
-avg_sleep = pd.to_datetime(str(datetime.timedelta(seconds=float(avg_sleep)))).strftime("%Hh%M")
+    Parameters:
+        - user (str): name of the user whose data is drawn
+        - chart (str): the callback id of the graph
+        - start_date (str): start of the date range
+        - end_date (str): end of the date range
+    """
 
-# VO2 max
-vo2max = 47.80
+    job = figure_job(user, chart, start_date, end_date)
+    if job is not None:
+        figure_cache.prefetch(*job, figure_pool)
 
-# Number of km run (not counting runs < 1 km)
-run = ah_data.loc[(ah_data["Activity"]=="Running") & (ah_data["Distance(km)"]>1)].reset_index(drop=True)
-km_run = round(run["Distance(km)"].sum(), 0)
-km_run = round(km_run + 1586) # Adding total of km run with Nike Run Club app
 
-# Percentage of run around the world goal
-earth_circumference = 40075
-pct_achieved = round(km_run / earth_circumference * 100, 2)
+# Define a function that starts drawing the graphs of a date range in the background
+def prefetch_range(user, start_date, end_date, loaded_sources):
+    """
+    Starts drawing every graph drawn by the server for the date range (see 'prefetch_figure'), once per user,
+    date range and versions of the data: the callbacks of the other graphs of the same range don't queue
+    them again.
 
-# -------------------------------------------------------------------------
-#                                 Colors
-# -------------------------------------------------------------------------
+    Parameters:
+        - user (str): name of the user whose data is drawn
+        - start_date (str): start of the date range
+        - end_date (str): end of the date range
+        - loaded_sources (dict): versions of the sources loaded by the background loader
+    """
 
-# Create variables for colors to quickly update the aesthetic of the app
-font_color = "#e6e6e6"
-marker_color = "#a02c5a"
+    key = (user, start_date, end_date, tuple(sorted(loaded_sources.items())))
+    with prefetched_lock:
+        if key in prefetched_ranges:
+            return
+        prefetched_ranges[key] = True
+        while len(prefetched_ranges) > 256:
+            prefetched_ranges.popitem(last=False)
 
-# -------------------------------------------------------------------------
-#                              Graph function
-# -------------------------------------------------------------------------
+    for chart in charts:
+        if chart not in client_charts:
+            prefetch_figure(user, chart, start_date, end_date)
 
 
-# Define a function that plots a scatter plot for a given dataframe
-def scatter_plot(
-        df, x, y, ylabel, avg_line_text, hovertemplate, ytickvals=False,
-        annot1_x=-0.18, annot2_x=1.2, margin_l=110, margin_r=115):
+# Define a function that returns the daily data of a graph filtered in the browser
+def client_chart_data(user, chart):
     """
-    Creates a scatter plot with a trend line using the provided dataframe and columns specified.
+    Returns what the browser needs to draw a graph of 'client_charts' for any date range: the graph of the whole
+    history drawn per day (its layout, styles and annotations are reused without its points), the x and y values
+    of each day, the formatted durations of the hover template and the prefix sums of the trend line. It is built
+    once per version of the data.
 
     Parameters:
-    df (pandas.DataFrame): The dataframe to use for the scatter plot.
-    x (str): The column to use for the x-axis.
-    y (str): The column to use for the y-axis.
-    ylabel (str): The label to use for the y-axis.
-    avg_line_text (str): The label to use for the average line on the y-axis.
-    hovertemplate (str): Hovertemplate to use for points.
-    ytickvals (bool): Whether to reformat y ticks or not.
-    annot1_x (float): x position for ylabel text.
-    annot2_x (float): x position for avg_line_text.
-    margin_l (int): Left margin for the plot.
-    margin_r (int): Right margin for the plot.
-    
+        - user (str): name of the user whose data is drawn
+        - chart (str): the callback id of the graph
+
     Returns:
-    fig (plotly.graph_objs._figure.Figure) : The created scatter plot figure.
+        A dict sent to the "client_data" store, or None if the data of the graph is not loaded yet.
     """
-    
-    # Add column to the dataframe to use for a custom hover template
-    df["formatted_duration"] = [
-        pd.to_datetime(str(datetime.timedelta(seconds=float(d)))).strftime("%Hh%M") 
-        for d in df[y]
-    ]
-    
-    # Draw scatter plot with trend line
-    fig = px.scatter(df, x=x, y=y, trendline="ols", trendline_color_override="#ffdd1a",
-                     custom_data=['formatted_duration']  # Add custom data to use in a custom hover template
-                    ) 
-
-    # Reformat y ticks if argument ytickvals is True
-    if ytickvals is True:
-        step = round((df[y].max() - df[y].min()) / 7)
-        ytickvals = np.arange(start=df[y].min(), 
-                              stop=df[y].max(), 
-                              step=step)
-        yticktext = [
-            pd.to_datetime(str(datetime.timedelta(seconds=float(d)))).round("10min").strftime("%Hh%M") 
-            for d in ytickvals
-        ]
-        fig.update_yaxes(tickvals=ytickvals, ticktext=yticktext)
-
-    # Update layout: define the plot's background color, the font and font color, the margins and remove the grid
-    fig.update_layout(paper_bgcolor="#2B2B2B", plot_bgcolor="#2B2B2B", font_family="sans-serif",
-                      font_color=font_color, xaxis_showgrid=False, yaxis_showgrid=False, 
-                      xaxis=dict(title=None, zeroline=False), yaxis=dict(title=None, zeroline=False),
-                      margin=dict(l=margin_l,r=margin_r,b=75,t=10, pad=20), autosize=True
-                      )
 
-    # Update layout: define the markers' size and color and overwrite the hover template with a custom one
-    fig.update_traces(marker=dict(size=7, color=marker_color), hovertemplate=hovertemplate)
+    source = charts[chart]["source"]
+    snapshot = user_data.get(user).snapshot(source)
+    if snapshot is None:
+        return None
+    data, version = snapshot
+    x, y = charts[chart]["trend"]
 
-    # Add title to the y axis with annotation since 'title_standoff' doesn't seem to work in Dash
-    fig.add_annotation(x=annot1_x, xref="paper", y=0.5, yref="paper", text=ylabel, textangle=-90, 
-                       showarrow=False, font=dict(color=font_color, size=14)
-                      )
+    def build():
+        table = derived(user, source, version, "rollups", lambda: source_rollups(source, data))["D"]
+        trend_index = derived(user, source, version, ("trend", x, y), lambda: source_trend(source, data, x, y))
+        days, origin, prefix = trend_index.prefix_sums()
 
-    # Add a horizontal line for the average using 'add_shape' because 'add_hline' doesn't seem to work in Dash
-    fig.add_shape(type="line", xref="paper", x0=0, y0=df[y].mean(), x1=0.98, y1=df[y].mean(),
-                  line=dict(dash="dot", color=font_color, width=1.25)
-                 )
+        # Keep the layout and the style of the traces, their points are sent once below
+        figure = charts[chart]["draw"](table).to_plotly_json()
+        for trace in figure["data"]:
+            for key in ("x", "y", "customdata"):
+                trace.pop(key, None)
 
-    # Add annotation to specify that the horizontal line is the average
-    fig.add_annotation(x=annot2_x, xref="paper", y=df[y].mean(), text=avg_line_text, showarrow=False, 
-                       font=dict(color=font_color, size=12)
-                      )
+        durations = f"{y}_formatted"
+        return {"figure": figure, "x": compact_dates(table[x]), "y": table[y].to_numpy(dtype="float64"),
+                "customdata": table[[durations]].to_numpy() if durations in table.columns else None,
+                "durations": durations in table.columns,
+                "trend": {"days": compact_dates(days), "origin": origin, "prefix": prefix}}
 
-    return fig
+    return derived(user, source, version, ("client", chart), build)
 
 
 # -------------------------------------------------------------------------
@@ -201,7 +1244,7 @@ def scatter_plot(
 
 
 # Define a function that creates a card for a given metric
-def metric_card(metric, title, icon):
+def metric_card(metric, title, icon, metric_id):
     """
     Returns a 'CardGroup' component containing two 'Card' components that display a metric, a title 
     and an icon to illustrate the metric.
@@ -210,6 +1253,7 @@ def metric_card(metric, title, icon):
         - metric (int or float): the numeric value to be displayed on top of the card
         - title (str): the title of the card
         - icon (str): the class of the icon to be displayed inside the card
+        - metric_id (str): the callback id of the metric, used to update it once the data is loaded
 
     Returns:
         A 'CardGroup' component from the 'dash_bootstrap_components' library (which is imported as 'dbc') 
@@ -218,7 +1262,7 @@ def metric_card(metric, title, icon):
     return dbc.CardGroup(
                [
                    dbc.Card(
-                       dbc.CardBody([html.H2(metric), html.H5(title, className="card-text")]),
+                       dbc.CardBody([html.H2(metric, id=metric_id), html.H5(title, className="card-text")]),
                        style={
                            "color":font_color, "background-color":"#2B2B2B",
                            "font-family":"sans-serif", "padding":"0px"
@@ -272,27 +1316,31 @@ def graph_card(title, figure):
     
     
 # Card 1: Average HRV 
-hrv_card = metric_card(metric=f"{avg_hrv} ms",
+hrv_card = metric_card(metric=placeholder,
                        title="Average HRV", 
-                       icon="fa fa-heartbeat"
+                       icon="fa fa-heartbeat",
+                       metric_id="avg_hrv"
                       )
 
 # Card 2: Average lowest heart rate
-lowhr_card = metric_card(metric=f"{avg_lowhr} bpm",
+lowhr_card = metric_card(metric=placeholder,
                        title="Average lowest HR", 
-                       icon="fa fa-heartbeat"
+                       icon="fa fa-heartbeat",
+                       metric_id="avg_lowhr"
                       )
 
 # Card 3: Average sleep
-sleep_card = metric_card(metric=f"{avg_sleep}",
+sleep_card = metric_card(metric=placeholder,
                        title="Average sleep duration", 
-                       icon="fa fa-bed"
+                       icon="fa fa-bed",
+                       metric_id="avg_sleep"
                       )
 
 # Card 4: VO2 max
 vo2max_card = metric_card(metric=f"{vo2max}",
                        title="VO2 max", 
-                       icon="fa fa-bicycle"
+                       icon="fa fa-bicycle",
+                       metric_id="vo2max"
                       )
 
 # Card 5: Number of km run + the percentage of the earth's circumference displayed as a progress bar
@@ -300,17 +1348,18 @@ run_goal_card = dbc.Card(
                     dbc.CardBody(
                         [
                             html.H2(
-                                f"{km_run:,} km run since Oct 2016".replace(',', ' '), 
-                                className="card-title"
+                                f"{placeholder} km run since Oct 2016", 
+                                className="card-title", id="km_run"
                             ),
                             html.H5(
                                 "Percentage of the earth's circumference (40 075 km)",
                                 className="card-text"
                             ),
                             dbc.Progress(
-                                children=[f"{pct_achieved}%"], value=pct_achieved, max=100,
+                                id="run_progress", value=0, max=100,
                                 color="warning", style={"height": "20px", "background-color": "#1E1E1E"}
-                            )
+                            ),
+                            html.H6(className="card-text", id="run_projection", style={"margin-top": "10px"})
                         ]
                     ),
                     style={"color":font_color, "background-color":"#2B2B2B", "font-family":"sans-serif"},
@@ -338,6 +1387,16 @@ deep_sleep_graph_card = graph_card(title="Deep sleep trend", figure="deep_sleep_
 # Card 12: REM sleep trend graph
 rem_sleep_graph_card = graph_card(title="REM sleep trend", figure="rem_sleep_fig")
 
+# Card 13: Run around the world progress graph
+run_goal_graph_card = graph_card(title="Run around the world progress", figure="run_goal_fig")
+
+# Card 14: HRV vs next-day Zone 2 performance graph
+hrv_performance_card = graph_card(title="HRV vs next-day Zone 2 performance", figure="hrv_performance_fig")
+
+# Card 15: Correlation of the Oura metrics with the Zone 2 performance by lag
+performance_lags_card = graph_card(title="Sleep and Zone 2 performance correlation by lag",
+                                   figure="performance_lags_fig")
+
 # -------------------------------------------------------------------------
 #                                App layout
 # -------------------------------------------------------------------------
@@ -354,133 +1413,201 @@ app = dash.Dash(__name__, external_stylesheets=[dbc.themes.DARKLY, FONT_AWESOME]
                 suppress_callback_exceptions=True
                )
 
-# Define app layout
-app.layout = dbc.Container(
-                 [
-                    # Cards displaying each metric (HRV, Lowest HR, Total sleep and VO2 max)
-                    dbc.Row(
-                        [
-                            dbc.Col(
-                                hrv_card, style={"margin-bottom":"25px"}, 
-                                xs=12, sm=6, md=6, lg=3, xl=3
-                            ),
-                            dbc.Col(
-                                lowhr_card, style={"margin-bottom":"25px"}, 
-                                xs=12, sm=6, md=6, lg=3, xl=3
-                            ),
+# Compress the responses (mostly the JSON of the figures) with Brotli, or gzip for browsers that don't accept
+# it. Dash's own 'compress' option only enables gzip
+app.server.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+Compress(app.server)
+
+# Define a function that builds the layout of the app
+@functools.lru_cache(maxsize=1)
+def build_layout(today):
+    """
+    Returns the layout of the app with the date picker ending on the given day. The layout is static apart from
+    the dates, so the tree is built once per day and the same snapshot is served to every page load.
+
+    Parameters:
+        - today (datetime.date): last day of the date picker
+
+    Returns:
+        A 'Container' component from the 'dash_bootstrap_components' library
+    """
+
+    return dbc.Container(
+                     [
+                        # Cards displaying each metric (HRV, Lowest HR, Total sleep and VO2 max)
+                        dbc.Row(
+                            [
+                                dbc.Col(
+                                    hrv_card, style={"margin-bottom":"25px"}, 
+                                    xs=12, sm=6, md=6, lg=3, xl=3
+                                ),
+                                dbc.Col(
+                                    lowhr_card, style={"margin-bottom":"25px"}, 
+                                    xs=12, sm=6, md=6, lg=3, xl=3
+                                ),
+                                dbc.Col(
+                                    sleep_card, style={"margin-bottom":"25px"},
+                                    xs=12, sm=6, md=6, lg=3, xl=3
+                                ),
+                                dbc.Col(
+                                    vo2max_card, style={"margin-bottom":"25px"},
+                                    xs=12, sm=6, md=6, lg=3, xl=3
+                                )
+                            ],
+                            className="g-0"
+                        ),
+                        # Run goal
+                        dbc.Row(
                             dbc.Col(
-                                sleep_card, style={"margin-bottom":"25px"},
-                                xs=12, sm=6, md=6, lg=3, xl=3
+                                run_goal_card, style={"margin-bottom":"42px"},
+                                xs=12, sm=12, md=12, lg=12, xl=12
                             ),
-                            dbc.Col(
-                                vo2max_card, style={"margin-bottom":"25px"},
-                                xs=12, sm=6, md=6, lg=3, xl=3
-                            )
-                        ],
-                        className="g-0"
-                    ),
-                    # Run goal
-                    dbc.Row(
-                        dbc.Col(
-                            run_goal_card, style={"margin-bottom":"42px"},
-                            xs=12, sm=12, md=12, lg=12, xl=12
                         ),
-                    ),
-                    # Graphs
-                    dbc.Row(
-                        [
-                            dbc.Col(
-                                # Calendar to change the date range
-                                dcc.DatePickerRange(id="my-date-picker-range",  # ID to be used for callback
-                                                    calendar_orientation="horizontal",  # vertical or horizontal
-                                                    day_size=39, # size of calendar image. Default is 39
-                                                    start_date_placeholder_text="Start date",  # text that appears when no start date chosen
-                                                    end_date_placeholder_text="End date",  # text that appears when no end date chosen
-                                                    with_portal=False,  # if True calendar will open in a full screen overlay portal
-                                                    first_day_of_week=1,  # Display of calendar when open (0 = Sunday)
-                                                    reopen_calendar_on_clear=True,
-                                                    is_RTL=False,  # True or False for direction of calendar
-                                                    clearable=True,  # whether or not the user can clear the dropdown
-                                                    number_of_months_shown=1,  # number of months shown when calendar is open
-                                                    min_date_allowed=datetime.datetime(2021, 6, 12),  # minimum date allowed on the DatePickerRange component
-                                                    max_date_allowed=datetime.datetime.now().date() + datetime.timedelta(days=1),  # maximum date allowed on the DatePickerRange component
-                                                    initial_visible_month=datetime.datetime.now().date(),  # the month initially presented when the user opens the calendar
-                                                    start_date=datetime.datetime(2021, 6, 12).date(),
-                                                    end_date=datetime.datetime.now().date(),
-                                                    display_format="MMM Do, YY",  # how selected dates are displayed in the DatePickerRange component.
-                                                    month_format="MMMM, YYYY",  # how calendar headers are displayed when the calendar is opened.
-                                                    minimum_nights=1,  # minimum number of days between start and end date
-                                                    persistence=True,
-                                                    persisted_props=["start_date", "end_date"],
-                                                    persistence_type="memory",  # session, local, or memory. Default is 'local'
-                                                    updatemode="singledate", # singledate or bothdates. Determines when callback is triggered.
-                                                    className="ml-1 mr-1"                                                    
+                        # Graphs
+                        dbc.Row(
+                            [
+                                dbc.Col(
+                                    # Calendar to change the date range
+                                    dcc.DatePickerRange(id="my-date-picker-range",  # ID to be used for callback
+                                                        calendar_orientation="horizontal",  # vertical or horizontal
+                                                        day_size=39, # size of calendar image. Default is 39
+                                                        start_date_placeholder_text="Start date",  # text that appears when no start date chosen
+                                                        end_date_placeholder_text="End date",  # text that appears when no end date chosen
+                                                        with_portal=False,  # if True calendar will open in a full screen overlay portal
+                                                        first_day_of_week=1,  # Display of calendar when open (0 = Sunday)
+                                                        reopen_calendar_on_clear=True,
+                                                        is_RTL=False,  # True or False for direction of calendar
+                                                        clearable=True,  # whether or not the user can clear the dropdown
+                                                        number_of_months_shown=1,  # number of months shown when calendar is open
+                                                        min_date_allowed=datetime.datetime(2021, 6, 12),  # minimum date allowed on the DatePickerRange component
+                                                        max_date_allowed=today + datetime.timedelta(days=1),  # maximum date allowed on the DatePickerRange component
+                                                        initial_visible_month=today,  # the month initially presented when the user opens the calendar
+                                                        start_date=datetime.datetime(2021, 6, 12).date(),
+                                                        end_date=today,
+                                                        display_format="MMM Do, YY",  # how selected dates are displayed in the DatePickerRange component.
+                                                        month_format="MMMM, YYYY",  # how calendar headers are displayed when the calendar is opened.
+                                                        minimum_nights=1,  # minimum number of days between start and end date
+                                                        persistence=True,
+                                                        persisted_props=["start_date", "end_date"],
+                                                        persistence_type="memory",  # session, local, or memory. Default is 'local'
+                                                        updatemode="singledate", # singledate or bothdates. Determines when callback is triggered.
+                                                        className="ml-1 mr-1"                                                    
+                                    ),
+                                    style={"margin-bottom":"25px"}
+                                )
+                            ]
+                        ),
+                        dbc.Row(
+                            [
+                                # HRV trend
+                                dbc.Col(
+                                    hrv_graph_card, style={"margin-bottom":"42px"},
+                                    xs=12, sm=12, md=12, lg=12, xl=6
                                 ),
-                                style={"margin-bottom":"25px"}
-                            )
-                        ]
-                    ),
-                    dbc.Row(
-                        [
-                            # HRV trend
-                            dbc.Col(
-                                hrv_graph_card, style={"margin-bottom":"42px"},
-                                xs=12, sm=12, md=12, lg=12, xl=6
-                            ),
-                            # Zone 2 trend
+                                # Zone 2 trend
+                                dbc.Col(
+                                    zone2_graph_card, style={"margin-bottom":"42px"},
+                                    xs=12, sm=12, md=12, lg=12, xl=6
+                                )
+                            ]
+                        ),
+                        dbc.Row(
+                            [
+                                # VO2 max trend
+                                dbc.Col(
+                                    vo2_graph_card, style={"margin-bottom":"42px"},
+                                    xs=12, sm=12, md=12, lg=6, xl=6
+                                ),
+                                # Total sleep trend
+                                dbc.Col(
+                                    sleep_graph_card, style={"margin-bottom":"42px"},
+                                    xs=12, sm=12, md=12, lg=6, xl=6
+                                )
+                            ]
+                        ),
+                        dbc.Row(
+                            # Deep sleep vs REM sleep
                             dbc.Col(
-                                zone2_graph_card, style={"margin-bottom":"42px"},
-                                xs=12, sm=12, md=12, lg=12, xl=6
+                                deep_vs_rem_card, style={"margin-bottom":"42px"},
+                                xs=12, sm=12, md=12, lg=12, xl=12
                             )
-                        ]
-                    ),
-                    dbc.Row(
-                        [
-                            # VO2 max trend
-                            dbc.Col(
-                                vo2_graph_card, style={"margin-bottom":"42px"},
-                                xs=12, sm=12, md=12, lg=6, xl=6
-                            ),
-                            # Total sleep trend
+                        ),
+                        dbc.Row(
+                            [
+                                # Deep sleep trend
+                                dbc.Col(
+                                    deep_sleep_graph_card, style={"margin-bottom":"42px"},
+                                    xs=12, sm=12, md=12, lg=6, xl=6
+                                ),
+                                # REM sleep trend
+                                dbc.Col(rem_sleep_graph_card, style={"margin-bottom":"42px"},
+                                        xs=12, sm=12, md=12, lg=6, xl=6
+                                )
+                            ]
+                        ),
+                        dbc.Row(
+                            # Run around the world progress
                             dbc.Col(
-                                sleep_graph_card, style={"margin-bottom":"42px"},
-                                xs=12, sm=12, md=12, lg=6, xl=6
+                                run_goal_graph_card, style={"margin-bottom":"42px"},
+                                xs=12, sm=12, md=12, lg=12, xl=12
                             )
-                        ]
-                    ),
-                    dbc.Row(
-                        # Deep sleep vs REM sleep
-                        dbc.Col(
-                            deep_vs_rem_card, style={"margin-bottom":"42px"},
-                            xs=12, sm=12, md=12, lg=12, xl=12
-                        )
-                    ),
-                    dbc.Row(
-                        [
-                            # Deep sleep trend
-                            dbc.Col(
-                                deep_sleep_graph_card, style={"margin-bottom":"42px"},
-                                xs=12, sm=12, md=12, lg=6, xl=6
-                            ),
-                            # REM sleep trend
-                            dbc.Col(rem_sleep_graph_card, style={"margin-bottom":"42px"},
+                        ),
+                        dbc.Row(
+                            [
+                                # HRV vs next-day Zone 2 performance
+                                dbc.Col(
+                                    hrv_performance_card, style={"margin-bottom":"42px"},
                                     xs=12, sm=12, md=12, lg=6, xl=6
+                                ),
+                                # Correlation with the Zone 2 performance by lag
+                                dbc.Col(
+                                    performance_lags_card, style={"margin-bottom":"42px"},
+                                    xs=12, sm=12, md=12, lg=6, xl=6
+                                )
+                            ]
+                        ),
+                        # LinkedIn animated logo
+                        dbc.Row(
+                            dbc.Col(
+                                html.A(
+                                    html.Div(de.Lottie(options=options, width="50%", height="50%", url=url)),
+                                    href="https://www.linkedin.com/in/zaki-abdelwahed/", target="_blank"
+                                ),
+                                width=1
                             )
-                        ]
-                    ),
-                    # LinkedIn animated logo
-                    dbc.Row(
-                        dbc.Col(
-                            html.A(
-                                html.Div(de.Lottie(options=options, width="50%", height="50%", url=url)),
-                                href="https://www.linkedin.com/in/zaki-abdelwahed/", target="_blank"
-                            ),
-                            width=1
-                        )
-                    )
-                 ],
-                 style={"padding":"35px"}, fluid=True
-             )
+                        ),
+                        # Details of a night, opened by clicking a point of the HRV or sleep graphs
+                        dbc.Modal(
+                            [
+                                dbc.ModalHeader(id="night_title"),
+                                dbc.ModalBody(dbc.Spinner(dcc.Graph(id="night_fig", config={"displayModeBar": False})),
+                                              style={"background-color":"#2B2B2B"})
+                            ],
+                            id="night_modal", size="xl", is_open=False, centered=True
+                        ),
+                        # Poll the background loader, every second until every source is loaded then every minute
+                        # to pick up refreshed data
+                        dcc.Interval(id="load_interval", interval=1000),
+                        dcc.Store(id="loaded_sources"),
+                        # Daily data of the graphs filtered in the browser (see 'clientside_filtering')
+                        dcc.Store(id="client_data")
+                     ],
+                     style={"padding":"35px"}, fluid=True
+                 )
+
+
+# Define a function that returns the layout of the app
+def serve_layout():
+    """
+    Returns the layout snapshot of the current day (see 'build_layout'). Dash calls it on each page load, so a
+    server running for several days keeps offering today's date.
+    """
+
+    return build_layout(datetime.date.today())
+
+
+# Define app layout, built on the first page load instead of when the app starts
+app.layout = serve_layout
 
 # -------------------------------------------------------------------------
 #                                Callbacks
@@ -488,329 +1615,286 @@ app.layout = dbc.Container(
 
 @app.callback(
     [
-        Output("hrv_fig", "figure"), 
-        Output("zone2_fig", "figure"),
-        Output("vo2max_fig", "figure"),
-        Output("sleep_fig", "figure"),
-        Output("deep_vs_rem", "figure"), 
-        Output("deep_sleep_fig", "figure"),
-        Output("rem_sleep_fig", "figure")
+        Output("loaded_sources", "data"),
+        Output("load_interval", "interval")
     ],
+    Input("load_interval", "n_intervals"),
+    State("loaded_sources", "data")
+)
+
+# Define a function that checks which sources the background loader has loaded or refreshed
+def poll_sources(n_intervals, loaded_sources):
+    """
+    Returns the version of each loaded source and polls less often once every source is loaded (or failed).
+    The versions are only sent when they changed, so the cards and graphs are only redrawn when a source is
+    loaded or its data changed after a refresh.
+
+    Parameters:
+        - n_intervals (int): number of times the interval fired
+        - loaded_sources (dict): versions of the sources loaded at the previous poll
+
+    Returns:
+        The versions of the loaded sources and the polling interval in milliseconds.
+    """
+
+    loader = user_data.get(current_user())
+    versions = loader.versions()
+    interval = 60 * 1000 if loader.done() else 1000
+    return (dash.no_update if versions == loaded_sources else versions), interval
+
+
+@app.callback(
     [
-        Input("my-date-picker-range", "start_date"),
-        Input("my-date-picker-range", "end_date")
-    ]
+        Output("avg_hrv", "children"),
+        Output("avg_lowhr", "children"),
+        Output("avg_sleep", "children"),
+        Output("km_run", "children"),
+        Output("run_progress", "children"),
+        Output("run_progress", "value"),
+        Output("run_projection", "children")
+    ],
+    Input("loaded_sources", "data")
 )
 
-# Define a function that updates the output when the callback is triggered
-def update_output(start_date, end_date):
+# Define a function that fills the metric cards once their data is loaded
+def update_cards(loaded_sources):
+    """
+    Returns the metrics displayed on the cards. Cards whose data is not loaded yet keep their placeholder.
+    They are computed again whenever a source is refreshed with new data.
+
+    Parameters:
+        - loaded_sources (dict): versions of the sources loaded by the background loader
+
+    Returns:
+        The average HRV, the average lowest HR, the average sleep duration, the number of km run, the
+        percentage of the earth's circumference (as text and as value of the progress bar) and the projected
+        date of completion.
+    """
+
+    avg_hrv = avg_lowhr = avg_sleep = km_run = pct_text = pct_achieved = projection = dash.no_update
+    user = current_user()
+    loader = user_data.get(user)
+
+    # Users without synced nights yet (no data, so no averages) keep the placeholders of the Oura cards
+    oura_data = loader.get("oura")
+    if oura_data is not None:
+        hrv, lowhr, sleep = oura_data[["average_hrv", "lowest_heart_rate", "total_sleep_duration"]].mean()
+
+        # Average HRV
+        if not pd.isna(hrv):
+            avg_hrv = f"{round(hrv)} ms"
+
+        # Average lowest HR
+        if not pd.isna(lowhr):
+            avg_lowhr = f"{round(lowhr)} bpm"
+
+        # Average total sleep
+        if not pd.isna(sleep):
+            avg_sleep = format_duration(round(sleep)).item()
+
+    snapshot = loader.snapshot("run")
+    if snapshot is not None:
+        # Number of km run from the distance index of the runs, adding total of km run with Nike Run Club app
+        index = distance_index(user, *snapshot)
+        total_km = round(round(index.total, 0) + users[user]["nike_km"])
+        km_run = f"{total_km:,} km run since Oct 2016".replace(',', ' ')
+
+        # Percentage of run around the world goal
+        pct_achieved = round(total_km / earth_circumference * 100, 2)
+        pct_text = [f"{pct_achieved}%"]
+
+        # Date the goal will be reached at the pace of the last 90 days
+        completion = index.projected_completion(earth_circumference, offset=users[user]["nike_km"])
+        projection = "" if completion is None else f"At the current pace, around the world on {completion:%b %d, %Y}"
+
+    return avg_hrv, avg_lowhr, avg_sleep, km_run, pct_text, pct_achieved, projection
+
+
+# Define a function that returns the date range the user zoomed to on a graph
+def zoomed_range(relayout_data):
+    """
+    Returns the date range of the x axis from the 'relayoutData' of a graph: (start_date, end_date) after a zoom or pan,
+    "reset" when the user double-clicks to autoscale, None for other changes (e.g. the graph being resized).
+    """
+
+    if not relayout_data:
+        return None
+    if relayout_data.get("xaxis.autorange"):
+        return "reset"
+
+    # Zooming sends "xaxis.range[0]" and "xaxis.range[1]", some changes send "xaxis.range" instead
+    x_range = relayout_data.get("xaxis.range") or [relayout_data.get("xaxis.range[0]"),
+                                                   relayout_data.get("xaxis.range[1]")]
+    if None in x_range:
+        return None
+    return tuple(pd.Timestamp(date).strftime("%Y-%m-%d") for date in x_range)
+
+
+# Define a function that updates a graph when the callback is triggered
+def update_output(chart, start_date, end_date, loaded_sources, relayout_data=None):
     """
-    Returns an updated version of each graph based on a given date range specified by the start_date and end_date parameters.
+    Returns an updated version of a graph based on a given date range specified by the start_date and end_date parameters.
     If there are not enough data points within the given date range, a message saying "Not enough data. Try a different date range." 
-    will be displayed instead of the graph.
+    will be displayed instead of the graph. Graphs whose data is still loading display "Loading data..." and are redrawn
+    once the background loader has loaded their source, or refreshed it with new data. Graphs display the data of
+    the logged-in user.
+
+    Each graph has its own callback so it is sent to the browser as soon as it is drawn. The first callback of a
+    date range also starts drawing the other graphs on the figure pool, so they are drawn concurrently.
+
+    Graphs are downsampled to a fixed number of points. When the user zooms on a graph, it is redrawn for the zoomed
+    range, which has less days and is drawn with more details (every point once the range is short enough). Graphs
+    whose x axis doesn't hold dates (see the 'zoom' of 'charts') are only zoomed in the browser.
 
     Parameters:
+        - chart (str): the callback id of the graph
         - start_date (str): start of the date range
         - end_date (str): end of the date range
+        - loaded_sources (dict): versions of the sources loaded by the background loader
+        - relayout_data (dict): last zoom, pan or autoscale of the graph, None for graphs without date zoom
 
     Returns:
-        The updated graph for each card.
+        The updated graph.
     """
 
-    # Update the Oura ring dataframe based on the date range specified
-    oura = oura_data.loc[
-        (oura_data.day.apply(lambda x: x.date()) >= pd.to_datetime(start_date).date()) 
-        & (oura_data.day.apply(lambda x: x.date()) <= pd.to_datetime(end_date).date())
-        ]
-    
-    # Update the Apple Health running dataframe based on the date range specified
-    new_run = run.loc[
-        (run.day.apply(lambda x: x.date()) >= pd.to_datetime(start_date).date()) 
-        & (run.day.apply(lambda x: x.date()) <= pd.to_datetime(end_date).date())
-        ]
-    
-    # Update the Apple Health VO2 max dataframe based on the date range specified
-    new_vo2 = vo2.loc[
-        (vo2.Date.apply(lambda x: x.date()) >= pd.to_datetime(start_date).date()) 
-        & (vo2.Date.apply(lambda x: x.date()) <= pd.to_datetime(end_date).date())
-        ]
-    
-    # HRV trend graph
-    if oura.shape[0] >= 2:
-        # Draw graph
-        hrv_fig = scatter_plot(df=oura, x="day", y="average_hrv", ylabel="HRV (ms)",
-                               hovertemplate="%{x} - %{y} ms", avg_line_text="Average HRV",
-                               ytickvals=False, annot1_x=-0.15, annot2_x=1.15, 
-                               margin_l=97.5, margin_r=102.5,
-                              )
-    else:
-        # Show message saying "Not enough data. Try a different date range."
-        hrv_fig = go.Figure()
-
-        # Update layout: define the plot's background color, the font and font color, the margins and remove the grid
-        hrv_fig.update_layout(paper_bgcolor="#2B2B2B", plot_bgcolor="#2B2B2B",
-                              xaxis=dict(showgrid=False, zeroline=False),
-                              yaxis=dict(showgrid=False, zeroline=False),
-                              margin=dict(l=0,r=0,b=0,t=0, pad=0)
-                             )
-
-        # Add annotation: "Not enough data. Try a different date range."
-        hrv_fig.add_annotation(x=0.5, xref="paper", y=0.5, yref="paper",
-                               text="Not enough data. Try a different date range.", 
-                               showarrow=False, font=dict(color=font_color, size=16)
-                              )
-                             
-
-    # Zone 2 performance trend
-
-    # Calculate pace per run
-    new_run["pace(km/h)"] = new_run["Distance(km)"] * 3600 / new_run["Duration(s)"]
-
-    # Divide average pace by average heart rate to compare performances
-    new_run["Performance"] = new_run["pace(km/h)"] / new_run["Heart rate: Average(count/min)"]
-
-    # Remove outliers (values greater than 3 standard deviations from the mean)
-    new_run = new_run.loc[abs(stats.zscore(new_run["Performance"])) < 3]
-
-    # Scatter plot
-    if new_run.shape[0] >= 2:
-        # Draw graph
-        zone2_fig = scatter_plot(df=new_run, x="day", y="Performance", 
-                                 ylabel="Performance (Speed / Average HR)",
-                                 hovertemplate="%{x} - %{y:.3f}",
-                                 avg_line_text="Average performance", ytickvals=False,
-                                 annot1_x=-0.2, annot2_x=1.26, margin_l=117.5, margin_r=145
-                                )
-    else:
-        # Show message saying "Not enough data. Try a different date range."
-        zone2_fig = go.Figure()
-
-        # Update layout: define the plot's background color, the font and font color, the margins and remove the grid
-        zone2_fig.update_layout(paper_bgcolor="#2B2B2B", plot_bgcolor="#2B2B2B",
-                                xaxis=dict(showgrid=False, zeroline=False),
-                                yaxis=dict(showgrid=False, zeroline=False),
-                                margin=dict(l=0,r=0,b=0,t=0, pad=0)
-                               )
-        
-        # Add annotation "Not enough data. Try a different date range."
-        zone2_fig.add_annotation(x=0.5, xref="paper", y=0.5, yref="paper",
-                                 text="Not enough data. Try a different date range.", 
-                                 showarrow=False, font=dict(color=font_color, size=16)
-                                )
-        
-    # VO2 max trend
-    if new_vo2.shape[0] >= 2:
-        # Draw graph
-        vo2max_fig = scatter_plot(df=new_vo2, x="Date", y="VO2 Max(mL/min·kg)", 
-                                  ylabel="VO2 max (ml/min/kg)", hovertemplate="%{x} - %{y:.1f}",
-                                  avg_line_text="Average VO2 max", ytickvals=False,
-                                  annot1_x=-0.2, annot2_x=1.26, margin_l=117.5, margin_r=145
-                                 )
-    else:
-        # Show message saying "Not enough data. Try a different date range."
-        zone2_fig = go.Figure()
-
-        # Update layout: define the plot's background color, the font and font color, the margins and remove the grid
-        zone2_fig.update_layout(paper_bgcolor="#2B2B2B", plot_bgcolor="#2B2B2B",
-                                xaxis=dict(showgrid=False, zeroline=False),
-                                yaxis=dict(showgrid=False, zeroline=False),
-                                margin=dict(l=0,r=0,b=0,t=0, pad=0)
-                               )
-        
-        # Add annotation "Not enough data. Try a different date range."
-        zone2_fig.add_annotation(x=0.5, xref="paper", y=0.5, yref="paper",
-                                 text="Not enough data. Try a different date range.", 
-                                 showarrow=False, font=dict(color=font_color, size=16)
-                                )
-    
-    # Total sleep trend
-    if oura.shape[0] >= 2:
-        # Draw graph
-        sleep_fig = scatter_plot(df=oura, x="day", y="total_sleep_duration", 
-                                 ylabel="Total sleep duration", hovertemplate="%{x} - %{customdata[0]}",
-                                 avg_line_text="Average total sleep", ytickvals=True,
-                                 annot1_x=-0.2, annot2_x=1.22, margin_l=117.5, margin_r=130
-                                )
-    else:
-        # Show message saying "Not enough data. Try a different date range."
-        sleep_fig = go.Figure()
-
-        # Update layout: define the plot's background color, the font and font color, the margins and remove the grid
-        sleep_fig.update_layout(paper_bgcolor="#2B2B2B", plot_bgcolor="#2B2B2B",
-                                xaxis=dict(showgrid=False, zeroline=False),
-                                yaxis=dict(showgrid=False, zeroline=False),
-                                margin=dict(l=0,r=0,b=0,t=0, pad=0)
-                               )
-
-        # Add annotation "Not enough data. Try a different date range." 
-        sleep_fig.add_annotation(x=0.5, xref="paper", y=0.5, yref="paper",
-                                 text="Not enough data. Try a different date range.", 
-                                 showarrow=False, font=dict(color=font_color, size=16)
-                                )
-        
-    # Deep sleep trend
-    if oura.shape[0] >= 2:
-        # Draw graph
-        deep_sleep_fig = scatter_plot(df=oura, x="day", y="deep_sleep_duration", 
-                                      ylabel="Deep sleep duration",         
-                                      hovertemplate="%{x} - %{customdata[0]}",
-                                      avg_line_text="Average deep sleep", ytickvals=True,
-                                      annot1_x=-0.2, annot2_x=1.22, margin_l=117.5, margin_r=130
-                                     )
-    else:
-        # Show message saying "Not enough data. Try a different date range."
-        deep_sleep_fig = go.Figure()
-
-        # Update layout
-        deep_sleep_fig.update_layout(paper_bgcolor="#2B2B2B", plot_bgcolor="#2B2B2B",
-                                     xaxis=dict(showgrid=False, zeroline=False),
-                                     yaxis=dict(showgrid=False, zeroline=False),
-                                     margin=dict(l=0,r=0,b=0,t=0, pad=0)
-                                    )
+    # Wait for the first poll of the background loader
+    if loaded_sources is None:
+        raise dash.exceptions.PreventUpdate
 
-        # Add annotation "Not enough data. Try a different date range."
-        deep_sleep_fig.add_annotation(x=0.5, xref="paper", y=0.5, yref="paper",
-                                      text="Not enough data. Try a different date range.", 
-                                      showarrow=False, font=dict(color=font_color, size=16)
-                                     )
-
-    # REM sleep trend
-    if oura.shape[0] >= 2:
-        # Draw graph
-        rem_sleep_fig = scatter_plot(df=oura, x="day", y="rem_sleep_duration", 
-                                     ylabel="REM sleep duration", 
-                                     hovertemplate="%{x} - %{customdata[0]}",
-                                     avg_line_text="Average REM sleep", ytickvals=True,
-                                     annot1_x=-0.2, annot2_x=1.22, margin_l=117.5, margin_r=130
-                                    )
-    else:
-        # Show message saying "Not enough data. Try a different date range."
-        rem_sleep_fig = go.Figure()
-
-        # Update layout: define the plot's background color, the font and font color, the margins and remove the grid
-        rem_sleep_fig.update_layout(paper_bgcolor="#2B2B2B", plot_bgcolor="#2B2B2B",
-                                    xaxis=dict(showgrid=False, zeroline=False),
-                                    yaxis=dict(showgrid=False, zeroline=False),
-                                    margin=dict(l=0,r=0,b=0,t=0, pad=0)
-                                   )
-
-        # Add annotation "Not enough data. Try a different date range."
-        rem_sleep_fig.add_annotation(x=0.5, xref="paper", y=0.5, yref="paper",
-                                     text="Not enough data. Try a different date range.", 
-                                     showarrow=False, font=dict(color=font_color, size=16)
-                                    )
-        
-    # Deep sleep vs REM sleep
-    
-    if oura.shape[0] < 2:
-        # Show message saying "Not enough data. Try a different date range."
-        deep_vs_rem = go.Figure()
-
-        # Update layout: define the plot's background color, the font and font color, the margins and remove the grid
-        deep_vs_rem.update_layout(paper_bgcolor="#2B2B2B", plot_bgcolor="#2B2B2B",
-                                  xaxis=dict(showgrid=False, zeroline=False),
-                                  yaxis=dict(showgrid=False, zeroline=False),
-                                  margin=dict(l=0,r=0,b=0,t=0, pad=0)
-                                 )
-
-        # Add annotation "Not enough data. Try a different date range."
-        deep_vs_rem.add_annotation(x=0.5, xref="paper", y=0.5, yref="paper",
-                                   text="Not enough data. Try a different date range.", 
-                                   showarrow=False, font=dict(color=font_color, size=16)
-                                  )
-    else:
-        # Draw graph
-        
-        # Create a plot with 2 y axis
-        deep_vs_rem = make_subplots(specs=[[{"secondary_y": True}]])
-
-        # Create customdata to control the hover
-        customdata1 = pd.DataFrame()
-        customdata1[0] = pd.to_datetime(oura.day).apply(lambda x : x.strftime("%b %d, %Y"))
-        customdata1[1] = oura.deep_sleep_duration.apply(lambda x: str(datetime.timedelta(seconds=x)))
-        customdata1[1] = pd.to_datetime(customdata1[1]).apply(lambda x : x.strftime("%Hh%M"))
-        customdata2 = pd.DataFrame()
-        customdata2[0] = pd.to_datetime(oura.day).apply(lambda x : x.strftime("%b %d, %Y"))
-        customdata2[1] = oura.rem_sleep_duration.apply(lambda x: str(datetime.timedelta(seconds=x)))
-        customdata2[1] = pd.to_datetime(customdata2[1]).apply(lambda x : x.strftime("%Hh%M"))
-
-        # Add the deep sleep graph
-        deep_vs_rem.add_trace(go.Scatter(x=oura.day, y=oura.deep_sleep_duration, 
-                                         name="Deep sleep", marker_color="#ffdd1a",
-                                         customdata=customdata1, 
-                                         hovertemplate="%{customdata[0]} - %{customdata[1]}"
-                                        ),
-                                        secondary_y=False,
-                             )
-
-        # Add the REM sleep graph
-        deep_vs_rem.add_trace(go.Scatter(x=oura.day, y=oura.rem_sleep_duration, 
-                                         name="REM sleep", marker_color=marker_color,
-                                         customdata=customdata2,
-                                         hovertemplate="%{customdata[0]} - %{customdata[1]}"
-                                        ),
-                                        secondary_y=True
-                             )
-
-        # Update layout: define the plot's background color, the font and font color, the margins and remove the grid
-        deep_vs_rem.update_layout(paper_bgcolor="#2B2B2B", plot_bgcolor = "#2B2B2B",
-                                  font_family = "sans-serif", font_color=font_color,
-                                  xaxis_showgrid=False, yaxis_showgrid=False, 
-                                  margin=dict(l=120,r=130,b=75,t=10, pad=20))
-
-        # # Reformat y ticks so that the sleep duration is the hh:mm format
-        if oura["deep_sleep_duration"].max() > oura["rem_sleep_duration"].max():
-            max_value = oura["deep_sleep_duration"].max()
-        else:
-            max_value = oura["rem_sleep_duration"].max()
-
-        if oura["deep_sleep_duration"].min() < oura["rem_sleep_duration"].min():
-            min_value = oura["deep_sleep_duration"].min()
-        else:
-            min_value = oura["rem_sleep_duration"].min()
-
-        step = round((max_value - min_value) / 7)
-        ytickvals = np.arange(start=min_value, stop=max_value, step=step)
-        yticktext = [pd.to_datetime(str(datetime.timedelta(seconds=float(d)))).round("10min").strftime("%Hh%M") for d in ytickvals]
-
-        deep_vs_rem.update_yaxes(tickvals = ytickvals, ticktext= yticktext,
-                                 secondary_y=False, zeroline=False
-                                )
+    # Draw the data of the logged-in user
+    user = current_user()
 
-        # Add title to the y axis with annotation since 'title_standoff' doesn't seem to work in Dash
-        deep_vs_rem.add_annotation(x=-0.2, xref="paper", y=0.5, yref="paper", text="Duration", 
-                                   textangle=-90, showarrow=False, font=dict(color=font_color, size=14)
-                                  )
-
-        # Remove secondary y axis
-        deep_vs_rem.update_yaxes(secondary_y=True, showticklabels=False, showgrid=False, zeroline=False) 
-
-        # Add a horizontal line for the average deep sleep using 'add_shape' because 'add_hline' doesn't seem to work in Dash
-        deep_vs_rem.add_shape(type="line", xref="paper", x0=0, y0=oura.deep_sleep_duration.mean(),
-                              x1=0.98, y1=oura.deep_sleep_duration.mean(), line=dict(dash="dot",
-                                                                                     color=font_color,
-                                                                                     width=1.25
-                                                                                    )
-                             )
-
-        # Add annotation to specify that the horizontal line is the average
-        deep_vs_rem.add_annotation(x=1.08, xref="paper", y=oura.deep_sleep_duration.mean(),
-                                   text="Average deep sleep", showarrow=False, 
-                                   font=dict(color=font_color, size=12)
-                                  )
-
-        # Add a horizontal line for the average REM sleep using 'add_shape' because 'add_hline' doesn't seem to work in Dash
-        deep_vs_rem.add_shape(type="line", xref="paper", x0=0, y0=oura.rem_sleep_duration.mean(), x1=0.98, 
-                              y1=oura.rem_sleep_duration.mean(), line=dict(dash="dot", color=font_color, width=1.25)
-                             )
-
-        # Add annotation to specify that the horizontal line is the average
-        deep_vs_rem.add_annotation(x=1.08, xref="paper", y=oura.rem_sleep_duration.mean(),
-                                   text="Average REM sleep", showarrow=False, 
-                                   font=dict(color=font_color, size=12)
-                                  )
-    
-    return hrv_fig, zone2_fig, vo2max_fig, sleep_fig, deep_vs_rem, deep_sleep_fig, rem_sleep_fig
+    # Redraw the graph for the zoomed range, or for the date picker's range when the user autoscales
+    if charts[chart]["zoom"] and dash.callback_context.triggered_id == chart:
+        zoom = zoomed_range(relayout_data)
+        if zoom is None:
+            raise dash.exceptions.PreventUpdate
+        if zoom != "reset":
+            return chart_figure(user, chart, *zoom)
+        return chart_figure(user, chart, start_date, end_date)
+
+    # Start drawing the other graphs of the date range, unless the callback of another graph already did (this
+    # graph is taken over by 'chart_figure' if the figure pool hasn't started it yet)
+    prefetch_range(user, start_date, end_date, loaded_sources)
+
+    return chart_figure(user, chart, start_date, end_date)
+
+
+# Define a function that times the callback of a graph
+def timed_update_output(chart, *args):
+    """
+    Calls 'update_output' and records its duration for the graph (see the /metrics route).
+    """
+
+    with metrics.update_seconds.time(chart=chart):
+        return update_output(chart, *args)
+
+
+# Register one callback per graph drawn by the server, redrawn for the zoomed date range of the graphs with dates
+for chart in charts:
+    if chart in client_charts:
+        continue
+    inputs = [
+        Input("my-date-picker-range", "start_date"),
+        Input("my-date-picker-range", "end_date"),
+        Input("loaded_sources", "data")
+    ]
+    if charts[chart]["zoom"]:
+        inputs.append(Input(chart, "relayoutData"))
+    app.callback(Output(chart, "figure"), inputs)(functools.partial(timed_update_output, chart))
+
+
+# Define a function that sends the daily data of the graphs filtered in the browser
+def update_client_data(loaded_sources):
+    """
+    Returns the daily data of the graphs of 'client_charts' (see 'client_chart_data'), sent again only when a
+    source is loaded or refreshed. The browser then draws every date range itself.
+
+    Parameters:
+        - loaded_sources (dict): versions of the sources loaded by the background loader
+
+    Returns:
+        The data of each graph (None while its source is loaded) and the figures displayed while loading and
+        when the date range doesn't hold enough data.
+    """
+
+    # Wait for the first poll of the background loader
+    if loaded_sources is None:
+        raise dash.exceptions.PreventUpdate
+
+    user = current_user()
+    return {"charts": {chart: client_chart_data(user, chart) for chart in client_charts},
+            "loading": message_figure("Loading data..."), "empty": message_figure(not_enough_data)}
+
+
+# Register the callbacks drawing the graphs in the browser
+if client_charts:
+    app.callback(Output("client_data", "data"), Input("loaded_sources", "data"))(update_client_data)
+
+    for chart in client_charts:
+        app.clientside_callback(
+            ClientsideFunction(namespace="health", function_name="filterFigure"),
+            Output(chart, "figure"),
+            [
+                Input("my-date-picker-range", "start_date"),
+                Input("my-date-picker-range", "end_date"),
+                Input("client_data", "data")
+            ],
+            State(chart, "id")
+        )
+
+
+# Graphs whose points open the details of their night when clicked
+night_charts = ["hrv_fig", "sleep_fig", "deep_sleep_fig", "rem_sleep_fig"]
+
+
+@app.callback(
+    [
+        Output("night_fig", "figure"),
+        Output("night_title", "children"),
+        Output("night_modal", "is_open")
+    ],
+    [Input(chart, "clickData") for chart in night_charts]
+)
+
+# Define a function that opens the details of the clicked night
+def show_night(*click_data):
+    """
+    Returns the graph of the 5-minute HRV, heart rate and sleep phases of the night clicked on a graph. Only the
+    series of that night are read from the Oura store (see 'oura_sync.read_night').
+
+    Parameters:
+        - click_data (dict): last click on each graph of 'night_charts'
+
+    Returns:
+        The graph of the night, the title of the window and True to open it.
+    """
+
+    chart = dash.callback_context.triggered_id
+    if chart is None:
+        raise dash.exceptions.PreventUpdate
+
+    # Points of graphs drawn per week or month are the first day of their period
+    point = click_data[night_charts.index(chart)]["points"][0]
+    day = pd.Timestamp(point["x"]).strftime("%Y-%m-%d")
+
+    db_path = os.path.join(users[current_user()]["data_dir"], oura_sync.DB_PATH)
+    night = oura_sync.read_night(day, db_path)
+    return night_figure(night), f"Night of {pd.Timestamp(day):%b %d, %Y}", True
+
+
+# Report the hits and misses of the figure cache
+@app.server.route("/figure-cache")
+def figure_cache_stats():
+    return flask.jsonify(figure_cache.stats())
+
+
+# Report the duration of each stage of loading and drawing, in the Prometheus text format
+@app.server.route("/metrics")
+def metrics_route():
+    for name, value in figure_cache.stats().items():
+        metrics.figure_cache_stats.set(value, stat=name)
+    return flask.Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,294 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import logging
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                               Data version
+# -------------------------------------------------------------------------
+
+
+# Define a function that computes a fingerprint of a dataframe's content
+def data_version(df):
+    """
+    Returns a short hash of the columns and values of a dataframe. It only changes when the data changes,
+    even across restarts, so it can be used in cache keys.
+
+    Parameters:
+        - df (pandas.DataFrame): the dataframe to fingerprint
+
+    Returns:
+        A 12 characters hexadecimal string
+    """
+
+    digest = hashlib.sha1("|".join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:12]
+
+# -------------------------------------------------------------------------
+#                               Data loader
+# -------------------------------------------------------------------------
+
+
+class DataLoader:
+    """
+    Runs the functions that fetch each data source (Oura's API, Google Drive files) on a pool of
+    background threads, so the Dash server can start serving requests before the data is downloaded.
+
+    Each source is registered under a name with 'submit' and its result is read with 'get', which
+    returns None until the source is loaded. 'version' returns a fingerprint of the loaded data.
+
+    Sources can be loaded again with 'refresh', or every few minutes with 'start_refresh'. A new load
+    builds a new snapshot (data, version) off the request path and replaces the previous one at once, so
+    readers using 'snapshot' always get data and version that belong together. Until the new load is
+    done (or if it fails) the previous snapshot is still returned. Snapshots are shared between requests
+    and must not be modified.
+
+    With a 'snapshots.SnapshotStore', several processes share the data: only the process holding the
+    store's lock loads the sources and writes each new snapshot to the store, the others read the current
+    snapshots from the store (memory-mapped) instead of fetching the sources themselves.
+    """
+
+    def __init__(self, max_workers=3, store=None, executor=None):
+        """
+        Parameters:
+            - max_workers (int): number of sources loaded at the same time
+            - store (snapshots.SnapshotStore): store shared with other processes, None to only load the
+                                               sources in this process
+            - executor (concurrent.futures.Executor): pool loading the sources, shared with other loaders.
+                                                      None to create one with max_workers threads
+        """
+
+        self.store = store
+        self._leader = store is None or store.acquire_leadership()
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="loader")
+        self._futures = {}
+        self._loaders = {}
+        self._snapshots = {}
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._stop_refresh = threading.Event()
+
+    def submit(self, name, func, *args, **kwargs):
+        """
+        Starts loading a source in the background.
+
+        Parameters:
+            - name (str): name used to read the source with 'get'
+            - func (callable): function returning the loaded data
+            - args, kwargs: arguments passed to func
+        """
+
+        with self._lock:
+            self._loaders[name] = (func, args, kwargs)
+            if self._leader:
+                self._start(name)
+
+    def _start(self, name):
+        func, args, kwargs = self._loaders[name]
+        future = self._executor.submit(self._load, name, func, *args, **kwargs)
+        future.add_done_callback(lambda f: self._log_result(name, f))
+        self._futures[name] = future
+
+    def _load(self, name, func, *args, **kwargs):
+        with metrics.stage_seconds.time(stage=f"{name}_load"):
+            data = func(*args, **kwargs)
+        with metrics.stage_seconds.time(stage=f"{name}_version"):
+            snapshot = (data, data_version(data))
+
+        # Swap the new snapshot in, unless the data didn't change or the loader was closed meanwhile
+        with self._lock:
+            if self._closed:
+                return snapshot
+            previous = self._snapshots.get(name)
+            if previous is None or previous[1] != snapshot[1]:
+                self._snapshots[name] = snapshot
+                self._sizes[name] = data.memory_usage(deep=True).sum()
+
+        # Share the new snapshot with the other processes, unless the loader was closed and another one took
+        # over the store ('close' waits for a write in progress before giving up the store's lock)
+        if self.store is not None and (previous is None or previous[1] != snapshot[1]):
+            with self._write_lock:
+                if not self._closed and self._leader:
+                    with metrics.stage_seconds.time(stage=f"{name}_snapshot_write"):
+                        self.store.write(name, *snapshot)
+        return snapshot
+
+    def _log_result(self, name, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error("Loading %s failed", name, exc_info=future.exception())
+        else:
+            logger.info("Loaded %s (version %s)", name, future.result()[1])
+
+    def refresh(self):
+        """
+        Starts loading every source again, except the ones still loading. A process reading a shared
+        store takes over the loading if the process that held the store's lock exited.
+        """
+
+        with self._lock:
+            if self._closed:
+                return
+            if not self._leader:
+                if not self.store.acquire_leadership():
+                    return
+                self._leader = True
+            for name in self._loaders:
+                future = self._futures.get(name)
+                if future is None or future.done():
+                    self._start(name)
+
+    def start_refresh(self, interval):
+        """
+        Starts a background thread loading every source again every 'interval' seconds.
+
+        Parameters:
+            - interval (float): number of seconds between two refreshes
+        """
+
+        def refresh_loop():
+            while not self._stop_refresh.wait(interval):
+                self.refresh()
+
+        self._stop_refresh.clear()
+        threading.Thread(target=refresh_loop, name="loader-refresh", daemon=True).start()
+
+    def stop_refresh(self):
+        """
+        Stops the thread started by 'start_refresh'.
+        """
+
+        self._stop_refresh.set()
+
+    def close(self):
+        """
+        Stops refreshing the sources, releases the loaded data and gives up the store's lock. Loads that haven't
+        started are cancelled, loads in progress finish in the background but their data is dropped.
+        """
+
+        self.stop_refresh()
+        with self._lock:
+            self._closed = True
+            futures = list(self._futures.values())
+        for future in futures:
+            future.cancel()
+        if self._own_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+        # Wait for a snapshot being written to the store, then let another loader take over
+        with self._write_lock:
+            if self.store is not None and self._leader:
+                self.store.release()
+                self._leader = False
+        with self._lock:
+            self._snapshots.clear()
+            self._sizes.clear()
+
+    def memory_usage(self):
+        """
+        Returns the number of bytes used by the loaded data of every source.
+        """
+
+        with self._lock:
+            return int(sum(self._sizes.values()))
+
+    def status(self, name):
+        """
+        Returns "loading", "ready" or "failed" for the given source. A source stays "ready" while it is
+        refreshed or if a refresh fails.
+        """
+
+        if self.snapshot(name) is not None:
+            return "ready"
+        with self._lock:
+            future = self._futures.get(name)
+        if future is None or not future.done():
+            return "loading"
+        return "failed" if future.cancelled() or future.exception() is not None else "ready"
+
+    def snapshot(self, name):
+        """
+        Returns the last loaded (data, version) of the given source, or None if it is not loaded.
+        """
+
+        with self._lock:
+            if self._leader:
+                return self._snapshots.get(name)
+
+        # Read the current snapshot from the shared store when it changed
+        version = self.store.current_version(name)
+        with self._lock:
+            snapshot = self._snapshots.get(name)
+        if version is None or (snapshot is not None and snapshot[1] == version):
+            return snapshot
+
+        try:
+            with metrics.stage_seconds.time(stage=f"{name}_snapshot_read"):
+                snapshot = (self.store.read(name, version), version)
+        except FileNotFoundError:
+            # Already replaced by a newer version, read it next time
+            return snapshot
+        with self._lock:
+            self._snapshots[name] = snapshot
+            self._sizes[name] = snapshot[0].memory_usage(deep=True).sum()
+        return snapshot
+
+    def get(self, name):
+        """
+        Returns the data of the given source, or None if it is still loading or failed to load.
+        """
+
+        snapshot = self.snapshot(name)
+        return None if snapshot is None else snapshot[0]
+
+    def version(self, name):
+        """
+        Returns the fingerprint of the data of the given source, or None if it is not loaded.
+        """
+
+        snapshot = self.snapshot(name)
+        return None if snapshot is None else snapshot[1]
+
+    def versions(self):
+        """
+        Returns the version of each loaded source, as a dict keyed by source name.
+        """
+
+        versions = {}
+        for name in sorted(self._loaders):
+            snapshot = self.snapshot(name)
+            if snapshot is not None:
+                versions[name] = snapshot[1]
+        return versions
+
+    def ready_sources(self):
+        """
+        Returns the sorted list of the sources that are loaded.
+        """
+
+        return list(self.versions())
+
+    def done(self):
+        """
+        Returns True when every source has its first snapshot or failed to load it (see 'status'). Refreshes
+        of loaded sources don't count, so the app keeps polling slowly while they run. A process reading a
+        shared store is done once the store holds every source.
+        """
+
+        with self._lock:
+            leader = self._leader
+        if not leader:
+            return all(self.snapshot(name) is not None for name in self._loaders)
+        return all(self.status(name) != "loading" for name in self._loaders)
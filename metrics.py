@@ -0,0 +1,147 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# -------------------------------------------------------------------------
+#                                 Metrics
+# -------------------------------------------------------------------------
+
+# Buckets (upper bounds) of the histograms of durations in seconds and of sizes in bytes
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000, 5000000)
+
+# Every metric created, in the order they are rendered
+_registry = []
+
+
+# Define a function that formats the labels of a sample
+def _format_labels(labels):
+    if not labels:
+        return ""
+    values = ",".join(f'{name}="{value}"' for name, value in labels)
+    return "{" + values + "}"
+
+
+class Histogram:
+    """
+    Prometheus-style histogram: counts the observed values per bucket, with their sum and count, for each
+    combination of label values. Observing a value only takes a lock and a binary search, so it can be left
+    on in production.
+    """
+
+    def __init__(self, name, help, buckets=SECONDS_BUCKETS):
+        """
+        Parameters:
+            - name (str): name of the metric
+            - help (str): description of the metric
+            - buckets (tuple): upper bounds of the buckets, in ascending order
+        """
+
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        """
+        Adds a value to the histogram of the given labels.
+        """
+
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Context manager observing the number of seconds spent in its block.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: ([*counts], total, count) for key, (counts, total, count) in self._series.items()}
+
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels([*key, ('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Gauge:
+    """
+    Prometheus-style gauge: the last value set for each combination of label values.
+    """
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def set(self, value, **labels):
+        """
+        Sets the value of the given labels.
+        """
+
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = dict(self._values)
+        lines.extend(f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(values.items()))
+        return lines
+
+
+# Define a function that renders every metric
+def render():
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+# -------------------------------------------------------------------------
+#                              App metrics
+# -------------------------------------------------------------------------
+
+# Time spent in each stage of loading the sources (sync, download, parse...)
+stage_seconds = Histogram("health_stage_seconds", "Duration of each stage of loading the data, in seconds.")
+
+# Time spent in each step of drawing a figure (trend line, filter, draw, serialize)
+figure_seconds = Histogram("health_figure_seconds", "Duration of each step of drawing a figure, in seconds.")
+
+# Size of the serialized figures sent to the browser, cached or not
+figure_bytes = Histogram("health_figure_bytes", "Size of the serialized figures served (drawn or cached), in bytes.",
+                         buckets=BYTES_BUCKETS)
+
+# Time spent answering the callback of each graph
+update_seconds = Histogram("health_update_output_seconds", "Duration of the callback of each graph, in seconds.")
+
+# Figure cache counters (hits, disk hits, misses, size), updated when the metrics are rendered
+figure_cache_stats = Gauge("health_figure_cache", "Figure cache hits, disk hits, misses and number of figures.")
@@ -0,0 +1,395 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import sqlite3
+import json
+import logging
+import datetime
+import requests
+import numpy as np
+import pandas as pd
+from pandas import json_normalize
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------------
+#                                 Settings
+# -------------------------------------------------------------------------
+
+# Oura's API endpoint for sleep documents
+OURA_URL = "https://api.ouraring.com/v2/usercollection/sleep"
+
+# First day of Oura ring data
+FIRST_DAY = "2021-06-11"
+
+# Local SQLite file holding the normalized sleep rows
+DB_PATH = "oura.sqlite"
+
+# Version of the tables of the local store, the store is synced again from scratch when it changes
+SCHEMA_VERSION = "2"
+
+# Metrics read back from the store and their compact types (durations are in seconds)
+SLEEP_COLUMNS = {
+    "day": "object",
+    "type": "category",
+    "average_hrv": "float32",
+    "lowest_heart_rate": "int32",
+    "total_sleep_duration": "int32",
+    "deep_sleep_duration": "int32",
+    "rem_sleep_duration": "int32"
+}
+
+# High-resolution series of each night (5-minute heart rate and HRV, sleep phases...), stored apart from
+# the metrics and only read for one night at a time with 'read_series'
+SERIES_FIELDS = ("heart_rate", "hrv", "sleep_phase_5_min", "movement_30_sec")
+
+# -------------------------------------------------------------------------
+#                                Local store
+# -------------------------------------------------------------------------
+
+
+# Define a function that opens the local store and creates its tables if needed
+def open_store(db_path=DB_PATH):
+    """
+    Opens the SQLite file holding the synced sleep rows. A store written with an older layout of the
+    tables is emptied, so every night is synced again.
+
+    Parameters:
+        - db_path (str): path of the SQLite file
+
+    Returns:
+        A 'sqlite3.Connection' with the "sleep", "sleep_series" and "sync_state" tables created
+    """
+
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute('CREATE TABLE IF NOT EXISTS sync_state ("key" TEXT PRIMARY KEY, "value" TEXT)')
+    if get_state(conn, "schema") != SCHEMA_VERSION:
+        conn.execute('DROP TABLE IF EXISTS sleep')
+        conn.execute('DROP TABLE IF EXISTS sleep_series')
+        conn.execute('DELETE FROM sync_state')
+        set_state(conn, "schema", SCHEMA_VERSION)
+
+    conn.execute('CREATE TABLE IF NOT EXISTS sleep ("id" TEXT PRIMARY KEY, "day" TEXT)')
+    series_columns = ", ".join(f'"{field}" TEXT' for field in SERIES_FIELDS)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS sleep_series ("id" TEXT PRIMARY KEY, "day" TEXT, "type" TEXT, '
+                 f'{series_columns})')
+    conn.execute('CREATE INDEX IF NOT EXISTS sleep_series_day ON sleep_series ("day")')
+    conn.commit()
+    return conn
+
+
+# Define a function that reads a value from the "sync_state" table
+def get_state(conn, key):
+    """
+    Returns the value stored under 'key' in the "sync_state" table, or None if it was never set.
+    """
+
+    row = conn.execute('SELECT "value" FROM sync_state WHERE "key" = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+
+# Define a function that writes a value to the "sync_state" table
+def set_state(conn, key, value):
+    """
+    Stores 'value' under 'key' in the "sync_state" table.
+    """
+
+    conn.execute('INSERT OR REPLACE INTO sync_state ("key", "value") VALUES (?, ?)', (key, value))
+
+
+# Define a function that converts a cell to a value SQLite can store
+def _to_sql_value(value):
+    # Nested fields (5-minute series, contributors...) are kept as JSON text
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+# Define a function that inserts or replaces normalized sleep rows in the store
+def upsert_rows(conn, df):
+    """
+    Writes normalized sleep rows to the "sleep" table, replacing rows that have the same "id".
+    Columns that appear in the API response for the first time are added to the table.
+
+    Parameters:
+        - conn (sqlite3.Connection): connection returned by 'open_store'
+        - df (pandas.DataFrame): normalized sleep documents
+
+    Returns:
+        None
+    """
+
+    if df.empty:
+        return
+
+    # Add the columns the table doesn't have yet
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(sleep)')}
+    for column in df.columns:
+        if column not in existing:
+            conn.execute(f'ALTER TABLE sleep ADD COLUMN "{column}"')
+
+    # Insert rows, replacing the ones that were already synced
+    columns = ", ".join(f'"{c}"' for c in df.columns)
+    placeholders = ", ".join("?" for _ in df.columns)
+    rows = [tuple(_to_sql_value(v) for v in row) for row in df.itertuples(index=False, name=None)]
+    conn.executemany(f"INSERT OR REPLACE INTO sleep ({columns}) VALUES ({placeholders})", rows)
+
+
+# Define a function that moves the high-resolution series out of the sleep documents
+def split_series(documents):
+    """
+    Separates the high-resolution series (SERIES_FIELDS) from the other fields of the sleep documents. Series are
+    kept as JSON text.
+
+    Parameters:
+        - documents (list): sleep documents returned by 'fetch_sleep'
+
+    Returns:
+        (documents without the series, rows of the "sleep_series" table as a DataFrame)
+    """
+
+    metrics, series = [], []
+    for document in documents:
+        metrics.append({key: value for key, value in document.items() if key not in SERIES_FIELDS})
+        series.append({"id": document["id"], "day": document["day"], "type": document.get("type"),
+                       **{field: json.dumps(document.get(field)) for field in SERIES_FIELDS}})
+    return metrics, pd.DataFrame(series, columns=["id", "day", "type", *SERIES_FIELDS])
+
+
+# Define a function that inserts or replaces the series of some nights in the store
+def upsert_series(conn, df):
+    """
+    Writes rows returned by 'split_series' to the "sleep_series" table, replacing rows that have the same "id".
+    """
+
+    if df.empty:
+        return
+
+    columns = ", ".join(f'"{c}"' for c in df.columns)
+    placeholders = ", ".join("?" for _ in df.columns)
+    rows = [tuple(_to_sql_value(v) for v in row) for row in df.itertuples(index=False, name=None)]
+    conn.executemany(f"INSERT OR REPLACE INTO sleep_series ({columns}) VALUES ({placeholders})", rows)
+
+
+# Define a function that reads the metrics of every synced night
+def read_rows(conn, columns=SLEEP_COLUMNS):
+    """
+    Returns the given metrics of every row of the "sleep" table, with compact types.
+
+    Parameters:
+        - conn (sqlite3.Connection): connection returned by 'open_store'
+        - columns (dict): columns to read and their types. Integer columns with missing values are read
+                          as float32
+
+    Returns:
+        A DataFrame with one row per sleep document
+    """
+
+    # Columns the API never returned are read as missing values
+    existing = {row[1] for row in conn.execute('PRAGMA table_info(sleep)')}
+    selected = ", ".join(f'"{c}"' if c in existing else f'NULL AS "{c}"' for c in columns)
+    df = pd.read_sql(f'SELECT {selected} FROM sleep', conn)
+
+    for column, dtype in columns.items():
+        if dtype.startswith("int") and df[column].isna().any():
+            dtype = "float32"
+        df[column] = df[column].astype(dtype)
+    return df
+
+
+# Define a function that reads the high-resolution series of a night
+def read_series(day, db_path=DB_PATH):
+    """
+    Returns the high-resolution series (SERIES_FIELDS) of the sleep documents of a day, read from the store
+    only when they are needed. The store is opened read-only and the day is found with the index of the
+    "sleep_series" table, so only the rows of that day are read.
+
+    Parameters:
+        - day (str): the day (YYYY-MM-DD)
+        - db_path (str): path of the SQLite file
+
+    Returns:
+        A list with one dict per sleep document of the day ("id", "type" and the series decoded from JSON)
+    """
+
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+    except sqlite3.OperationalError:
+        return []
+    try:
+        fields = ", ".join(f'"{field}"' for field in SERIES_FIELDS)
+        rows = conn.execute(f'SELECT "id", "type", {fields} FROM sleep_series WHERE "day" = ?', (day,)).fetchall()
+    except sqlite3.OperationalError:
+        # The store was never synced
+        return []
+    finally:
+        conn.close()
+
+    return [{"id": row[0], "type": row[1], **{field: json.loads(value) for field, value in zip(SERIES_FIELDS, row[2:])}}
+            for row in rows]
+
+
+# Define a function that converts a 5-minute series to NumPy arrays
+def decode_series(series):
+    """
+    Returns the timestamps and values of a series of a sleep document ({"interval", "items", "timestamp"}).
+    Missing items are returned as NaN.
+
+    Parameters:
+        - series (dict): the series, None if the document doesn't have it
+
+    Returns:
+        (timestamps as a 'DatetimeIndex', values as a float NumPy array)
+    """
+
+    if not series or not series.get("items"):
+        return pd.DatetimeIndex([]), np.array([], dtype="float64")
+
+    values = np.array(series["items"], dtype="float64")
+
+    # Timestamps are kept in the local time of the night (the offset returned by the API is dropped)
+    start = pd.Timestamp(series["timestamp"]).tz_localize(None)
+    times = start + pd.to_timedelta(np.arange(len(values)) * series["interval"], unit="s")
+    return times, values
+
+
+# Define a function that converts the sleep phases to NumPy arrays
+def decode_phases(phases, start, interval=300):
+    """
+    Returns the timestamps and phases of a 'sleep_phase_5_min' string, which holds one digit per 5 minutes
+    (1 = deep, 2 = light, 3 = REM, 4 = awake).
+
+    Parameters:
+        - phases (str): the sleep phases, None if the document doesn't have them
+        - start (str or datetime): start of the first phase (bedtime)
+        - interval (int): number of seconds per phase
+
+    Returns:
+        (timestamps as a 'DatetimeIndex', phases as a uint8 NumPy array)
+    """
+
+    if not phases:
+        return pd.DatetimeIndex([]), np.array([], dtype="uint8")
+
+    codes = np.frombuffer(phases.encode("ascii"), dtype="uint8") - ord("0")
+    times = pd.Timestamp(start) + pd.to_timedelta(np.arange(len(codes)) * interval, unit="s")
+    return times, codes
+
+
+# Define a function that returns the decoded series of the main sleep of a night
+def read_night(day, db_path=DB_PATH):
+    """
+    Returns the 5-minute HRV, heart rate and sleep phases of the main sleep of a day ("long_sleep" document,
+    or the first document of the day if there is none).
+
+    Parameters:
+        - day (str): the day (YYYY-MM-DD)
+        - db_path (str): path of the SQLite file
+
+    Returns:
+        A dict with the (timestamps, values) of "hrv", "heart_rate" and "phases", or None if the day has no data
+    """
+
+    documents = read_series(day, db_path)
+    if not documents:
+        return None
+    document = next((d for d in documents if d["type"] == "long_sleep"), documents[0])
+
+    hrv = decode_series(document["hrv"])
+    heart_rate = decode_series(document["heart_rate"])
+
+    # Phases start with the other series, at bedtime
+    start = hrv[0][0] if len(hrv[0]) else heart_rate[0][0] if len(heart_rate[0]) else None
+    phases = decode_phases(document["sleep_phase_5_min"], start) if start is not None else decode_phases(None, None)
+    return {"hrv": hrv, "heart_rate": heart_rate, "phases": phases}
+
+# -------------------------------------------------------------------------
+#                                 Oura API
+# -------------------------------------------------------------------------
+
+
+# Define a function that downloads the sleep documents of a date range
+def fetch_sleep(api_key, start_date, end_date, url=OURA_URL, session=None):
+    """
+    Downloads the sleep documents between start_date and end_date, following the 'next_token'
+    returned by the API until every page has been read.
+
+    Parameters:
+        - api_key (str): Oura personal access token
+        - start_date (str): first day to fetch (YYYY-MM-DD)
+        - end_date (str): last day to fetch (YYYY-MM-DD)
+        - url (str): endpoint to call, can point to a local stub server
+        - session (requests.Session): session to reuse, a new one is created if None
+
+    Returns:
+        A list of sleep documents (dict)
+    """
+
+    session = session or requests.Session()
+    headers = {"Authorization": f"Bearer {api_key}"}
+    params = {"start_date": start_date, "end_date": end_date}
+
+    documents = []
+    while True:
+        response = session.get(url, headers=headers, params=params, timeout=30)
+        response.raise_for_status()
+        page = response.json()
+        documents.extend(page.get("data", []))
+
+        # Stop when the API doesn't return a token for another page
+        next_token = page.get("next_token")
+        if not next_token:
+            return documents
+        params = {"start_date": start_date, "end_date": end_date, "next_token": next_token}
+
+
+# Define a function that brings the local store up to date and returns the full history
+def sync_sleep(api_key, db_path=DB_PATH, url=OURA_URL, today=None, session=None):
+    """
+    Fetches only the days that are not in the local store yet, saves them and returns every synced
+    sleep row. The last synced day is fetched again because a night can be updated after it was first
+    synced (late sync of the ring, nap added later in the day...). When Oura's API can't be reached (or the
+    token expired), the rows already in the store are returned.
+
+    Parameters:
+        - api_key (str): Oura personal access token
+        - db_path (str): path of the SQLite file
+        - url (str): endpoint to call, can point to a local stub server
+        - today (datetime.date): last day to fetch, defaults to the current date
+        - session (requests.Session): session to reuse, a new one is created if None
+
+    Returns:
+        A DataFrame holding the metrics of SLEEP_COLUMNS for each sleep document (see 'read_rows')
+    """
+
+    today = today or datetime.datetime.now().date()
+    conn = open_store(db_path)
+    try:
+        # Start from the last synced day, or from the first day of data on the first run
+        last_day = get_state(conn, "last_day")
+        start_date = last_day or FIRST_DAY
+        try:
+            documents = fetch_sleep(api_key, start_date, today.strftime("%Y-%m-%d"), url=url, session=session)
+        except Exception:
+            # Nothing to fall back to before the first sync
+            if last_day is None:
+                raise
+            logger.warning("Could not sync the nights from Oura's API, using the local store", exc_info=True)
+            return read_rows(conn)
+
+        # Save the new rows, with their high-resolution series apart, and remember the most recent day
+        if documents:
+            metrics, series = split_series(documents)
+            new_rows = json_normalize(metrics)
+            upsert_rows(conn, new_rows)
+            upsert_series(conn, series)
+            set_state(conn, "last_day", max(start_date, new_rows["day"].max()))
+        conn.commit()
+
+        return read_rows(conn)
+    finally:
+        conn.close()
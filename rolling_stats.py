@@ -0,0 +1,80 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import pandas as pd
+
+# Lengths of the rolling windows, in days
+WINDOWS = (7, 30, 60)
+
+# Percentiles bounding the percentile bands
+PERCENTILES = (10, 90)
+
+# -------------------------------------------------------------------------
+#                           Rolling statistics
+# -------------------------------------------------------------------------
+
+
+# Define a function that computes the rolling statistics of metrics
+def rolling_statistics(df, metrics, windows=WINDOWS, percentiles=PERCENTILES, min_periods=3):
+    """
+    Computes the rolling mean, standard deviation and percentiles of each metric over the days before each row
+    (the row included), like the baselines of Oura's readiness views. Windows are measured in days rather than
+    rows, so days without data don't stretch them. Means and standard deviations are updated in O(1) per row;
+    percentiles keep the window sorted, in O(log window) per row.
+
+    Parameters:
+        - df (pandas.DataFrame): a dataframe indexed by day (see 'date_range.index_by_day')
+        - metrics (list): columns to compute the statistics of
+        - windows (tuple): lengths of the windows in days
+        - percentiles (tuple): percentiles computed for each window
+        - min_periods (int): minimum number of values in a window, fewer give missing statistics
+
+    Returns:
+        A float32 dataframe with the same index, holding "<metric>_mean_<window>d", "<metric>_std_<window>d"
+        and "<metric>_p<percentile>_<window>d" columns
+    """
+
+    data = df[metrics].astype("float64")
+    columns = {}
+    for window in windows:
+        rolling = data.rolling(f"{window}D", min_periods=min(min_periods, window))
+        statistics = {"mean": rolling.mean(), "std": rolling.std()}
+        for percentile in percentiles:
+            statistics[f"p{percentile}"] = rolling.quantile(percentile / 100)
+
+        for metric in metrics:
+            for name, values in statistics.items():
+                columns[f"{metric}_{name}_{window}d"] = values[metric]
+
+    return pd.DataFrame(columns, index=df.index).astype("float32")
+
+
+# Define a function that returns the band of a metric around its rolling mean
+def baseline_band(statistics, metric, window=30, kind="std"):
+    """
+    Returns the rolling baseline of a metric and the band around it.
+
+    Parameters:
+        - statistics (pandas.DataFrame): the statistics returned by 'rolling_statistics'
+        - metric (str): name of the metric
+        - window (int): length of the window in days, one of the windows of the statistics
+        - kind (str): "std" for the mean plus or minus one standard deviation, "percentile" for the first and
+                      last percentiles of the statistics (10th to 90th by default)
+
+    Returns:
+        A dataframe with the same index and "lower", "mean" and "upper" columns
+    """
+
+    mean = statistics[f"{metric}_mean_{window}d"]
+    if kind == "std":
+        spread = statistics[f"{metric}_std_{window}d"]
+        lower, upper = mean - spread, mean + spread
+    elif kind == "percentile":
+        names = sorted((column for column in statistics.columns
+                        if column.startswith(f"{metric}_p") and column.endswith(f"_{window}d")),
+                       key=lambda column: int(column[len(metric) + 2:-len(f"_{window}d")]))
+        lower, upper = statistics[names[0]], statistics[names[-1]]
+    else:
+        raise ValueError(f"Unknown band: {kind}")
+
+    return pd.DataFrame({"lower": lower, "mean": mean, "upper": upper})
@@ -0,0 +1,118 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import numpy as np
+import pandas as pd
+from date_range import slice_days
+
+# -------------------------------------------------------------------------
+#                                 Rollups
+# -------------------------------------------------------------------------
+
+# Resolutions of the rollup tables and approximate number of days in each period
+RESOLUTIONS = {"D": 1, "W": 7, "M": 30.44}
+
+
+# Define a function that returns the first day of the period of each date
+def period_start(index, resolution):
+    """
+    Returns the first day of the day ("D"), week starting on Monday ("W") or month ("M") of each date.
+
+    Parameters:
+        - index (pandas.DatetimeIndex): normalized dates (see 'date_range.index_by_day')
+        - resolution (str): "D", "W" or "M"
+
+    Returns:
+        A 'DatetimeIndex' with the start of the period of each date
+    """
+
+    if resolution == "D":
+        return index
+    if resolution == "W":
+        return index - pd.to_timedelta(index.dayofweek, unit="D")
+    if resolution == "M":
+        return index.to_period("M").to_timestamp()
+    raise ValueError(f"Unknown resolution: {resolution}")
+
+
+# Define a function that aggregates metrics per period
+def rollup(df, date_column, metrics, resolution):
+    """
+    Aggregates the metrics of a dataframe indexed by day into one row per period.
+
+    Parameters:
+        - df (pandas.DataFrame): a dataframe returned by 'date_range.index_by_day'
+        - date_column (str): name of the date column, set to the start of each period in the result
+        - metrics (list): columns to aggregate
+        - resolution (str): "D", "W" or "M"
+
+    Returns:
+        A dataframe indexed by the start of each period (same index as 'index_by_day') holding the mean of
+        each metric under its own name and its minimum, maximum and number of values under
+        "<metric>_min", "<metric>_max" and "<metric>_count"
+    """
+
+    stats = df[metrics].groupby(period_start(df.index, resolution)).agg(["mean", "min", "max", "count"])
+    stats.columns = [metric if stat == "mean" else f"{metric}_{stat}" for metric, stat in stats.columns]
+    stats.index = pd.DatetimeIndex(stats.index, name="date")
+    stats.insert(0, date_column, stats.index)
+    return stats
+
+
+# Define a function that returns the periods of a rollup table overlapping a date range
+def slice_periods(table, start_date, end_date, resolution):
+    """
+    Returns the rows of a rollup table whose period overlaps the date range, including the period the
+    range starts in (its first day can be before start_date).
+    """
+
+    start = period_start(pd.DatetimeIndex([pd.Timestamp(start_date).normalize()]), resolution)[0]
+    return slice_days(table, start, end_date)
+
+
+# Define a function that builds the rollup tables of every resolution
+def build_rollups(df, date_column, metrics):
+    """
+    Returns the rollup tables of the metrics for every resolution, as a dict keyed by resolution.
+    """
+
+    return {resolution: rollup(df, date_column, metrics, resolution) for resolution in RESOLUTIONS}
+
+
+# Define a function that chooses the resolution to display for a date range
+def choose_resolution(start_date, end_date, max_points=366):
+    """
+    Returns the finest resolution that displays at most max_points periods for the date range, so a
+    year is displayed per day, a few years per week and longer ranges per month.
+
+    Parameters:
+        - start_date (str or datetime): start of the date range
+        - end_date (str or datetime): end of the date range
+        - max_points (int): maximum number of periods to display
+
+    Returns:
+        "D", "W" or "M"
+    """
+
+    days = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days + 1
+    for resolution, period_days in RESOLUTIONS.items():
+        if days / period_days <= max_points:
+            return resolution
+    return "M"
+
+
+# Define a function that returns the mean of a metric, weighted by the number of values of each period
+def weighted_mean(df, metric):
+    """
+    Returns the mean of the metric over the rows of the dataframe. For a rollup table, each period
+    counts as many times as the number of values it aggregates, so the result is the mean of the raw data.
+    """
+
+    count_column = f"{metric}_count"
+    if count_column not in df.columns:
+        return df[metric].mean()
+
+    counts = df[count_column].to_numpy()
+    if counts.sum() == 0:
+        return np.nan
+    return np.average(np.nan_to_num(df[metric].to_numpy(dtype="float64")), weights=counts)
@@ -0,0 +1,129 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import numpy as np
+import pandas as pd
+from trendline import NS_PER_DAY, fit_line
+
+# Number of days before the last run whose progress is used to project the completion of the goal
+RECENT_DAYS = 90
+
+# -------------------------------------------------------------------------
+#                          Cumulative distance
+# -------------------------------------------------------------------------
+
+
+class DistanceIndex:
+    """
+    Prefix sums of the distance of the runs sorted by date, so the distance run between any two dates is
+    computed in O(log n) with two binary searches. Indexes are not modified once built: 'extend' returns a new
+    index, so the graphs and cards can keep using the previous one while the data is refreshed.
+    """
+
+    def __init__(self, dates, distances, _start=None):
+        """
+        Parameters:
+            - dates (array-like of datetime): dates of the runs, sorted in ascending order
+            - distances (array-like of float): distance of each run in km, missing distances count as 0
+        """
+
+        self.dates = pd.DatetimeIndex(dates)
+        self.days = self.dates.normalize()
+        self._distances = np.nan_to_num(np.asarray(distances, dtype="float64"))
+
+        # Prefix sums starting with 0 so the distance of runs [i, j) is cumulative[j] - cumulative[i]. An
+        # extended index only sums its new runs, after the prefix sums of the index it extends
+        if _start is None:
+            _start = np.zeros(1)
+        cumulative = np.empty(len(self._distances) + 1)
+        cumulative[:len(_start)] = _start
+        np.cumsum(self._distances[len(_start) - 1:], out=cumulative[len(_start):])
+        cumulative[len(_start):] += _start[-1]
+        self._cumulative = cumulative
+
+    def __len__(self):
+        return len(self._distances)
+
+    @property
+    def total(self):
+        """
+        Distance of every run, in km.
+        """
+
+        return self._cumulative[-1]
+
+    def extend(self, dates, distances):
+        """
+        Returns the index of the runs of a new version of the data. When the new runs start with the runs of
+        this index (new runs were added after them), only the distances of the new runs are summed; otherwise
+        (past runs changed) the index is built again.
+
+        Parameters:
+            - dates (array-like of datetime): dates of the runs, sorted in ascending order
+            - distances (array-like of float): distance of each run in km
+
+        Returns:
+            A new 'DistanceIndex'
+        """
+
+        dates = pd.DatetimeIndex(dates)
+        distances = np.nan_to_num(np.asarray(distances, dtype="float64"))
+        n = len(self)
+        if len(dates) >= n and dates[:n].equals(self.dates) and np.array_equal(distances[:n], self._distances):
+            return DistanceIndex(dates, distances, _start=self._cumulative)
+        return DistanceIndex(dates, distances)
+
+    def _positions(self, start_date, end_date):
+        start = self.days.searchsorted(pd.Timestamp(start_date).normalize(), side="left")
+        end = self.days.searchsorted(pd.Timestamp(end_date).normalize(), side="right")
+        return start, end
+
+    def between(self, start_date, end_date):
+        """
+        Returns the distance run between start_date and end_date (both included), in km.
+        """
+
+        start, end = self._positions(start_date, end_date)
+        return self._cumulative[end] - self._cumulative[start]
+
+    def cumulative(self, start_date, end_date):
+        """
+        Returns the runs between start_date and end_date as a dataframe with their "day" and the total
+        distance run up to and including each of them ("cumulative_km").
+        """
+
+        start, end = self._positions(start_date, end_date)
+        return pd.DataFrame({"day": self.dates[start:end], "cumulative_km": self._cumulative[start + 1:end + 1]})
+
+    def projected_completion(self, goal, offset=0, recent_days=RECENT_DAYS):
+        """
+        Returns the date the goal will be reached at the recent pace: a least squares line is fitted to the
+        total distance of the runs of the last 'recent_days' days (see 'trendline.fit_line') and extended
+        until it reaches the goal.
+
+        Parameters:
+            - goal (float): distance to reach in km
+            - offset (float): km run before the first indexed run (e.g. with another app)
+            - recent_days (int): number of days before the last run used to measure the pace
+
+        Returns:
+            A pandas.Timestamp, the date of the last run if the goal is already reached, or None if the
+            recent runs don't progress (less than 2 runs or all on the same day)
+        """
+
+        if not len(self):
+            return None
+        if self.total + offset >= goal:
+            return self.dates[-1]
+
+        recent = self.cumulative(self.days[-1] - pd.Timedelta(days=recent_days), self.days[-1])
+        line = fit_line(recent["day"], recent["cumulative_km"] + offset)
+        if line is None or line[0] <= 0:
+            return None
+
+        # Dates after 2262 can't be represented, the goal is out of reach anyway
+        slope, intercept = line
+        try:
+            return pd.Timestamp(round((goal - intercept) / slope * NS_PER_DAY)).normalize()
+        except (OverflowError, pd.errors.OutOfBoundsDatetime):
+            return None
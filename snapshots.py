@@ -0,0 +1,139 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import os
+import glob
+import threading
+import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process loads its own data
+    fcntl = None
+
+# -------------------------------------------------------------------------
+#                            Shared snapshots
+# -------------------------------------------------------------------------
+
+
+class SnapshotStore:
+    """
+    Directory of versioned Arrow IPC files shared by the processes serving the app (e.g. gunicorn workers).
+
+    One process, the loader, holds a lock on the directory: it fetches the sources and writes a file per
+    source and version with 'write'. The other processes read the current version of each source with
+    'read', which memory-maps the file: the operating system shares its pages between the processes instead
+    of each one holding a copy, and numeric columns without missing values are used in place.
+    """
+
+    def __init__(self, directory, keep=2):
+        """
+        Parameters:
+            - directory (str): directory holding the snapshots
+            - keep (int): number of versions of each source kept on disk
+        """
+
+        self.directory = directory
+        self.keep = keep
+        self._lock_file = None
+        self._write_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def acquire_leadership(self):
+        """
+        Tries to become the process loading the data. The lock is released when the process exits, so
+        another process can take over.
+
+        Returns:
+            True if this process is (or just became) the loader
+        """
+
+        if self._lock_file is not None:
+            return True
+        if fcntl is None:
+            self._lock_file = True
+            return True
+
+        lock_file = open(os.path.join(self.directory, "loader.lock"), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def release(self):
+        """
+        Stops being the process loading the data, so another loader (e.g. the next loader of an evicted user in
+        this process) can take over without waiting for this one to be garbage collected.
+        """
+
+        if self._lock_file not in (None, True):
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+        self._lock_file = None
+
+    def _path(self, name, version):
+        return os.path.join(self.directory, f"{name}-{version}.arrow")
+
+    def _pointer(self, name):
+        return os.path.join(self.directory, f"{name}.current")
+
+    def write(self, name, data, version):
+        """
+        Writes a version of a source and makes it the current one.
+
+        Parameters:
+            - name (str): name of the source
+            - data (pandas.DataFrame): data of the source
+            - version (str): version of the data (see 'loader.data_version')
+        """
+
+        with self._write_lock:
+            # Write the file, then the pointer to it, each to a temporary file renamed into place so readers
+            # never see a partial file
+            path = self._path(name, version)
+            if not os.path.exists(path):
+                table = pa.Table.from_pandas(data, preserve_index=True)
+                with pa.OSFile(f"{path}.tmp", "wb") as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+                os.replace(f"{path}.tmp", path)
+
+            pointer = self._pointer(name)
+            with open(f"{pointer}.tmp", "w", encoding="utf-8") as f:
+                f.write(version)
+            os.replace(f"{pointer}.tmp", pointer)
+
+            # Remove the oldest versions (processes still reading them keep their mapping)
+            paths = sorted(glob.glob(self._path(name, "*")), key=os.path.getmtime, reverse=True)
+            for old_path in [p for p in paths if p != path][self.keep - 1:]:
+                os.remove(old_path)
+
+    def current_version(self, name):
+        """
+        Returns the current version of a source, or None if it was never written.
+        """
+
+        try:
+            with open(self._pointer(name), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def read(self, name, version):
+        """
+        Returns a version of a source as a dataframe backed by the memory-mapped file.
+
+        Parameters:
+            - name (str): name of the source
+            - version (str): version to read (see 'current_version')
+
+        Returns:
+            A pandas.DataFrame, with the index it was written with
+        """
+
+        with pa.memory_map(self._path(name, version)) as source:
+            table = pa.ipc.open_file(source).read_all()
+        return table.to_pandas(split_blocks=True)
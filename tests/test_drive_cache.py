@@ -0,0 +1,154 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import json
+import os
+import pytest
+from drive_cache import DriveCache, METADATA_FIELDS
+
+# -------------------------------------------------------------------------
+#                              Fake Drive client
+# -------------------------------------------------------------------------
+
+
+class FakeFile(dict):
+    """
+    PyDrive2-like file: 'FetchMetadata' copies the metadata of the Drive file and 'GetContentFile' writes its content.
+    """
+
+    def __init__(self, drive, file_id):
+        super().__init__(id=file_id)
+        self.drive = drive
+
+    def FetchMetadata(self, fields=None):
+        self.drive.metadata_calls.append(fields)
+        if self.drive.offline:
+            raise ConnectionError("Drive can't be reached")
+        self.update(self.drive.files[self["id"]]["metadata"])
+
+    def GetContentFile(self, filename):
+        self.drive.downloads.append(self["id"])
+
+        # A download interrupted halfway leaves part of the content in the file
+        content = self.drive.files[self["id"]]["content"]
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(content[:len(content) // 2] if self.drive.interrupt else content)
+        if self.drive.interrupt:
+            raise ConnectionError("Download interrupted")
+
+
+class FakeDrive:
+    """
+    Replaces the Google Drive client: serves files held in memory by file id, and records the calls.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.metadata_calls = []
+        self.downloads = []
+        self.offline = False
+        self.interrupt = False
+
+    def put(self, file_id, content, md5, modified="2024-01-01T00:00:00.000Z"):
+        self.files[file_id] = {"content": content, "metadata": {"md5Checksum": md5, "modifiedDate": modified}}
+
+    def CreateFile(self, metadata):
+        return FakeFile(self, metadata["id"])
+
+
+@pytest.fixture
+def drive():
+    drive = FakeDrive()
+    drive.put("run-id", "Date,Distance\n2024-01-01,10\n", md5="md5-1")
+    return drive
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "run.csv"), str(tmp_path / "drive_manifest.json")
+
+# -------------------------------------------------------------------------
+#                                   Tests
+# -------------------------------------------------------------------------
+
+
+def test_first_fetch_downloads_and_records_metadata(drive, paths):
+    path, manifest_path = paths
+    assert DriveCache(client=drive, manifest_path=manifest_path).fetch("run-id", path) is True
+
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == drive.files["run-id"]["content"]
+
+    # Only the md5 checksum and modification date are requested, and both are kept in the manifest
+    assert drive.metadata_calls == [",".join(METADATA_FIELDS)]
+    with open(manifest_path, encoding="utf-8") as f:
+        assert json.load(f) == {path: {"id": "run-id", "md5Checksum": "md5-1",
+                                       "modifiedDate": "2024-01-01T00:00:00.000Z"}}
+
+
+def test_up_to_date_file_is_not_downloaded_again(drive, paths):
+    path, manifest_path = paths
+    DriveCache(client=drive, manifest_path=manifest_path).fetch("run-id", path)
+
+    # A new cache reads the manifest written by the first one
+    assert DriveCache(client=drive, manifest_path=manifest_path).fetch("run-id", path) is False
+    assert drive.downloads == ["run-id"]
+
+
+@pytest.mark.parametrize("change", [{"md5": "md5-2"}, {"md5": "md5-1", "modified": "2024-02-01T00:00:00.000Z"}])
+def test_changed_file_is_downloaded_again(drive, paths, change):
+    path, manifest_path = paths
+    cache = DriveCache(client=drive, manifest_path=manifest_path)
+    cache.fetch("run-id", path)
+
+    drive.put("run-id", "Date,Distance\n2024-02-01,12\n", **change)
+    assert cache.fetch("run-id", path) is True
+    assert drive.downloads == ["run-id", "run-id"]
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == "Date,Distance\n2024-02-01,12\n"
+
+
+def test_missing_local_file_is_downloaded_again(drive, paths):
+    path, manifest_path = paths
+    cache = DriveCache(client=drive, manifest_path=manifest_path)
+    cache.fetch("run-id", path)
+
+    os.remove(path)
+    assert cache.fetch("run-id", path) is True
+
+
+def test_interrupted_download_keeps_previous_file(drive, paths):
+    path, manifest_path = paths
+    cache = DriveCache(client=drive, manifest_path=manifest_path)
+    cache.fetch("run-id", path)
+    previous = drive.files["run-id"]["content"]
+
+    drive.put("run-id", "Date,Distance\n2024-02-01,12\n2024-02-02,8\n", md5="md5-2")
+    drive.interrupt = True
+    with pytest.raises(ConnectionError):
+        cache.fetch("run-id", path)
+
+    # The partial download is removed, readers still see the previous file and it isn't marked as up to date
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == previous
+    assert sorted(os.listdir(os.path.dirname(path))) == sorted(os.path.basename(p) for p in paths)
+    drive.interrupt = False
+    assert cache.fetch("run-id", path) is True
+
+
+def test_offline_drive_uses_local_copy(drive, paths):
+    path, manifest_path = paths
+    DriveCache(client=drive, manifest_path=manifest_path).fetch("run-id", path)
+
+    drive.offline = True
+    assert DriveCache(client=drive, manifest_path=manifest_path).fetch("run-id", path) is False
+    assert drive.downloads == ["run-id"]
+
+
+def test_offline_drive_raises_without_local_copy(drive, paths):
+    path, manifest_path = paths
+    drive.offline = True
+
+    with pytest.raises(ConnectionError):
+        DriveCache(client=drive, manifest_path=manifest_path).fetch("run-id", path)
+    assert not os.path.exists(path)
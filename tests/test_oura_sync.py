@@ -0,0 +1,162 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import json
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+import pytest
+import requests
+import oura_sync
+
+# Number of documents per page returned by the stub server
+PAGE_SIZE = 3
+
+# -------------------------------------------------------------------------
+#                               Stub Oura API
+# -------------------------------------------------------------------------
+
+
+# Define a function that builds the sleep document of a day
+def make_document(day, hrv=50):
+    return {"id": f"{day}-long_sleep", "day": day, "type": "long_sleep", "average_hrv": hrv,
+            "lowest_heart_rate": 48, "total_sleep_duration": 27000, "deep_sleep_duration": 4500,
+            "rem_sleep_duration": 5400, "hrv": {"interval": 300.0, "items": [hrv, None], "timestamp": f"{day}T23:00:00"},
+            "heart_rate": {"interval": 300.0, "items": [50, 49], "timestamp": f"{day}T23:00:00"},
+            "sleep_phase_5_min": "12", "movement_30_sec": "11", "readiness": {"score": 80}}
+
+
+class StubOura:
+    """
+    Local HTTP server answering like Oura's sleep endpoint: the documents between "start_date" and "end_date",
+    PAGE_SIZE at a time, with a "next_token" while pages are left. Every request is recorded in 'calls', and
+    the server answers 401 while 'fail' is True.
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.calls = []
+        self.fail = False
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                stub.calls.append({"authorization": self.headers["Authorization"], **query})
+                if stub.fail:
+                    self.send_response(401)
+                    self.end_headers()
+                    return
+
+                rows = [d for d in stub.documents if query["start_date"] <= d["day"] <= query["end_date"]]
+                offset = int(query.get("next_token", 0))
+                next_token = str(offset + PAGE_SIZE) if offset + PAGE_SIZE < len(rows) else None
+                body = json.dumps({"data": rows[offset:offset + PAGE_SIZE], "next_token": next_token}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v2/usercollection/sleep"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def stub():
+    days = [(datetime.date(2021, 6, 11) + datetime.timedelta(days=i)).isoformat() for i in range(10)]
+    server = StubOura([make_document(day) for day in days])
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+# -------------------------------------------------------------------------
+#                                   Tests
+# -------------------------------------------------------------------------
+
+
+def test_fetch_sleep_follows_next_token(stub):
+    documents = oura_sync.fetch_sleep("token", "2021-06-11", "2021-06-20", url=stub.url)
+
+    # 10 documents, 3 per page: 4 requests, each one after the first sends the token of the previous page
+    assert [d["day"] for d in documents] == [d["day"] for d in stub.documents]
+    assert [call.get("next_token") for call in stub.calls] == [None, "3", "6", "9"]
+    assert all(call["start_date"] == "2021-06-11" and call["end_date"] == "2021-06-20" for call in stub.calls)
+    assert all(call["authorization"] == "Bearer token" for call in stub.calls)
+
+
+def test_fetch_sleep_single_page(stub):
+    documents = oura_sync.fetch_sleep("token", "2021-06-11", "2021-06-12", url=stub.url)
+
+    assert len(documents) == 2
+    assert len(stub.calls) == 1
+
+
+def test_sync_sleep_stores_every_page(stub, tmp_path):
+    db_path = str(tmp_path / "oura.sqlite")
+    rows = oura_sync.sync_sleep("token", db_path=db_path, url=stub.url, today=datetime.date(2021, 6, 20))
+
+    assert len(rows) == 10
+    assert list(rows.columns) == list(oura_sync.SLEEP_COLUMNS)
+    assert stub.calls[0]["start_date"] == oura_sync.FIRST_DAY
+
+    # The series are stored apart and read back one night at a time
+    night = oura_sync.read_series("2021-06-15", db_path)
+    assert night[0]["hrv"]["items"] == [50, None]
+
+
+def test_sync_sleep_fetches_from_last_day(stub, tmp_path):
+    db_path = str(tmp_path / "oura.sqlite")
+    oura_sync.sync_sleep("token", db_path=db_path, url=stub.url, today=datetime.date(2021, 6, 15))
+
+    # The night of the last synced day is updated and the following nights are added
+    stub.documents[4] = make_document("2021-06-15", hrv=70)
+    stub.calls.clear()
+    rows = oura_sync.sync_sleep("token", db_path=db_path, url=stub.url, today=datetime.date(2021, 6, 20))
+
+    assert stub.calls[0]["start_date"] == "2021-06-15"
+    assert len(rows) == 10
+    assert rows.loc[rows["day"] == "2021-06-15", "average_hrv"].item() == 70
+
+
+def test_sync_sleep_falls_back_to_store(stub, tmp_path):
+    db_path = str(tmp_path / "oura.sqlite")
+    synced = oura_sync.sync_sleep("token", db_path=db_path, url=stub.url, today=datetime.date(2021, 6, 20))
+
+    # The API rejects the token: the rows synced before are returned
+    stub.fail = True
+    rows = oura_sync.sync_sleep("token", db_path=db_path, url=stub.url, today=datetime.date(2021, 6, 21))
+
+    assert rows.equals(synced)
+
+
+def test_sync_sleep_falls_back_when_unreachable(stub, tmp_path):
+    db_path = str(tmp_path / "oura.sqlite")
+    synced = oura_sync.sync_sleep("token", db_path=db_path, url=stub.url, today=datetime.date(2021, 6, 20))
+
+    # Nothing listens on the port anymore
+    stub.server.shutdown()
+    stub.server.server_close()
+    rows = oura_sync.sync_sleep("token", db_path=db_path, url=stub.url, today=datetime.date(2021, 6, 21))
+
+    assert rows.equals(synced)
+
+
+def test_first_sync_raises(stub, tmp_path):
+    db_path = str(tmp_path / "oura.sqlite")
+    stub.fail = True
+
+    # There is no store to fall back to before the first sync
+    with pytest.raises(requests.HTTPError):
+        oura_sync.sync_sleep("token", db_path=db_path, url=stub.url, today=datetime.date(2021, 6, 20))
+
+    # The failed sync doesn't count as a sync: the next one starts from the first day again
+    stub.fail = False
+    stub.calls.clear()
+    rows = oura_sync.sync_sleep("token", db_path=db_path, url=stub.url, today=datetime.date(2021, 6, 20))
+    assert stub.calls[0]["start_date"] == oura_sync.FIRST_DAY
+    assert len(rows) == 10
@@ -0,0 +1,188 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Number of nanoseconds in a day, x values are fitted as a number of days
+NS_PER_DAY = 86400 * 10**9
+
+# -------------------------------------------------------------------------
+#                            Linear trend lines
+# -------------------------------------------------------------------------
+
+
+# Define a function that converts dates to a number of days
+def to_days(dates):
+    """
+    Returns the dates as a float array of days since 1970-01-01, the x values used for the fits.
+    """
+
+    # Dates can be stored in seconds, milliseconds... (pandas >= 2), count them in nanoseconds
+    return pd.DatetimeIndex(dates).as_unit("ns").asi8 / NS_PER_DAY
+
+
+# Define a function that computes a least squares line from the sums of its points
+def _line_from_sums(n, sx, sy, sxy, sxx):
+    # Not enough points (or all points on the same day) to fit a line
+    denominator = n * sxx - sx * sx
+    if n < 2 or denominator <= 0:
+        return None
+
+    slope = (n * sxy - sx * sy) / denominator
+    intercept = (sy - slope * sx) / n
+    return slope, intercept
+
+
+# Define a function that fits a line to a set of points
+def fit_line(dates, values):
+    """
+    Fits an ordinary least squares line to the points using the closed-form solution. Points with a
+    missing value are ignored.
+
+    Parameters:
+        - dates (array-like of datetime): x values of the points
+        - values (array-like of float): y values of the points
+
+    Returns:
+        (slope, intercept) of the line with x in days (see 'to_days'), or None if there are less than 2 points
+    """
+
+    x = to_days(dates)
+    y = np.asarray(values, dtype="float64")
+    valid = ~np.isnan(y)
+    x, y = x[valid], y[valid]
+    if len(x) < 2:
+        return None
+
+    # Center x values to keep the sums small and precise, then move the intercept back to x = 0
+    origin = x.mean()
+    x = x - origin
+    line = _line_from_sums(len(x), x.sum(), y.sum(), (x * y).sum(), (x * x).sum())
+    if line is None:
+        return None
+    slope, intercept = line
+    return slope, intercept - slope * origin
+
+
+class TrendIndex:
+    """
+    Prefix sums (Σx, Σy, Σxy, Σx²) of a metric sorted by date, so the least squares line of any date range
+    is computed in O(1) once the range is located with a binary search.
+    """
+
+    def __init__(self, dates, values):
+        """
+        Parameters:
+            - dates (array-like of datetime): dates of the metric, sorted in ascending order
+            - values (array-like of float): values of the metric, missing values are ignored
+        """
+
+        self.days = pd.DatetimeIndex(dates).normalize()
+        y = np.asarray(values, dtype="float64")
+
+        # x values are counted from the first date to keep the sums small and precise
+        x = to_days(dates)
+        self._origin = x[0] if len(x) else 0
+        x = x - self._origin
+
+        # Missing values don't contribute to the sums
+        valid = ~np.isnan(y)
+        x = np.where(valid, x, 0)
+        y = np.where(valid, y, 0)
+
+        # Prefix sums starting with 0 so the sums of rows [i, j) are prefix[j] - prefix[i]
+        self._prefix = np.zeros((5, len(y) + 1))
+        for row, terms in enumerate([valid.astype("float64"), x, y, x * y, x * x]):
+            np.cumsum(terms, out=self._prefix[row, 1:])
+
+    def fit(self, start_date, end_date):
+        """
+        Returns the least squares line of the points between start_date and end_date (both included).
+
+        Parameters:
+            - start_date (str or datetime): start of the date range
+            - end_date (str or datetime): end of the date range
+
+        Returns:
+            (slope, intercept) of the line with x in days (see 'to_days'), or None if there are less than 2 points
+        """
+
+        start = self.days.searchsorted(pd.Timestamp(start_date).normalize(), side="left")
+        end = self.days.searchsorted(pd.Timestamp(end_date).normalize(), side="right")
+        n, sx, sy, sxy, sxx = self._prefix[:, end] - self._prefix[:, start]
+        line = _line_from_sums(round(n), sx, sy, sxy, sxx)
+        if line is None:
+            return None
+
+        # Move the intercept back to x = 0 (1970-01-01)
+        slope, intercept = line
+        return slope, intercept - slope * self._origin
+
+    def prefix_sums(self):
+        """
+        Returns what 'fit' uses, e.g. to fit the lines of date ranges in the browser.
+
+        Returns:
+            (days, origin, prefix): the normalized dates of the points, the x value (in days, see 'to_days')
+            the x values are counted from, and the prefix sums of n, x, y, xy and x² (one row per sum,
+            starting with 0)
+        """
+
+        return self.days, self._origin, self._prefix
+
+# -------------------------------------------------------------------------
+#                                Smoothing
+# -------------------------------------------------------------------------
+
+
+# Define a function that smooths a metric
+def smooth(dates, values, method="rolling", window=15):
+    """
+    Returns a smoothed version of the metric, to draw a curve instead of a straight trend line.
+
+    Parameters:
+        - dates (array-like of datetime): dates of the metric, sorted in ascending order
+        - values (array-like of float): values of the metric
+        - method (str): "rolling" for a centered rolling mean, "loess" for a local linear regression
+                        weighted with a tricube kernel (LOESS-style)
+        - window (int): number of points used around each point
+
+    Returns:
+        A NumPy array with the smoothed value of each point
+    """
+
+    y = np.asarray(values, dtype="float64")
+    if method == "rolling":
+        return pd.Series(y).rolling(window, center=True, min_periods=1).mean().to_numpy()
+    if method != "loess":
+        raise ValueError(f"Unknown smoothing method: {method}")
+
+    x = to_days(dates)
+    n = len(y)
+    window = min(window, n)
+    if window < 2:
+        return y.copy()
+
+    # Window of each point: the 'window' closest positions, shifted inside the array at both ends
+    starts = np.clip(np.arange(n) - window // 2, 0, n - window)
+    xw = sliding_window_view(x, window)[starts]
+    yw = sliding_window_view(y, window)[starts]
+
+    # Tricube weights based on the distance to the point, missing values get no weight
+    distance = np.abs(xw - x[:, None])
+    max_distance = distance.max(axis=1, keepdims=True)
+    max_distance[max_distance == 0] = 1
+    weights = (1 - (distance / (max_distance * 1.0001)) ** 3) ** 3
+    weights[np.isnan(yw)] = 0
+    yw = np.nan_to_num(yw)
+
+    # Weighted least squares line of each window, evaluated at the point
+    xw = xw - x[:, None]
+    sw, swx, swy = weights.sum(1), (weights * xw).sum(1), (weights * yw).sum(1)
+    swxx, swxy = (weights * xw * xw).sum(1), (weights * xw * yw).sum(1)
+    denominator = sw * swxx - swx * swx
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(denominator > 0, (sw * swxy - swx * swy) / denominator, 0)
+        return (swy - slope * swx) / sw
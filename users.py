@@ -0,0 +1,114 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# User whose data is displayed when the app is not configured for several users
+DEFAULT_USER = "default"
+
+# -------------------------------------------------------------------------
+#                                  Users
+# -------------------------------------------------------------------------
+
+
+# Define a function that returns the settings of every user
+def user_settings(creds, vo2_file_id, nike_km):
+    """
+    Returns the settings of each user from the credentials module. Several users are configured with a
+    'users' dict in creds, keyed by user name:
+
+        users = {"alice": {"api_key": "...", "file_id": "...", "vo2_file_id": "...", "nike_km": 0}, ...}
+
+    Without it, the app displays the data of a single user configured with 'creds.api_key' and
+    'creds.file_id', stored in the working directory as before.
+
+    Parameters:
+        - creds (module): the credentials module
+        - vo2_file_id (str): Drive id of the VO2 max export of the single user
+        - nike_km (float): km run with Nike Run Club by the single user
+
+    Returns:
+        A dict of settings (api_key, file_id, vo2_file_id, nike_km, data_dir) keyed by user name
+    """
+
+    if not hasattr(creds, "users"):
+        return {DEFAULT_USER: dict(api_key=creds.api_key, file_id=creds.file_id, vo2_file_id=vo2_file_id,
+                                   nike_km=nike_km, data_dir=".")}
+
+    # Each user's files (Oura store, Drive exports, snapshots) are kept in their own directory
+    return {user: {"nike_km": 0, **settings, "data_dir": os.path.join("users", user)}
+            for user, settings in creds.users.items()}
+
+
+class UserData:
+    """
+    Data loaders of the users, created the first time a user's data is requested.
+
+    Loaders are kept in least recently used order: when the data of the loaded users takes more than
+    'max_bytes', or more than 'max_users' users are loaded, the users who haven't requested anything for
+    the longest time are evicted (their data is loaded again on their next request). Creating a loader only
+    starts loading in the background, so users never wait for each other's data.
+    """
+
+    def __init__(self, create, max_bytes=512 * 2**20, max_users=16, on_evict=None):
+        """
+        Parameters:
+            - create (callable): function returning a new 'loader.DataLoader' for a user name
+            - max_bytes (int): memory allowed for the data of the loaded users
+            - max_users (int): maximum number of loaded users
+            - on_evict (callable): function called with the user name when a user is evicted
+        """
+
+        self.max_bytes = max_bytes
+        self.max_users = max_users
+        self._create = create
+        self._on_evict = on_evict
+        self._loaders = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        """
+        Returns the data loader of a user, creating it (and evicting idle users) if it isn't loaded.
+        """
+
+        with self._lock:
+            loader = self._loaders.get(user)
+            if loader is not None:
+                self._loaders.move_to_end(user)
+            else:
+                logger.info("Loading the data of %s", user)
+                loader = self._loaders[user] = self._create(user)
+
+            # Data grows as it is loaded, so check the limits on every request
+            evicted = self._evict()
+
+        for user, old_loader in evicted:
+            old_loader.close()
+            if self._on_evict is not None:
+                self._on_evict(user)
+        return loader
+
+    def _evict(self):
+        # Evict the least recently used users, never the one that was just requested
+        evicted = []
+        sizes = {user: loader.memory_usage() for user, loader in self._loaders.items()}
+        while len(self._loaders) > 1 and (len(self._loaders) > self.max_users
+                                          or sum(sizes.values()) > self.max_bytes):
+            user, loader = self._loaders.popitem(last=False)
+            del sizes[user]
+            logger.info("Evicting the data of %s", user)
+            evicted.append((user, loader))
+        return evicted
+
+    def stats(self):
+        """
+        Returns the loaded users (least recently used first) and the memory used by their data.
+        """
+
+        with self._lock:
+            return {user: loader.memory_usage() for user, loader in self._loaders.items()}
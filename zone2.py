@@ -0,0 +1,105 @@
+# -------------------------------------------------------------------------
+#                                  Imports
+# -------------------------------------------------------------------------
+import numpy as np
+import pandas as pd
+
+# Robust z-score above which a run is an outlier (Iglewicz and Hoaglin's rule for MAD-based scores)
+OUTLIER_SCORE = 3.5
+
+# Scaling of the median absolute deviation so scores match z-scores for normally distributed data
+MAD_SCALE = 0.6745
+
+# Runs around each run used by the rolling outlier rule
+ROLLING_WINDOW = "90D"
+
+# -------------------------------------------------------------------------
+#                          Zone 2 performance
+# -------------------------------------------------------------------------
+
+
+# Define a function that computes the robust z-score of values from their median and median absolute deviation
+def _robust_score(values, median, mad):
+    # Values can't be told apart when most of them are equal (no deviation): none of them is an outlier
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = MAD_SCALE * (values - median) / mad
+    return np.where(mad > 0, scores, np.where(np.isnan(values), np.nan, 0))
+
+
+# Define a function that scores each value against every value
+def robust_scores(values):
+    """
+    Returns the robust z-score of each value: its distance to the median in median absolute deviations (MAD),
+    scaled like a z-score. Unlike z-scores, the median and the MAD aren't pulled by the outliers themselves.
+
+    Parameters:
+        - values (array-like of float): the values, missing values get a missing score
+
+    Returns:
+        A NumPy array with the score of each value
+    """
+
+    values = np.asarray(values, dtype="float64")
+    if np.isnan(values).all():
+        return np.full(len(values), np.nan)
+    median = np.nanmedian(values)
+    return _robust_score(values, median, np.nanmedian(np.abs(values - median)))
+
+
+# Define a function that scores each value against the values around it
+def rolling_robust_scores(dates, values, window=ROLLING_WINDOW):
+    """
+    Returns the robust z-score of each value against the values of the window of time centered on it (see
+    'robust_scores'). The score of a run doesn't depend on the date range displayed, and it follows the
+    progression over the years instead of comparing recent runs to the first ones. The MAD of the window is
+    the rolling median of the deviations of each value from the median of its own window, so both medians are
+    computed by pandas' rolling median instead of one Python call per value.
+
+    Parameters:
+        - dates (array-like of datetime): dates of the values, sorted in ascending order
+        - values (array-like of float): the values
+        - window (str): length of the window (pandas offset, e.g. "90D")
+
+    Returns:
+        A NumPy array with the score of each value
+    """
+
+    series = pd.Series(np.asarray(values, dtype="float64"), index=pd.DatetimeIndex(dates))
+    median = series.rolling(window, center=True, min_periods=1).median()
+    mad = (series - median).abs().rolling(window, center=True, min_periods=1).median()
+    return _robust_score(series.to_numpy(), median.to_numpy(), mad.to_numpy())
+
+
+# Define a function that adds the Zone 2 metrics to the runs
+def add_zone2_metrics(run, window=ROLLING_WINDOW):
+    """
+    Adds the metrics of the Zone 2 graph to the runs, computed once per version of the data so the graph only
+    slices them:
+        - "pace(km/h)": average speed of the run
+        - "Performance": speed divided by the average heart rate
+        - "Performance_score": robust z-score of the performance against every run
+        - "Performance_rolling_score": robust z-score against the runs of the window around the run
+
+    Parameters:
+        - run (pandas.DataFrame): the runs, sorted by "day" (see 'apple_health.read_runs')
+        - window (str): window of the rolling scores (pandas offset)
+
+    Returns:
+        The dataframe with the new float32 columns
+    """
+
+    distance = run["Distance(km)"].to_numpy(dtype="float64")
+    duration = run["Duration(s)"].to_numpy(dtype="float64")
+    heart_rate = run["Heart rate: Average(count/min)"].to_numpy(dtype="float64")
+
+    # Runs without a duration or heart rate have no performance
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pace = np.where(duration > 0, distance * 3600 / duration, np.nan)
+        performance = np.where(heart_rate > 0, pace / heart_rate, np.nan)
+
+    return run.assign(**{
+        "pace(km/h)": pace.astype("float32"),
+        "Performance": performance.astype("float32"),
+        "Performance_score": robust_scores(performance).astype("float32"),
+        "Performance_rolling_score": rolling_robust_scores(run["day"], performance, window).astype("float32")
+    })